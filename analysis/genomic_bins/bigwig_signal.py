@@ -0,0 +1,98 @@
+"""Compute the mean bigWig signal of many bins reading the intervals of each chromosome once"""
+
+import numpy as np
+
+
+def coverage_weighted_mean(intervals, starts, ends):
+    """Mean signal of the covered bases of each bin [start, end) given the sorted non-overlapping bigWig intervals
+    of a chromosome (array of start, end, value rows). Bins without covered bases are NaN"""
+
+    iv_starts = intervals[:, 0]
+    iv_ends = intervals[:, 1]
+    iv_values = intervals[:, 2]
+    lengths = iv_ends - iv_starts
+    cum_bases = np.concatenate([[0.0], np.cumsum(lengths)])
+    cum_signal = np.concatenate([[0.0], np.cumsum(lengths * iv_values)])
+
+    def upstream(coordinates):
+        """Covered bases and summed signal upstream of each coordinate"""
+        closed = np.searchsorted(iv_ends, coordinates, side='right')    # intervals ending at or before coordinate
+        bases = cum_bases[closed].copy()
+        signal = cum_signal[closed].copy()
+        # Add the part of the interval spanning the coordinate, if any
+        spanning = np.minimum(closed, len(iv_starts) - 1)
+        partial = np.where(
+            (closed < len(iv_starts)) & (iv_starts[spanning] < coordinates), coordinates - iv_starts[spanning], 0)
+        bases += partial
+        signal += partial * iv_values[spanning]
+        return bases, signal
+
+    start_bases, start_signal = upstream(starts)
+    end_bases, end_signal = upstream(ends)
+    bases = end_bases - start_bases
+    signal = end_signal - start_signal
+
+    mean = np.full(len(starts), np.nan)
+    covered = bases > 0
+    mean[covered] = signal[covered] / bases[covered]
+
+    return mean
+
+
+def bins_mean_signal(bw, chromosomes, starts, ends):
+    """Mean signal of each bin in an open pyBigWig file, equivalent to bw.stats(chrom, start, end, type='mean',
+    exact=True) for every bin.
+
+    Returns an array with the mean signal per bin (NaN when the bin has no data) and a boolean array marking bins
+    that bw.stats cannot query (chromosome missing in the file or bin outside the chromosome bounds)
+    """
+
+    chromosomes = np.asarray(chromosomes, dtype=object)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    mean = np.full(len(starts), np.nan)
+    errors = np.ones(len(starts), dtype=bool)
+
+    chrom_sizes = bw.chroms()
+    for chrom in np.unique(chromosomes):
+        if chrom not in chrom_sizes:
+            continue
+        rows = np.flatnonzero(chromosomes == chrom)
+        valid = (starts[rows] >= 0) & (starts[rows] < ends[rows]) & (ends[rows] <= chrom_sizes[chrom])
+        rows = rows[valid]
+        errors[rows] = False
+
+        # Read all the intervals of the chromosome at once
+        intervals = bw.intervals(chrom)
+        if not intervals:
+            continue
+        intervals = np.array(intervals, dtype=np.float64)
+        mean[rows] = coverage_weighted_mean(intervals, starts[rows], ends[rows])
+
+    return mean, errors
+
+
+class BatchStats:
+    """Mean signal of the bins of a dataframe (CHR, START, END columns) computed at once, queried by bin position
+    with the same output as bw.stats(chrom, start, end, type='mean')"""
+
+    def __init__(self, bw, bins_df):
+        self.mean, self.errors = bins_mean_signal(bw, bins_df['CHR'].values, bins_df['START'].values, bins_df['END'].values)
+
+    @classmethod
+    def from_signal(cls, mean, errors):
+        """Query precomputed mean signal and error arrays (e.g., from signal_cache.SignalCache)"""
+
+        batch_stats = cls.__new__(cls)
+        batch_stats.mean, batch_stats.errors = mean, errors
+
+        return batch_stats
+
+    def stats(self, i):
+        """Mean signal of the i-th bin as a list, None when there is no data"""
+
+        if self.errors[i]:
+            raise RuntimeError('Invalid interval bounds!')
+        mean = self.mean[i]
+
+        return [None] if np.isnan(mean) else [float(mean)]
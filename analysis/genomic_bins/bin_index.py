@@ -0,0 +1,110 @@
+"""Assign genomic positions to bins using per chromosome sorted arrays of bin coordinates"""
+
+import numpy as np
+
+
+def parse_binid(binid):
+    """Split a bin identifier (e.g., "chr1:0-1000000") into chromosome (without "chr"), start and end"""
+
+    chrom, start_end = binid.split(':')
+    start, end = start_end.split('-')
+
+    return chrom[3:], int(start), int(end)
+
+
+class BinIndex:
+    """Index of genomic bins stored as sorted start and end coordinates per chromosome.
+
+    Bins are queried as closed intervals [START, END] (END + 1 open end, as in the former IntervalTree
+    implementation), so a position at the boundary of two consecutive bins is assigned to both of them.
+    """
+
+    def __init__(self, chromosomes, starts, ends, binids):
+        self.binids = np.asarray(binids, dtype=object)
+        chromosomes = np.asarray(chromosomes, dtype=object)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64) + 1  # +1 open end
+
+        self._index = {}
+        for chrom in np.unique(chromosomes):
+            bins = np.flatnonzero(chromosomes == chrom)
+            bins = bins[np.lexsort((ends[bins], starts[bins]))]
+            # The running maximum of the end tells when no upstream bin can contain a position
+            self._index[chrom] = (starts[bins], ends[bins], np.maximum.accumulate(ends[bins]), bins)
+
+    @classmethod
+    def from_binids(cls, binids):
+        """Build the index from bin identifiers (e.g., "chr1:0-1000000")"""
+
+        binids = list(binids)
+        coordinates = [parse_binid(binid) for binid in binids]
+        chromosomes, starts, ends = zip(*coordinates) if coordinates else ([], [], [])
+
+        return cls(chromosomes, starts, ends, binids)
+
+    @classmethod
+    def from_bed(cls, bins_df):
+        """Build the index from a dataframe with CHR (e.g., "chr1"), START, END and BINID columns"""
+
+        chromosomes = [chrom[3:] for chrom in bins_df['CHR'].tolist()]
+
+        return cls(chromosomes, bins_df['START'].values, bins_df['END'].values, bins_df['BINID'].values)
+
+    def __len__(self):
+        return len(self.binids)
+
+    def query(self, chrom, positions):
+        """Find the bins overlapping each position in a chromosome.
+
+        Returns two arrays of equal length with the index of the position and the index of the bin of every
+        overlap, sorted by position index
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        if chrom not in self._index or len(positions) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        starts, ends, max_ends, bins = self._index[chrom]
+
+        # Last bin starting at or before each position
+        positions_idx = np.arange(len(positions))
+        candidates = np.searchsorted(starts, positions, side='right') - 1
+
+        # Walk upstream only while a previous bin can still overlap (at most once for non-overlapping bins)
+        hits_positions, hits_bins = [], []
+        while len(positions_idx) > 0:
+            keep = candidates >= 0
+            positions_idx, candidates = positions_idx[keep], candidates[keep]
+            keep = max_ends[candidates] > positions[positions_idx]
+            positions_idx, candidates = positions_idx[keep], candidates[keep]
+            hit = ends[candidates] > positions[positions_idx]
+            hits_positions.append(positions_idx[hit])
+            hits_bins.append(bins[candidates[hit]])
+            candidates = candidates - 1
+
+        hits_positions = np.concatenate(hits_positions)
+        hits_bins = np.concatenate(hits_bins)
+        order = np.argsort(hits_positions, kind='mergesort')
+
+        return hits_positions[order], hits_bins[order]
+
+    def assign(self, chromosomes, positions):
+        """Find the bins overlapping each (chromosome, position) pair.
+
+        Returns two arrays of equal length with the index of the pair and the index of the bin of every overlap,
+        sorted by pair index
+        """
+
+        chromosomes = np.asarray(chromosomes, dtype=object)
+        positions = np.asarray(positions, dtype=np.int64)
+
+        hits_rows, hits_bins = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int64)]
+        for chrom in np.unique(chromosomes):
+            rows = np.flatnonzero(chromosomes == chrom)
+            positions_idx, bins = self.query(chrom, positions[rows])
+            hits_rows.append(rows[positions_idx])
+            hits_bins.append(bins)
+        hits_rows = np.concatenate(hits_rows)
+        hits_bins = np.concatenate(hits_bins)
+        order = np.argsort(hits_rows, kind='mergesort')
+
+        return hits_rows[order], hits_bins[order]
@@ -1,46 +1,113 @@
-import os, sys
-os.environ["PATH"] = os.path.dirname(sys.executable) + os.pathsep + os.environ["PATH"]
+import os
 
 import click
+import numpy as np
 import pandas as pd
-import pybedtools
 
-CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+CHROMOSOMES = list(map(lambda x: f'chr{x}', list(range(1, 23)) + ['X', 'Y']))
+
+
+def load_mappable_genome(mappable_genome_f):
+    """Load mappable genome coordinates as sorted BED start and end arrays per chromosome"""
+
+    mappable_genome_df = pd.read_csv(
+        mappable_genome_f, sep='\t', header=0, usecols=['CHR', 'START', 'END'], dtype={'CHR': str}, low_memory=False)
+
+    intervals = {}
+    for chrom, data in mappable_genome_df.groupby('CHR', sort=False):
+        starts = np.sort(data['START'].values.astype(np.int64) - 1)    # BED format
+        ends = np.sort(data['END'].values.astype(np.int64))
+        # Cumulative sums allow computing the covered bp up to any coordinate in O(log n)
+        starts_cumsum = np.concatenate([[0], np.cumsum(starts)])
+        ends_cumsum = np.concatenate([[0], np.cumsum(ends)])
+        intervals[chrom] = (starts, starts_cumsum, ends, ends_cumsum)
+
+    return intervals
+
+
+def covered_bp(intervals, coordinates):
+    """For each BED coordinate, compute the bp of the intervals located upstream of it.
+
+    Each interval contributes min(coordinate, end) - start when start < coordinate, so the difference between the
+    values at the end and the start of a bin equals the sum of the overlaps of every interval with the bin
+    (same as the sum of the lengths reported by bedtools intersect)
+    """
+
+    starts, starts_cumsum, ends, ends_cumsum = intervals
+    opened = np.searchsorted(starts, coordinates, side='left')    # intervals starting before coordinate
+    closed = np.searchsorted(ends, coordinates, side='left')    # intervals ending before coordinate
+
+    return (opened * coordinates - starts_cumsum[opened]) - (closed * coordinates - ends_cumsum[closed])
+
+
+def bins_overlap(bins_df, intervals):
+    """Compute the bp overlapping the mappable genome for every bin in a chromosome"""
+
+    if intervals is None:
+        return np.zeros(len(bins_df), dtype=np.int64)
+    starts = bins_df['START'].values.astype(np.int64)
+    ends = bins_df['END'].values.astype(np.int64)
+
+    return covered_bp(intervals, ends) - covered_bp(intervals, starts)
+
+
+def load_bins(bins_f):
+    """Load bin coordinates and build bin identifiers"""
+
+    bins_df = pd.read_csv(bins_f, sep='\t', header=0, dtype={'CHR': str})
+    bins_df['CHR'] = 'chr' + bins_df['CHR']
+    bins_df['BINID'] = bins_df['CHR'] + ':' + bins_df['START'].astype(str) + '-' + bins_df['END'].astype(str)
+
+    return bins_df
+
+
+def bins_name(bins_f):
+    """Name of a set of bins from its file (e.g., hg38_1000kb_bin.bed.gz --> hg38_1000kb_bin)"""
+
+    name = os.path.basename(bins_f)
+    for extension in ['.gz', '.bed']:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+
+    return name
+
+
 @click.command()
-@click.option('-chr', '--chromosome', default=None, required=True)
-@click.option('-b', '--bins_f', default=None, required=True)
+@click.option('-chr', '--chromosome', default=None, multiple=True,
+              help='Chromosome to analyse (can be used multiple times). Default: all chromosomes')
+@click.option('-b', '--bins_f', default=None, required=True, multiple=True,
+              help='Bins file (can be used multiple times to analyse several bin sizes)')
 @click.option('-g', '--mappable_genome_f', default=None, required=True)
-@click.option('-o', '--output_f', default=None, required=True)
+@click.option('-o', '--output_f', default=None, required=True,
+              help='Output file. When several chromosomes or bin files are analysed, it must contain the '
+                   '{chromosome} and/or {bins} placeholders (e.g., data/{bins}.nodrivers.{chromosome}.bed.stats)')
 def main(chromosome, bins_f, mappable_genome_f, output_f):
-    """For a given chromosome and a bin, compute the fraction of the bin that overlaps with the mappable genome"""
-
-    # Read mappable genome coordinates and transform to BED
-    mappable_genome_df = pd.read_csv(mappable_genome_f, sep='\t', header=0, low_memory=False)
-    mappable_genome_df['START'] = mappable_genome_df.apply(lambda x: x['START'] - 1, axis=1)    # BED format
-    mappable_genome_df = mappable_genome_df.loc[mappable_genome_df['CHR'] == chromosome].copy()
-    mappable_genome_bed = pybedtools.BedTool.from_dataframe(mappable_genome_df)
-
-    # Read bin coordinates, subset the chromosome under analysis and intersect with the mappable genome
-    bins_df = pd.read_csv(bins_f, sep='\t', header=0)
-    bins_df['CHR'] = bins_df.apply(lambda x: 'chr' + str(x['CHR']), axis=1)
-    bins_df = bins_df.loc[bins_df['CHR'] == chromosome].copy()
-    bins_df['BINID'] = bins_df.apply(lambda x: f"{x['CHR']}:{x['START']}-{x['END']}", axis=1)    # bin identifiers
-    # Compute overlap for each bin in the chromosome
-    with open(output_f, 'w') as ofd:
-        ofd.write('{}\n'.format('\t'.join(['CHR', 'START', 'END', 'BINID', 'BP_OVERLAP'])))
-        for binid, data in bins_df.groupby('BINID'):
-            bin_bed = pybedtools.BedTool.from_dataframe(data)
-            map_bin_bed = bin_bed.intersect(mappable_genome_bed)    # overlap with mappable genome
-            # If there is overlap, write the number of bp overlapping the mappable genome
-            if len(map_bin_bed) > 0:
-                map_bin_df = pd.read_csv(map_bin_bed.fn, sep='\t', header=None)
-                map_bin_df.columns = ['CHR', 'START', 'END', 'BINID']
-                map_bin_df['LENGTH'] = map_bin_df.apply(lambda x: x['END'] - x['START'], axis=1)    # This is BED format
-                total_length = sum(map_bin_df['LENGTH'])
-                info = [data['CHR'].iloc[0], str(data['START'].iloc[0]), str(data['END'].iloc[0]), binid, str(total_length)]
-            else:
-                info = [data['CHR'].iloc[0], str(data['START'].iloc[0]), str(data['END'].iloc[0]), binid, '0']
-            ofd.write('{}\n'.format('\t'.join(info)))
+    """For each chromosome and set of bins, compute the bp of each bin that overlap with the mappable genome"""
+
+    chromosomes = list(chromosome) if chromosome else CHROMOSOMES
+    if len(chromosomes) > 1 and '{chromosome}' not in output_f:
+        raise click.BadParameter('missing {chromosome} placeholder to analyse several chromosomes', param_hint='output_f')
+    if len(bins_f) > 1 and '{bins}' not in output_f:
+        raise click.BadParameter('missing {bins} placeholder to analyse several bin files', param_hint='output_f')
+
+    # Read mappable genome coordinates once for all chromosomes and bin sizes
+    mappable_genome = load_mappable_genome(mappable_genome_f)
+
+    header = ['CHR', 'START', 'END', 'BINID', 'BP_OVERLAP']
+    for file in bins_f:
+        bins_df = load_bins(file)
+        for chrom in chromosomes:
+            # Subset the chromosome under analysis, sorted by bin identifier as in previous releases
+            chrom_bins_df = bins_df.loc[bins_df['CHR'] == chrom].drop_duplicates(subset='BINID')
+            chrom_bins_df = chrom_bins_df.sort_values(by='BINID', kind='mergesort')
+            overlap = bins_overlap(chrom_bins_df, mappable_genome.get(chrom))
+
+            # Compute overlap for each bin in the chromosome
+            with open(output_f.format(chromosome=chrom, bins=bins_name(file)), 'w') as ofd:
+                ofd.write('{}\n'.format('\t'.join(header)))
+                for row, total_length in zip(chrom_bins_df.itertuples(index=False), overlap):
+                    info = [row.CHR, str(row.START), str(row.END), row.BINID, str(total_length)]
+                    ofd.write('{}\n'.format('\t'.join(info)))
 
 
 if __name__ == '__main__':
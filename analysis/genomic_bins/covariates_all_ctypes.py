@@ -0,0 +1,162 @@
+"""Compute large-scale covariates (DNase, RNA and replication timing) for several cancer types at once"""
+
+import hashlib
+from multiprocessing import Pool
+import os
+
+import click
+import numpy as np
+import pandas as pd
+
+import dnase_ctype
+import replication_ctype
+import rna_ctype
+
+# Script and mark name (used in output files) for each experiment
+EXPERIMENTS = {
+    'dnase': (dnase_ctype, 'DNase'),
+    'rna': (rna_ctype, 'rna'),
+    'replication': (replication_ctype, 'RepliSeq'),
+}
+
+
+def cancer_classes(cov_f):
+    """Replication timing class (SOLID or NON_SOLID) of each cancer type, as in merge_largescale.py"""
+
+    covariates_df = pd.read_csv(cov_f, sep='\t', header=0)
+    cancer_class = {}
+    for _, row in covariates_df.iterrows():
+        if 'Helas3' in row['REPLICATION_EPIGENOME']:
+            cancer_class[row['CANCER_TYPE']] = 'SOLID'
+        else:
+            cancer_class[row['CANCER_TYPE']] = 'NON_SOLID'
+
+    return cancer_class
+
+
+def bins_checksum(bins_df):
+    """Identifier of a set of bins"""
+
+    return hashlib.md5(bins_df.to_csv(index=False).encode()).hexdigest()[:12]
+
+
+def save_checkpoint(checkpoint_f, values, failed):
+    """Save the signal per bin of an epigenome (written to a temporary file first so it is never left incomplete)"""
+
+    tmp_f = checkpoint_f + '.tmp.npz'
+    np.savez(tmp_f, values=values, failed=np.array(failed, dtype=str))
+    os.replace(tmp_f, checkpoint_f)
+
+
+def load_checkpoint(checkpoint_f):
+    """Load the signal per bin of an epigenome"""
+
+    with np.load(checkpoint_f) as data:
+        values = data['values']
+        failed = [tuple(map(str, error)) for error in data['failed']]
+
+    return values, failed
+
+
+def run_unit(unit):
+    """Compute the signal per bin of an epigenome, unless it is already saved from a previous run"""
+
+    experiment, epigenome, files, bins_f, checkpoint_f, batch, cache_dir = unit
+    if not os.path.exists(checkpoint_f):
+        module = EXPERIMENTS[experiment][0]
+        bins_df = module.load_bins(bins_f)
+        values, failed = module.epigenome_signal(files, bins_df, batch, cache_dir)
+        save_checkpoint(checkpoint_f, values, failed)
+
+    return experiment, epigenome
+
+
+@click.command()
+@click.option('--experiment', default=list(EXPERIMENTS), multiple=True, type=click.Choice(list(EXPERIMENTS)))
+@click.option('--cancer-type', default=None, multiple=True, type=str,
+              help='Cancer types to analyse (can be used multiple times). Default: all cancer types in cov_f')
+@click.option('--bins_f', default=None, required=True, type=str)
+@click.option('--cov_f', default=None, required=True, type=str)
+@click.option('--dnase_metadata_f', default=None, type=str)
+@click.option('--rna_metadata_f', default=None, type=str)
+@click.option('--dnase_url', default=None, type=str)
+@click.option('--rna_url', default=None, type=str)
+@click.option('--replication_url', default=None, type=str)
+@click.option('--output_f', default=None, required=True, type=str,
+              help='Output file with {experiment}, {mark} and {ctype} placeholders '
+                   '(e.g., large_scale_cov/{experiment}/{ctype}_hg38_1000kb_bin.{mark}.filtered.bed.gz)')
+@click.option('--checkpoint_dir', default=None, required=True, type=str,
+              help='Directory where the signal of each epigenome is saved, to resume interrupted runs')
+@click.option('--cores', default=1, type=int)
+@click.option('--batch', is_flag=True, default=False,
+              help='Read the intervals of each chromosome once per epigenome instead of querying each bin')
+@click.option('--cache_dir', default=None, type=str,
+              help='Read the signal from the cache built with signal_cache.py instead of the bigWig files')
+def main(experiment, cancer_type, bins_f, cov_f, dnase_metadata_f, rna_metadata_f, dnase_url, rna_url,
+         replication_url, output_f, checkpoint_dir, cores, batch, cache_dir):
+    """Get large-scale covariates for all cancer types, reading each epigenome bigWig once per set of bins"""
+
+    required = {
+        'dnase': [('dnase_metadata_f', dnase_metadata_f), ('dnase_url', dnase_url)],
+        'rna': [('rna_metadata_f', rna_metadata_f), ('rna_url', rna_url)],
+        'replication': [('replication_url', replication_url)]
+    }
+    for exp in experiment:
+        for name, value in required[exp]:
+            if value is None:
+                raise click.BadParameter(f'required to compute {exp} covariates', param_hint=name)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    cancer_class = cancer_classes(cov_f)
+    cancer_types = list(cancer_type) if cancer_type else list(cancer_class.keys())
+
+    # Epigenomes of each cancer type (cancer type class for replication timing)
+    epigenomes = {}
+    for exp in experiment:
+        if exp == 'dnase':
+            for ctype in cancer_types:
+                epigenomes[(exp, ctype)] = [(epi, dnase_ctype.epigenome_files(dnase_url, epi))
+                                            for epi in dnase_ctype.ctype_epigenomes(ctype, dnase_metadata_f, cov_f)]
+        elif exp == 'rna':
+            for ctype in cancer_types:
+                epigenomes[(exp, ctype)] = [(epi, rna_ctype.epigenome_files(rna_url, epi, rna_metadata_f))
+                                            for epi in rna_ctype.ctype_epigenomes(ctype, cov_f)]
+        else:
+            for ctype in sorted(set([cancer_class[c] for c in cancer_types])):
+                epigenomes[(exp, ctype)] = [(cell, replication_ctype.epigenome_files(replication_url, cell))
+                                            for cell in replication_ctype.ctype_epigenomes(ctype)]
+
+    # Unique work units: each epigenome file is read once for the set of bins
+    checksums = dict([(exp, bins_checksum(EXPERIMENTS[exp][0].load_bins(bins_f))) for exp in experiment])
+    units = {}
+    for (exp, _), data in epigenomes.items():
+        for epi, files in data:
+            checkpoint_f = os.path.join(checkpoint_dir, f'{exp}.{epi}.{checksums[exp]}.npz')
+            units[(exp, epi)] = (exp, epi, files, bins_f, checkpoint_f, batch, cache_dir)
+    pending = [unit for unit in units.values() if not os.path.exists(unit[4])]
+    print(f'Epigenomes to compute: {len(pending)} (already computed: {len(units) - len(pending)})')
+
+    # Run
+    if cores > 1:
+        with Pool(cores) as pool:
+            for exp, epi in pool.imap_unordered(run_unit, pending):
+                print(f'{exp}\t{epi}\tdone')
+    else:
+        for unit in pending:
+            exp, epi = run_unit(unit)
+            print(f'{exp}\t{epi}\tdone')
+
+    # Merge epigenomes per cancer type
+    for (exp, ctype), data in epigenomes.items():
+        module, mark = EXPERIMENTS[exp]
+        results = []
+        for epi, _ in data:
+            values, failed = load_checkpoint(units[(exp, epi)][4])
+            results.append((epi, values, failed))
+        output_file = output_f.format(experiment=exp, mark=mark, ctype=ctype)
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        module.write_results(module.load_bins(bins_f), results, output_file)
+
+
+if __name__ == '__main__':
+    main()
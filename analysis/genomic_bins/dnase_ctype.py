@@ -6,65 +6,88 @@ import numpy as np
 import pandas as pd
 import pyBigWig
 
+from bigwig_signal import BatchStats
+from signal_cache import SignalCache
 
-@click.command()
-@click.option('--cancer-type', default=None, required=True, type=str)
-@click.option('--bins_f', default=None, required=True, type=str)
-@click.option('--metadata_f', default=None, required=True, type=str)
-@click.option('--cov_f', default=None, required=True, type=str)
-@click.option('--url', default=None, required=True, type=str)
-@click.option('--output_f', default=None, required=True, type=str)
-def main(cancer_type, bins_f, metadata_f, cov_f, url, output_f):
-    """Get DNase signal from available Roadmap/ENCODE epigenomes"""
 
-    # Output files
-    output_log = output_f + '.log'
+def ctype_epigenomes(cancer_type, metadata_f, cov_f, mark='DNase'):
+    """Get epigenomes with DNase (or another mark) data for a cancer type"""
 
-    # Epigenomes
     # Get epigenomes with mark data
     table_df = pd.read_csv(metadata_f, sep='\t', header=0)
-    available_epigenomes = list(table_df.loc[table_df['MARK'] == 'DNase']['EID'])
+    available_epigenomes = list(table_df.loc[table_df['MARK'] == mark]['EID'])
 
     # Get epigenomes cancer type specific
     table2_df = pd.read_csv(cov_f, sep='\t', header=0)
     ctype_epigenomes = table2_df.loc[table2_df['CANCER_TYPE'] == cancer_type]['DNA_HISTONES_RNA_EPIGENOME'].iloc[0].split(',')
 
     # Intersect epigenomes for analysis
-    epigenomes = list(set(available_epigenomes).intersection(set(ctype_epigenomes)))
+    return list(set(available_epigenomes).intersection(set(ctype_epigenomes)))
+
+
+def epigenome_files(url, epigenome, mark='DNase'):
+    """BigWig files of an epigenome"""
+
+    return [os.path.join(url, f'{epigenome}-{mark}.fc.signal.bigwig')]
+
+
+def load_bins(bins_f):
+    """Read bins, keeping the first coordinates of each bin identifier sorted by identifier"""
 
-    # Input bins
     bins_df = pd.read_csv(bins_f, sep='\t', header=0)
     bins_df.sort_values(by=['CHR', 'START'], ascending=[True, True], inplace=True)
 
-    #### Run
-    loaded_epigenomes = []
-    for epigenome in epigenomes:
-        file = os.path.join(url, f'{epigenome}-DNase.fc.signal.bigwig')
-        loaded_epigenomes.append((epigenome, pyBigWig.open(file)))
+    return bins_df.drop_duplicates(subset='BINID').sort_values(by='BINID')
+
+
+def epigenome_signal(files, bins_df, batch=False, cache_dir=None):
+    """Get the mean signal per bin of an epigenome and the bins without data (signal 0.0)"""
+
+    if cache_dir:
+        batch, batch_bw = True, SignalCache(cache_dir, files[0]).batch_stats(bins_df)
+    else:
+        bw = pyBigWig.open(files[0])
+        if batch:
+            batch_bw = BatchStats(bw, bins_df)
+
+    values = np.zeros(len(bins_df))
+    failed = []
+    for i, x in enumerate(bins_df.itertuples(index=False)):
+        results = batch_bw.stats(i) if batch else bw.stats(x.CHR, x.START, x.END, type='mean')
+        if results[0]:
+            values[i] = results[0]
+        else:
+            failed.append((x.BINID, ))
+
+    return values, failed
 
+
+def write_results(bins_df, results, output_f):
+    """Write the mean and standard deviation of the signal across epigenomes per bin.
+
+    Results is a list of (epigenome, values, failed) as returned by epigenome_signal for each epigenome
+    """
+
+    output_log = output_f + '.log'
     header = ['CHR', 'START', 'END', 'ID', 'MEAN_SIGNAL', 'STD']
+    failed_sets = [(epi_name, set([f[0] for f in failed])) for epi_name, _, failed in results]
     failed_bins = []
 
     with gzip.open(output_f, 'wt') as ofd:
         ofd.write('{}\n'.format('\t'.join(header)))
 
         # Iterate through bins, epigenomes and get data
-        for binid, bin_data in bins_df.groupby('BINID'):
-            chrom, hg19_start, hg19_end = bin_data["CHR"].iloc[0], bin_data["START"].iloc[0], bin_data["END"].iloc[0]
+        for i, x in enumerate(bins_df.itertuples(index=False)):
+            binid = x.BINID
             hg38_start, hg38_end = binid.split(':')[1].split('-')
-            signal = []
-
-            for epi_name, epi_bw in loaded_epigenomes:
-                results = epi_bw.stats(chrom, hg19_start, hg19_end, type='mean')
-                if results[0]:
-                    signal.append(results[0])
-                else:
-                    signal.append(0.0)
+            signal = [values[i] for _, values, _ in results]
+            for epi_name, failed in failed_sets:
+                if binid in failed:
                     failed_bins.append((epi_name, binid))
 
             # Write
             data_to_write = [
-                chrom,
+                x.CHR,
                 str(hg38_start),
                 str(hg38_end),
                 binid,
@@ -78,5 +101,35 @@ def main(cancer_type, bins_f, metadata_f, cov_f, url, output_f):
             ofd.write('{}\n'.format('\t'.join(list(error))))
 
 
+@click.command()
+@click.option('--cancer-type', default=None, required=True, type=str)
+@click.option('--bins_f', default=None, required=True, type=str)
+@click.option('--metadata_f', default=None, required=True, type=str)
+@click.option('--cov_f', default=None, required=True, type=str)
+@click.option('--url', default=None, required=True, type=str)
+@click.option('--mark', default='DNase', type=str, help='Roadmap mark (e.g., DNase or a histone mark)')
+@click.option('--output_f', default=None, required=True, type=str)
+@click.option('--batch', is_flag=True, default=False,
+              help='Read the intervals of each chromosome once per epigenome instead of querying each bin')
+@click.option('--cache_dir', default=None, type=str,
+              help='Read the signal from the cache built with signal_cache.py instead of the bigWig files')
+def main(cancer_type, bins_f, metadata_f, cov_f, url, mark, output_f, batch, cache_dir):
+    """Get DNase (or histone mark) signal from available Roadmap/ENCODE epigenomes"""
+
+    # Epigenomes
+    epigenomes = ctype_epigenomes(cancer_type, metadata_f, cov_f, mark)
+
+    # Input bins
+    bins_df = load_bins(bins_f)
+
+    #### Run
+    results = []
+    for epigenome in epigenomes:
+        values, failed = epigenome_signal(epigenome_files(url, epigenome, mark), bins_df, batch, cache_dir)
+        results.append((epigenome, values, failed))
+
+    write_results(bins_df, results, output_f)
+
+
 if __name__ == '__main__':
     main()
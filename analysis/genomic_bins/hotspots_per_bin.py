@@ -2,9 +2,10 @@ from collections import defaultdict
 import json
 
 import click
-from intervaltree import IntervalTree
 import pandas as pd
 
+from bin_index import BinIndex
+
 autosomes = list(map(lambda x: f'chr{x}', range(1, 23)))
 
 
@@ -17,13 +18,8 @@ def main(hotspots_f, bins_f, output_f):
     # Load bins in autosomes
     bins_df = pd.read_csv(bins_f, sep='\t', header=0)
 
-    # Load bins into intervaltree
-    tree = defaultdict(IntervalTree)
-    for binid in bins_df['BINID'].tolist():
-        chrom, start_end = binid.split(':')
-        chrom = chrom[3:]
-        start, end = start_end.split('-')
-        tree[chrom].addi(int(start), int(end) + 1, binid)  # +1 open end
+    # Load bins into index
+    index = BinIndex.from_binids(bins_df['BINID'].tolist())
 
     # Read hotspots and intersect
     hotspots_per_bin = defaultdict(lambda: defaultdict(int))
@@ -36,13 +32,17 @@ def main(hotspots_f, bins_f, output_f):
             hotspot_sigs[hotspot][signature] = prob
             signatures.add(signature)
     # Assign hotspot to signature by maximum likelihood
+    best_sigs, chromosomes, positions = [], [], []
     for hotspot, data in hotspot_sigs.items():
         sorted_sigs = sorted([(s, float(p)) for s, p in data.items()], key=lambda x: x[1], reverse=True)
-        best_sig = sorted_sigs[0][0]
+        best_sigs.append(sorted_sigs[0][0])
         chrom, pos, _ = hotspot.split('_')
-        # Intersect with bins
-        for interval in tree[str(chrom)][int(pos)]:
-            hotspots_per_bin[interval.data][best_sig] += 1
+        chromosomes.append(str(chrom))
+        positions.append(int(pos))
+    # Intersect with bins
+    rows, bins = index.assign(chromosomes, positions)
+    for row, binid in zip(rows, index.binids[bins]):
+        hotspots_per_bin[binid][best_sigs[row]] += 1
 
     # Save
     dict_to_json = {}
@@ -1,36 +1,74 @@
 import os, sys
-os.environ["PATH"] = os.path.dirname(sys.executable) + os.pathsep + os.environ["PATH"]
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'mappable_genome'))
 
 import click
+import numpy as np
 import pandas as pd
-import pybedtools
+
+from genome_mask import GenomeMask
+import intervals
 
 
 @click.command()
 @click.option('-b', '--bins_f', default=None, required=True)
-@click.option('-g', '--mappable_genome_f', default=None, required=True)
-@click.option('-o', '--output_f', default=None, required=True)
-def main(bins_f, mappable_genome_f, output_f):
+@click.option('-g', '--mappable_genome_f', default=None, required=True,
+              help='Mappable genome (1-based) or prefix of its mask built with genome_mask.py')
+@click.option('-o', '--output_f', default=None,
+              help='Output file with the mappable coordinates of each bin (requires the mappable genome file)')
+@click.option('-c', '--counts_f', default=None, help='Output file with the number of mappable positions per bin')
+def main(bins_f, mappable_genome_f, output_f, counts_f):
     """
     Intersect the mappable genome with filtered bins to find mappable positions per bin
     """
 
-    # Read mappable genome coordinates and transform to BED
-    mappable_genome_df = pd.read_csv(mappable_genome_f, sep='\t', header=0, low_memory=False)
-    mappable_genome_df['START'] = mappable_genome_df.apply(lambda x: x['START'] - 1, axis=1)    # BED format
-    mappable_genome_bed = pybedtools.BedTool.from_dataframe(mappable_genome_df)
-
     # Read bin coordinates
     bins_df = pd.read_csv(bins_f, sep='\t', header=0)
-    bins_bed = pybedtools.BedTool.from_dataframe(bins_df)
 
-    # Intersect
-    intersect_bed = mappable_genome_bed.intersect(bins_bed, wb=True)    # wb writes the original entry in bins_bed
-    intersect_df = pd.read_csv(intersect_bed.fn, sep='\t', header=None)
+    # Count mappable positions per bin from the mask
+    if counts_f:
+        if os.path.exists(f'{mappable_genome_f}.index.json'):
+            mask = GenomeMask.load(mappable_genome_f)
+        else:
+            mask = GenomeMask.from_regions(mappable_genome_f, one_based=True, header=0)
+        counts = np.zeros(len(bins_df), dtype=np.int64)
+        for chrom in bins_df['CHR'].unique():
+            rows = np.flatnonzero(bins_df['CHR'].values == chrom)
+            counts[rows] = mask.count(chrom, bins_df['START'].values[rows], bins_df['END'].values[rows])
+        counts_df = pd.DataFrame({'BINID': bins_df['BINID'].values, 'MAPPABLE_POSITIONS': counts})
+        counts_df.to_csv(counts_f, sep='\t', index=False)
+
+    if output_f is None:
+        return
+
+    # Read mappable genome coordinates and transform to BED
+    mappable_genome_df = pd.read_csv(mappable_genome_f, sep='\t', header=0, low_memory=False)
+    mappable_genome_df['START'] = mappable_genome_df['START'] - 1    # BED format
+
+    # Intersect each mappable region with the bins it overlaps
+    output = []
+    for chrom in mappable_genome_df['CHR'].unique():
+        chrom_bins_df = bins_df.loc[bins_df['CHR'] == chrom].sort_values(by=['START', 'END'])
+        if len(chrom_bins_df) == 0:
+            continue
+        regions_df = mappable_genome_df.loc[mappable_genome_df['CHR'] == chrom]
+        starts, ends, index = intervals.intersect(
+            regions_df['START'].values, regions_df['END'].values,
+            chrom_bins_df['START'].values, chrom_bins_df['END'].values)
+        # Bin of each fragment (bins are disjoint)
+        bins = np.searchsorted(chrom_bins_df['END'].values, starts, side='right')
+        output.append(pd.DataFrame({
+            'CHR': chrom,
+            'START': starts,
+            'END': ends,
+            'BINID': chrom_bins_df['BINID'].values[bins],
+            'ROW': regions_df.index.values[index]
+        }))
 
-    # Reformat
-    intersect_df = intersect_df[[0, 1, 2, 6]]
-    intersect_df.columns = ['CHR', 'START', 'END', 'BINID']
+    # Reformat (same order as the mappable genome file)
+    intersect_df = pd.concat(output, ignore_index=True) if output else pd.DataFrame(
+        columns=['CHR', 'START', 'END', 'BINID', 'ROW'])
+    intersect_df.sort_values(by=['ROW', 'START'], kind='mergesort', inplace=True)
+    intersect_df = intersect_df[['CHR', 'START', 'END', 'BINID']]
 
     # Save
     intersect_df.to_csv(output_f, sep='\t', index=False)
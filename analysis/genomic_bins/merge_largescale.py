@@ -1,16 +1,18 @@
-from collections import defaultdict
 import gzip
 
 from bgparsers import readers
 import click
-from intervaltree import IntervalTree
 import numpy as np
 import pandas as pd
 
+from bin_index import BinIndex
+import dnase_ctype
+
 
 autosomes = list(map(lambda x: f'chr{x}', range(1, 23)))
 
-covariates_f = 'covariates_list.csv'     # this is equivalent to Extended View Dataset EV6 
+covariates_f = 'covariates_list.csv'     # this is equivalent to Extended View Dataset EV6
+metadata_f = 'Roadmap.metadata.consolidated.txt.csv'
 covariates_df = pd.read_csv(covariates_f, sep='\t', header=0)
 cancer_class = {}
 for _, row in covariates_df.iterrows():
@@ -19,111 +21,178 @@ for _, row in covariates_df.iterrows():
     else:
         cancer_class[row['CANCER_TYPE']] = 'NON_SOLID'
 
-@click.command()
-@click.option('-c', '--ctype', default=None, required=True)
-@click.option('-m', '--mtype', default=None, required=True)
-@click.option('-b', '--binsize', default=None, required=True)
-@click.option('-o', '--output_path', default=None, required=True)
-def main(ctype, mtype, binsize, output_path):
+histonemarks = [
+    'H3K4me1',
+    'H3K4me3',
+    'H3K36me3',
+    'H3K27me3',
+    'H3K9me3',
+    'H3K27ac',
+    'H3K9ac'
+]
+sufixes = ['in', 'out', 'total']
+
+
+def cached_signal_table(ctype, mark, bins_df, cache_dir):
+    """Mean signal of a mark across the cancer type epigenomes per bin read from the signal cache, as in the
+    tables written by dnase_ctype.py"""
+
+    signal = []
+    for epigenome in dnase_ctype.ctype_epigenomes(ctype, metadata_f, covariates_f, mark):
+        files = dnase_ctype.epigenome_files('', epigenome, mark)
+        values, _ = dnase_ctype.epigenome_signal(files, bins_df, cache_dir=cache_dir)
+        signal.append(values)
+
+    return pd.DataFrame({
+        'ID': bins_df['BINID'].values,
+        'MEAN_SIGNAL': np.mean(signal, axis=0) if signal else np.nan
+    })
+
+
+def load_bins(binsize):
+    """Autosomal bin identifiers (sorted) and their index"""
 
-    #### Bins
     bins_dir = '/bins_genome/data'
     bins_file = f'{bins_dir}/hg19_liftoverfromhg38_{binsize}_bin.filtered.bed.gz'
     # Use these bins so that there are no bins with no epigenetic data (data in hg19)
 
-    bins_tree = defaultdict(IntervalTree)
     binids = set()
     with gzip.open(bins_file, 'rt') as fd:
         next(fd)
         for line in fd:
             chrom, _, _, binid = line.strip().split('\t')
             if chrom in autosomes:
-                start, end = binid.split(':')[-1].split('-')
-                bins_tree[chrom[3:]].addi(int(start), int(end) + 1, binid)  # +1
                 binids.add(binid)
+    binids = sorted(binids)
+
+    return binids, BinIndex.from_binids(binids), bins_file
+
+
+def load_replication(metactype, binsize):
+    """Replication timing table of a cancer type class (SOLID or NON_SOLID)"""
+
+    experiment = 'replication'
+    base_dir = f'/hg38_{binsize}_bins/{experiment}'
+    file = f'{base_dir}/{metactype}_hg38_{binsize}_bin.RepliSeq.filtered.bed.gz'
+
+    return pd.read_csv(file, sep='\t', header=0)
+
+
+def load_covariates(ctype, binsize, bins_file, cache_dir=None, repli_df=None):
+    """Covariate tables (ID and MEAN_SIGNAL columns) of a cancer type, by output column name.
+
+    The replication timing table is shared by the cancer types of the same class and can be given already loaded
+    """
+
+    tables = {}
 
     #### DNase
     experiment = 'dnase'
     base_dir = f'/hg38_{binsize}_bins/{experiment}'
     file = f'{base_dir}/{ctype}_hg38_{binsize}_bin.DNase.filtered.bed.gz'
-    dnase_df = pd.read_csv(file, sep='\t', header=0)
+    tables['DHS'] = pd.read_csv(file, sep='\t', header=0)
 
     #### Histones
-    histonemarks = [
-        'H3K4me1',
-        'H3K4me3',
-        'H3K36me3',
-        'H3K27me3',
-        'H3K9me3',
-        'H3K27ac',
-        'H3K9ac'
-    ]
     experiment = 'histonemarks'
     base_dir = f'/hg38_{binsize}_bins/{experiment}'
-    hm_data = {}
+    if cache_dir:
+        hm_bins_df = dnase_ctype.load_bins(bins_file)
     for hm in histonemarks:
-        file = f'{base_dir}/{ctype}_hg38_{binsize}_bin.{hm}.filtered.bed.gz'
-        df = pd.read_csv(file, sep='\t', header=0)
-        hm_data[hm] = df
+        if cache_dir:
+            tables[hm] = cached_signal_table(ctype, hm, hm_bins_df, cache_dir)
+        else:
+            file = f'{base_dir}/{ctype}_hg38_{binsize}_bin.{hm}.filtered.bed.gz'
+            tables[hm] = pd.read_csv(file, sep='\t', header=0)
 
     #### Replication time
-    experiment = 'replication'
-    base_dir = f'/hg38_{binsize}_bins/{experiment}'
-    metactype = cancer_class[ctype]
-    file = f'{base_dir}/{metactype}_hg38_{binsize}_bin.RepliSeq.filtered.bed.gz'
-    repli_df = pd.read_csv(file, sep='\t', header=0)
+    if repli_df is None:
+        repli_df = load_replication(cancer_class[ctype], binsize)
+    tables['REPLI_T'] = repli_df
 
     #### RNA
     experiment = 'rna'
     base_dir = f'/hg38_{binsize}_bins/{experiment}'
     file = f'{base_dir}/{ctype}_hg38_{binsize}_bin.rna.filtered.bed.gz'
-    rna_df = pd.read_csv(file, sep='\t', header=0)
+    tables['EXPR'] = pd.read_csv(file, sep='\t', header=0)
+
+    return tables
+
+
+def join_covariates(tables, binids):
+    """Signal of each covariate per bin (first row of the bin in each table, rounded to 6 decimals)"""
+
+    covariates = {}
+    for name, df in tables.items():
+        signal = df.drop_duplicates(subset='ID').set_index('ID')['MEAN_SIGNAL']
+        covariates[name] = signal.reindex(binids).round(6).values
+
+    return covariates
+
+
+def load_mutations(ctype, mtype):
+    """Mutations inside, outside hotspots and in total of a cancer type.
+
+    Returns the sorted signatures and, for each sufix, the chromosomes and positions of the mutations with their
+    signature probabilities (vector) or signature index (maxprob)
+    """
 
-    #### Mutations
     base_dir = '/signatures/assign_muts_to_sigs/data'
-    sum_probs_dict = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
-    total_muts = defaultdict(lambda: defaultdict(float))
+    mutations = {}
     if mtype == 'vector':
-        signatures = list()
-        for sufix in ['in', 'out', 'total']:
+        for sufix in sufixes:
             input_f = f'{base_dir}/{ctype}_SBS96_{sufix}.txt'
             with open(input_f, 'r') as fd:
-                for i, line in enumerate(fd):
-                    # Parse data
-                    if i > 0:
-                        data = line.strip().split('\t')
-                        chrom, pos = data[1:3]
-                        probabilities = data[4:]
-                        for interval in bins_tree[chrom][int(pos)]:
-                            binid = interval.data
-                            # Load
-                            for s, p in list(zip(signatures, probabilities)):
-                                sum_probs_dict[sufix][binid][s] += float(p)
-                                total_muts[sufix][binid] += 1
-                    # Parse header
-                    else:
-                        header = line.strip().split('\t')
-                        signatures = sorted(header[4:])
+                header = next(fd).strip().split('\t')
+            signatures = sorted(header[4:])
+            muts_df = pd.read_csv(
+                input_f, sep='\t', header=None, skiprows=1, dtype={1: str, 2: int}, float_precision='round_trip')
+            mutations[sufix] = (muts_df[1].values, muts_df[2].values, muts_df.iloc[:, 4:].values)
     elif mtype == 'maxprob':
-        signatures = set()
-        for sufix in ['in', 'out', 'total']:
+        labels = {}
+        for sufix in sufixes:
             input_f = f'{base_dir}/{ctype}_SBS96_{sufix}_maxprob.tsv'
-            with open(input_f, 'r') as fd:
-                next(fd)
-                for line in fd:
-                    # Parse data
-                    _, chrom, pos, _, s, _ = line.strip().split('\t')
-                    signatures.add(s)
-                    for interval in bins_tree[chrom][int(pos)]:
-                        binid = interval.data
-                        sum_probs_dict[sufix][binid][s] += 1
-                        total_muts[sufix][binid] += 1
+            muts_df = pd.read_csv(input_f, sep='\t', header=None, skiprows=1, dtype={1: str, 2: int, 4: str})
+            labels[sufix] = muts_df[4].values
+            mutations[sufix] = (muts_df[1].values, muts_df[2].values)
+        signatures = sorted(set().union(*[set(sig) for sig in labels.values()]))
+        for sufix in sufixes:
+            codes = pd.Categorical(labels[sufix], categories=signatures).codes
+            mutations[sufix] += (codes, )
+
+    return signatures, mutations
+
+
+def count_mutations(signatures, mutations, bins_index, mtype):
+    """Mutations per bin (bins array) and per bin and signature (bins x signatures array) of each sufix"""
+
+    n_bins, n_sigs = len(bins_index), len(signatures)
+    total_muts, sig_muts = {}, {}
+    for sufix in sufixes:
+        chromosomes, positions, data = mutations[sufix]
+        rows, bins = bins_index.assign(chromosomes, positions)
+        hits = np.bincount(bins, minlength=n_bins)
+        if mtype == 'vector':
+            probabilities = data[rows]
+            sig_muts[sufix] = np.zeros((n_bins, n_sigs))
+            for i in range(n_sigs):
+                sig_muts[sufix][:, i] = np.bincount(bins, weights=probabilities[:, i], minlength=n_bins)
+            # Mutations are counted once per signature, as in the previous per-line implementation
+            total_muts[sufix] = (hits * n_sigs).astype(np.float64)
+        else:
+            sig_muts[sufix] = np.bincount(
+                bins * n_sigs + data[rows], minlength=n_bins * n_sigs).reshape(n_bins, n_sigs).astype(np.float64)
+            total_muts[sufix] = hits.astype(np.float64)
+
+    return total_muts, sig_muts
+
+
+def load_hotspots(ctype):
+    """Chromosomes and positions of the SNV hotspots of a cancer type"""
 
-    #### Hotspots
     base_dir = '/hotspots/'
     file = f'{base_dir}/{ctype}.results.tsv.gz'
 
-    bins_hotspots = defaultdict(int)
+    chromosomes, positions = [], []
     for row in readers.variants(
             file=file,
             required=['CHROMOSOME', 'POSITION'],
@@ -135,93 +204,107 @@ def main(ctype, mtype, binsize, output_path):
         mutype = row['MUT_TYPE']
 
         if mutype == 'snv':
-            for interval in bins_tree[chrom][int(pos)]:
-                bins_hotspots[interval.data] += 1
+            chromosomes.append(chrom)
+            positions.append(int(pos))
 
-    print('Data loaded')
-    ## Merge
-    header = [
-                 'DATA_TYPE',
-                 'BIN_SIZE',
-                 'CHR',
-                 'START',
-                 'END',
-                 'BINID',
-                 'CTYPE',
-                 'DHS'] + sorted(histonemarks) + [
-                 'REPLI_T',
-                 'EXPR',
-                 'H_SNV_BIN',
-                 'M_IN_BIN',
-                 'M_OUT_BIN',
-                 'M_TOTAL_BIN',
-                 'SIG',
-                 'M_IN_SIG',
-                 'M_OUT_SIG',
-                 'M_TOTAL_SIG'
-             ]
-
-    lines = []
-    for binid in binids:
-        binid_data = []
-        chrom = binid.split(':')[0]
-        start, end = binid.split(':')[-1].split('-')
-        binid_data += [mtype, binsize, chrom, start, end, binid, ctype]
-
-        # DNase
-        try:
-            dnase = round(dnase_df.loc[dnase_df['ID'] == binid]['MEAN_SIGNAL'].iloc[0], 6)
-        except IndexError:
-            dnase = np.nan
-        binid_data += [dnase]
-
-        # Histone marks
-        for hm in sorted(histonemarks):
-            data = hm_data[hm]
-            try:
-                binid_data += [round(data.loc[data['ID'] == binid]['MEAN_SIGNAL'].iloc[0], 6)]
-            except IndexError:
-                binid_data += [np.nan]
-
-        # Replication
-        try:
-            binid_data += [round(repli_df.loc[repli_df['ID'] == binid]['MEAN_SIGNAL'].iloc[0], 6)]
-        except IndexError:
-            binid_data += [np.nan]
+    return chromosomes, positions
+
+
+def count_hotspots(hotspots, bins_index):
+    """Hotspots per bin"""
+
+    _, bins = bins_index.assign(*hotspots)
 
-        # RNA
+    return np.bincount(bins, minlength=len(bins_index))
+
+
+def largescale_matrix(ctype, mtype, binsize, binids, covariates, hotspots, signatures, total_muts, sig_muts):
+    """Assemble the matrix with one row per bin and signature"""
+
+    n_sigs = len(signatures)
+    coordinates = pd.Series(binids, dtype=object).str.extract(r'^([^:]+):(\d+)-(\d+)$')
+
+    def per_bin(values):
+        """Repeat the values of each bin for all signatures"""
+        return np.repeat(np.asarray(values), n_sigs)
+
+    columns = {
+        'DATA_TYPE': mtype,
+        'BIN_SIZE': binsize,
+        'CHR': per_bin(coordinates[0].values),
+        'START': per_bin(coordinates[1].values.astype(np.int64)),
+        'END': per_bin(coordinates[2].values.astype(np.int64)),
+        'BINID': per_bin(binids),
+        'CTYPE': ctype,
+        'DHS': per_bin(covariates['DHS']),
+    }
+    for hm in sorted(histonemarks):
+        columns[hm] = per_bin(covariates[hm])
+    columns['REPLI_T'] = per_bin(covariates['REPLI_T'])
+    columns['EXPR'] = per_bin(covariates['EXPR'])
+    columns['H_SNV_BIN'] = per_bin(hotspots)
+    for sufix in sufixes:
+        columns[f'M_{sufix.upper()}_BIN'] = per_bin(total_muts[sufix])
+    columns['SIG'] = np.tile(np.asarray(signatures, dtype=object), len(binids))
+    for sufix in sufixes:
+        columns[f'M_{sufix.upper()}_SIG'] = sig_muts[sufix].ravel()
+
+    return pd.DataFrame(columns, index=pd.RangeIndex(len(binids) * n_sigs))
+
+
+def check_output_format(output_format):
+    """Check that a Parquet engine (pyarrow or fastparquet) is installed before computing the matrices"""
+
+    if output_format == 'parquet':
         try:
-            binid_data += [round(rna_df.loc[rna_df['ID'] == binid]['MEAN_SIGNAL'].iloc[0], 6)]
-        except IndexError:
-            binid_data += [np.nan]
-
-        # Hotspots
-        binid_data += [bins_hotspots.get(binid, 0)]
-
-        # Mutations in the bin
-        for sufix in ['in', 'out', 'total']:
-            total_muts_sufix = total_muts[sufix]
-            binid_data += [total_muts_sufix.get(binid, 0)]
-
-        # Mutations in the bin, split by signature
-        for sig in signatures:
-            sig_data_to_write = [sig]
-            for sufix in ['in', 'out', 'total']:
-                muts_sufix = sum_probs_dict[sufix]
-                muts_sufix_bin = muts_sufix.get(binid, {})
-                if muts_sufix_bin:
-                    sig_data_to_write += [muts_sufix_bin.get(sig, 0)]
-                else:
-                    sig_data_to_write += [0]
-
-            lines.append(pd.DataFrame([binid_data + sig_data_to_write]))
-
-    results_df = pd.concat(lines)
-    results_df.columns = header
+            pd.io.parquet.get_engine('auto')
+        except ImportError:
+            raise click.UsageError('-f parquet requires pyarrow or fastparquet (see env.yaml)')
+
+
+def save_matrix(results_df, output_path, ctype, binsize, mtype, output_format):
+    """Save the matrix as TSV or Parquet"""
+
+    output_f = f'{output_path}/{ctype}_{binsize}_largescale_matrix_{mtype}'
+    if output_format == 'parquet':
+        results_df.to_parquet(f'{output_f}.parquet', index=False)
+    else:
+        results_df.to_csv(f'{output_f}.tsv', sep='\t', header=True, index=False)
+
+
+@click.command()
+@click.option('-c', '--ctype', default=None, required=True)
+@click.option('-m', '--mtype', default=None, required=True)
+@click.option('-b', '--binsize', default=None, required=True)
+@click.option('-o', '--output_path', default=None, required=True)
+@click.option('--cache_dir', default=None,
+              help='Compute the histone marks signal from the cache built with signal_cache.py instead of reading '
+                   'the histone marks tables')
+@click.option('-f', '--output_format', default='tsv', type=click.Choice(['tsv', 'parquet']))
+def main(ctype, mtype, binsize, output_path, cache_dir, output_format):
+
+    check_output_format(output_format)
+
+    #### Bins
+    binids, bins_index, bins_file = load_bins(binsize)
+
+    #### Covariates
+    covariates = join_covariates(load_covariates(ctype, binsize, bins_file, cache_dir), binids)
+
+    #### Mutations
+    signatures, mutations = load_mutations(ctype, mtype)
+    total_muts, sig_muts = count_mutations(signatures, mutations, bins_index, mtype)
+
+    #### Hotspots
+    hotspots = count_hotspots(load_hotspots(ctype), bins_index)
+
+    print('Data loaded')
+    ## Merge
+    results_df = largescale_matrix(
+        ctype, mtype, binsize, binids, covariates, hotspots, signatures, total_muts, sig_muts)
 
     # Save
-    output_f = f'{output_path}/{ctype}_{binsize}_largescale_matrix_{mtype}.tsv'
-    results_df.to_csv(output_f, sep='\t', header=True, index=False)
+    save_matrix(results_df, output_path, ctype, binsize, mtype, output_format)
 
 
 if __name__ == '__main__':
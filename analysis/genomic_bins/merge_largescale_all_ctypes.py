@@ -0,0 +1,78 @@
+"""Build the large-scale matrices of several cancer types, mutation types and bin sizes at once"""
+
+from multiprocessing import Pool
+
+import click
+
+import merge_largescale as ml
+
+# Bins and replication timing tables shared by all cancer types, loaded once before the workers are forked
+SHARED = {}
+
+
+def run_ctype(unit):
+    """Build the matrices of a cancer type, reading its mutation and hotspot files once for all bin sizes"""
+
+    ctype, mtypes, binsizes, output_path, cache_dir, output_format = unit
+
+    hotspots = ml.load_hotspots(ctype)
+    covariates = {}
+    for binsize in binsizes:
+        binids, _, bins_file = SHARED['bins'][binsize]
+        repli_df = SHARED['replication'][(ml.cancer_class[ctype], binsize)]
+        covariates[binsize] = ml.join_covariates(
+            ml.load_covariates(ctype, binsize, bins_file, cache_dir, repli_df), binids)
+
+    for mtype in mtypes:
+        signatures, mutations = ml.load_mutations(ctype, mtype)
+        for binsize in binsizes:
+            binids, bins_index, _ = SHARED['bins'][binsize]
+            total_muts, sig_muts = ml.count_mutations(signatures, mutations, bins_index, mtype)
+            results_df = ml.largescale_matrix(
+                ctype, mtype, binsize, binids, covariates[binsize], ml.count_hotspots(hotspots, bins_index),
+                signatures, total_muts, sig_muts)
+            ml.save_matrix(results_df, output_path, ctype, binsize, mtype, output_format)
+
+    return ctype
+
+
+@click.command()
+@click.option('-c', '--ctype', default=None, multiple=True,
+              help='Cancer types (can be used multiple times). Default: all cancer types in covariates_list.csv')
+@click.option('-m', '--mtype', default=['vector', 'maxprob'], multiple=True, type=click.Choice(['vector', 'maxprob']))
+@click.option('-b', '--binsize', default=None, required=True, multiple=True,
+              help='Bin sizes (e.g., 1000kb; can be used multiple times)')
+@click.option('-o', '--output_path', default=None, required=True)
+@click.option('--cache_dir', default=None,
+              help='Compute the histone marks signal from the cache built with signal_cache.py instead of reading '
+                   'the histone marks tables')
+@click.option('-f', '--output_format', default='tsv', type=click.Choice(['tsv', 'parquet']))
+@click.option('--cores', default=1, type=int)
+def main(ctype, mtype, binsize, output_path, cache_dir, output_format, cores):
+    """Large-scale matrices of all cancer types and bin sizes, with one worker per cancer type"""
+
+    ml.check_output_format(output_format)
+
+    ctypes = list(ctype) if ctype else list(ml.cancer_class.keys())
+
+    # Shared data
+    SHARED['bins'] = dict([(b, ml.load_bins(b)) for b in binsize])
+    SHARED['replication'] = {}
+    for metactype in sorted(set([ml.cancer_class[c] for c in ctypes])):
+        for b in binsize:
+            SHARED['replication'][(metactype, b)] = ml.load_replication(metactype, b)
+    print('Bins loaded')
+
+    # Run
+    units = [(c, list(mtype), list(binsize), output_path, cache_dir, output_format) for c in ctypes]
+    if cores > 1:
+        with Pool(cores) as pool:
+            for c in pool.imap_unordered(run_ctype, units):
+                print(f'{c}\tdone')
+    else:
+        for unit in units:
+            print(f'{run_ctype(unit)}\tdone')
+
+
+if __name__ == '__main__':
+    main()
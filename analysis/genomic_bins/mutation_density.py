@@ -0,0 +1,109 @@
+"""Cumulative mutation counts per chromosome and signature to count mutations in any set of genomic windows"""
+
+import numpy as np
+import pandas as pd
+
+from bin_index import parse_binid
+
+# Offset between signatures in the sorted keys, larger than any chromosome length
+SIGNATURE_OFFSET = 2 ** 32
+
+
+class MutationDensity:
+    """Mutations of a file sorted by position in each chromosome.
+
+    Mutations assigned to a signature by maximum likelihood (maxprob) are stored as sorted keys
+    (signature index * SIGNATURE_OFFSET + position), so the number of mutations of a signature up to any position
+    is its rank in the array. Mutations with a vector of signature probabilities (vector) are stored as the
+    cumulative sum of probabilities along the sorted positions. In both cases, the counts in a window are the
+    difference of two cumulative values.
+    """
+
+    def __init__(self, signatures, positions, keys=None, cumulative=None):
+        self.signatures = list(signatures)
+        self._positions = positions
+        self._keys = keys
+        self._cumulative = cumulative
+
+    @classmethod
+    def from_maxprob(cls, muts_f):
+        """Load mutations assigned to signatures by maximum likelihood (SIGNATURE in the 8th column)"""
+
+        muts_df = pd.read_csv(
+            muts_f, sep='\t', header=None, skiprows=1, usecols=[1, 2, 7], names=['CHROMOSOME', 'POSITION', 'SIGNATURE'],
+            dtype={'CHROMOSOME': str, 'POSITION': np.int64, 'SIGNATURE': str})
+        signatures = sorted(muts_df['SIGNATURE'].unique())
+        codes = pd.Categorical(muts_df['SIGNATURE'], categories=signatures).codes.astype(np.int64)
+        chromosomes = muts_df['CHROMOSOME'].values
+        all_positions = muts_df['POSITION'].values
+
+        positions, keys = {}, {}
+        for chrom in np.unique(chromosomes):
+            rows = chromosomes == chrom
+            positions[chrom] = np.sort(all_positions[rows])
+            keys[chrom] = np.sort(codes[rows] * SIGNATURE_OFFSET + all_positions[rows])
+
+        return cls(signatures, positions, keys=keys)
+
+    @classmethod
+    def from_vector(cls, muts_f):
+        """Load mutations with signature probabilities (one column per signature from the 5th column)"""
+
+        with open(muts_f, 'r') as fd:
+            header = next(fd).strip().split('\t')
+        signatures = sorted(header[4:])
+        muts_df = pd.read_csv(
+            muts_f, sep='\t', header=None, skiprows=1, dtype={1: str, 2: np.int64}, float_precision='round_trip')
+        chromosomes = muts_df[1].values
+        all_positions = muts_df[2].values
+        probabilities = muts_df.iloc[:, 4:].values.astype(np.float64)
+
+        positions, cumulative = {}, {}
+        for chrom in np.unique(chromosomes):
+            rows = np.flatnonzero(chromosomes == chrom)
+            rows = rows[np.argsort(all_positions[rows], kind='mergesort')]
+            positions[chrom] = all_positions[rows]
+            cumulative[chrom] = np.vstack([np.zeros((1, len(signatures))), np.cumsum(probabilities[rows], axis=0)])
+
+        return cls(signatures, positions, cumulative=cumulative)
+
+    def counts(self, chrom, starts, ends):
+        """Count mutations in the closed windows [start, end] of a chromosome.
+
+        Returns the number of mutations per window and an array (windows x signatures) with the mutations of each
+        signature (or the sum of probabilities of each signature)
+        """
+
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if chrom not in self._positions:
+            return np.zeros(len(starts), dtype=np.int64), np.zeros((len(starts), len(self.signatures)))
+        positions = self._positions[chrom]
+
+        # Mutations before the start and up to the end of each window
+        lower = np.searchsorted(positions, starts, side='left')
+        upper = np.searchsorted(positions, ends, side='right')
+        hits = upper - lower
+
+        if self._keys is not None:
+            offsets = np.arange(len(self.signatures), dtype=np.int64) * SIGNATURE_OFFSET
+            keys = self._keys[chrom]
+            weights = (np.searchsorted(keys, ends[:, None] + offsets[None, :], side='right') -
+                       np.searchsorted(keys, starts[:, None] + offsets[None, :], side='left'))
+        else:
+            cumulative = self._cumulative[chrom]
+            weights = cumulative[upper] - cumulative[lower]
+
+        return hits, weights
+
+    def counts_per_bin(self, binids):
+        """Count mutations in bins given by their identifiers (e.g., "chr1:0-1000000"), in the same order"""
+
+        coordinates = pd.DataFrame([parse_binid(binid) for binid in binids], columns=['CHR', 'START', 'END'])
+        hits = np.zeros(len(coordinates), dtype=np.int64)
+        weights = np.zeros((len(coordinates), len(self.signatures)))
+        for chrom, data in coordinates.groupby('CHR', sort=False):
+            rows = data.index.values
+            hits[rows], weights[rows] = self.counts(chrom, data['START'].values, data['END'].values)
+
+        return hits, weights
@@ -0,0 +1,70 @@
+import json
+
+import click
+import pandas as pd
+
+from mutation_density import MutationDensity
+
+BIN_SIZES = [1000000, 500000, 250000, 100000, 50000, 25000, 10000]
+
+
+@click.command()
+@click.option('-m', '--muts_f', default=None, required=True)
+@click.option('-t', '--mtype', default='maxprob', type=click.Choice(['maxprob', 'vector']),
+              help='Mutations assigned to a signature (maxprob) or with signature probabilities (vector)')
+@click.option('-bs', '--bin_size', default=BIN_SIZES, multiple=True, type=int, help='Bin sizes (bp)')
+@click.option('-b', '--bins_f', default=None, required=True,
+              help='Bins file with {bin_name} placeholder (e.g., hg38_{bin_name}_bin.[...].binids.txt)')
+@click.option('-o', '--output_f', default=None, required=True, help='Output file with {bin_name} placeholder')
+@click.option('-n', '--norm_output_f', default=None,
+              help='Output file of normalised mutations per bin with {bin_name} and {signature} placeholders')
+@click.option('-s', '--signature', default=None, multiple=True,
+              help='Signatures to normalise (can be used multiple times). Default: all signatures')
+def main(muts_f, mtype, bin_size, bins_f, output_f, norm_output_f, signature):
+    """Count mutations per bin for several bin sizes reading the mutations file once"""
+
+    # Load mutations once
+    if mtype == 'maxprob':
+        density = MutationDensity.from_maxprob(muts_f)
+    else:
+        density = MutationDensity.from_vector(muts_f)
+    signatures = list(signature) if signature else density.signatures
+
+    for size in bin_size:
+        bin_name = f'{int(size/1000)}kb'
+
+        # Load bins
+        bins_df = pd.read_csv(bins_f.format(bin_name=bin_name), sep='\t', header=0)
+        binids = list(bins_df['BINID'].unique())
+
+        # Count mutations per bin
+        hits, weights = density.counts_per_bin(binids)
+
+        # Save bins with at least 1 mutation from any signature
+        dict_to_json = {}
+        for binid, bin_hits, bin_weights in zip(binids, hits, weights):
+            if bin_hits == 0:
+                continue
+            if mtype == 'maxprob':
+                dict_to_json[binid] = dict(
+                    [(sig, int(mutations)) for sig, mutations in zip(density.signatures, bin_weights) if mutations > 0])
+            else:
+                dict_to_json[binid] = dict(zip(density.signatures, map(float, bin_weights)))
+        with open(output_f.format(bin_name=bin_name), 'w') as ofd:
+            json.dump(dict_to_json, ofd)
+
+        # Normalise mutation rate across bins (pseudocount proportional to bin size)
+        if norm_output_f:
+            pseudocount = int(size)/1000000
+            for sig in signatures:
+                mutations = dict()
+                for binid in binids:
+                    mutations[binid] = dict_to_json.get(binid, {}).get(sig, 0) + pseudocount
+                total_mutations = sum(mutations.values())
+                muts_norm = dict([(binid, counts/total_mutations) for binid, counts in mutations.items()])
+                with open(norm_output_f.format(bin_name=bin_name, signature=sig), 'w') as ofd:
+                    json.dump(muts_norm, ofd)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,11 @@
-from collections import defaultdict
 import json
 
 import click
-from intervaltree import IntervalTree
+import numpy as np
 import pandas as pd
 
+from bin_index import BinIndex
+
 
 @click.command()
 @click.option('-m', '--muts_f', default=None, required=True)
@@ -14,42 +15,33 @@ def main(muts_f, bins_f, output_f):
 
     # Load bins
     bins_df = pd.read_csv(bins_f, sep='\t', header=0)
-    selected_bins = set(bins_df['BINID'].unique())
+    selected_bins = bins_df['BINID'].unique()
 
-    # Load bins into intervaltree
-    tree = defaultdict(IntervalTree)
-    for binid in selected_bins:
-        chrom, start_end = binid.split(':')
-        start, end = start_end.split('-')
-        chrom = chrom[3:]
-        tree[chrom].addi(int(start), int(end) + 1, binid)
+    # Load bins into index
+    index = BinIndex.from_binids(selected_bins)
 
-    # Read mutations and intersect
-    sum_probs_dict = defaultdict(lambda: defaultdict(float))
-    signatures = list()
+    # Parse header
     with open(muts_f, 'r') as fd:
-        for i, line in enumerate(fd):
-            # Parse data
-            if i > 0:
-                data = line.strip().split('\t')
-                chrom, pos = data[1:3]
-                probabilities = data[4:]
-                for interval in tree[chrom][int(pos)]:
-                    binid = interval.data
-                    # Load
-                    for s, p in list(zip(signatures, probabilities)):
-                        sum_probs_dict[binid][s] += float(p)
-            # Parse header
-            else:
-                header = line.strip().split('\t')
-                signatures = sorted(header[4:])
+        header = next(fd).strip().split('\t')
+    signatures = sorted(header[4:])
+
+    # Read mutations and intersect
+    muts_df = pd.read_csv(
+        muts_f, sep='\t', header=None, skiprows=1, dtype={1: str, 2: int}, float_precision='round_trip')
+    rows, bins = index.assign(muts_df[1].values, muts_df[2].values)
+    probabilities = muts_df.iloc[:, 4:].values[rows]
+
+    # Sum the probabilities of mutations per bin (bins in order of appearance)
+    binids, first_hit, bins = np.unique(bins, return_index=True, return_inverse=True)
+    order = np.argsort(first_hit, kind='mergesort')
+    sum_probs = np.stack(
+        [np.bincount(bins, weights=probabilities[:, i], minlength=len(binids)) for i in range(len(signatures))],
+        axis=1)
 
     # Save
     dict_to_json = {}
-    for binid, sigs_to_muts in sum_probs_dict.items():
-        dict_to_json[binid] = {}
-        for sig, mutations in sigs_to_muts.items():
-            dict_to_json[binid][sig] = mutations
+    for i in order:
+        dict_to_json[index.binids[binids[i]]] = dict(zip(signatures, map(float, sum_probs[i])))
     with open(output_f, 'w') as ofd:
         json.dump(dict_to_json, ofd)
 
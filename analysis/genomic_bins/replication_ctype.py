@@ -7,6 +7,9 @@ import pyBigWig
 import numpy as np
 import pandas as pd
 
+from bigwig_signal import BatchStats
+from signal_cache import SignalCache
+
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -16,40 +19,73 @@ cell_lines = {
 }
 CHR = [str(i) for i in range(1, 23)] + ['X', 'Y']
 
-@click.command()
-@click.option('--cancer-type', default=None, required=True, type=str)
-@click.option('--bins_f', default=None, required=True, type=str)
-@click.option('--url', default=None, required=True, type=str)
-@click.option('--output_f', default=None, required=True, type=str)
-def main(cancer_type, bins_f, url, output_f):
+def ctype_epigenomes(cancer_type):
+    """Get the cell lines with replication timing data for a cancer type class (SOLID or NON_SOLID)"""
 
-    """Get Replication timing signal from available Roadmap/ENCODE epigenomes"""
+    return cell_lines[cancer_type]
 
-    # Output files
-    output_log = output_f + '.log'
 
-    # Input bins
+def epigenome_files(url, cell):
+    """BigWig files of a cell line"""
+
+    return [os.path.join(url, f'wgEncodeUwRepliSeq{cell}WaveSignalRep1.bigWig')]
+
+
+def load_bins(bins_f):
+    """Read bins sorted by coordinates"""
+
     bins_df = pd.read_csv(bins_f, sep='\t', header=0, low_memory=False)
     bins_df.sort_values(by=['CHR', 'START'], ascending=[True, True], inplace=True)
 
+    return bins_df
+
+
+def epigenome_signal(files, bins_df, batch=False, cache_dir=None):
+    """Get the signal per bin of a cell line (NaN when the bin cannot be queried) and the failed bins"""
+
+    values = np.full(len(bins_df), np.nan)
+    failed = []
+    if cache_dir:
+        batch, batch_bw = True, SignalCache(cache_dir, files[0]).batch_stats(bins_df)
+    else:
+        bw = pyBigWig.open(files[0])
+        if batch:
+            batch_bw = BatchStats(bw, bins_df)
+
+    # Iterate through bins and get data
+    for i, (_, x) in enumerate(bins_df.iterrows()):
+        chrom, start, end, binid = x["CHR"], x["START"], x["END"], x['BINID']
+        try:
+            if batch:
+                bin_data = batch_bw.stats(i)
+            else:
+                bin_data = bw.stats(x["CHR"], x["START"], x["END"], type='mean')
+            if bin_data[0]:
+                values[i] = bin_data[0]
+            else:
+                values[i] = 0.0
+                failed.append((binid, ))
+        except RuntimeError:
+            failed.append((binid, ))
+
+    return values, failed
+
+
+def write_results(bins_df, results, output_f):
+    """Write the mean and standard deviation of the signal across cell lines per bin.
+
+    Results is a list of (cell line, values, failed) as returned by epigenome_signal for each cell line
+    """
+
+    output_log = output_f + '.log'
     results_per_bin = defaultdict(list)
     failed_bins = []
-    for cell in cell_lines[cancer_type]:
-        file = os.path.join(url, f'wgEncodeUwRepliSeq{cell}WaveSignalRep1.bigWig')
-        bw = pyBigWig.open(file)
-
-        # Iterate through bins and get data
-        for _, x in bins_df.iterrows():
-            chrom, start, end, binid = x["CHR"], x["START"], x["END"], x['BINID']
-            try:
-                bin_data = bw.stats(x["CHR"], x["START"], x["END"], type='mean')
-                if bin_data[0]:
-                    results_per_bin[binid].append(bin_data[0])
-                else:
-                    results_per_bin[binid].append(0.0)
-                    failed_bins.append((cell, binid))
-            except RuntimeError:
-                failed_bins.append((cell, binid))
+    binids = bins_df['BINID'].tolist()
+    for cell, values, failed in results:
+        for binid, value in zip(binids, values):
+            if not np.isnan(value):
+                results_per_bin[binid].append(value)
+        failed_bins += [(cell, ) + tuple(error) for error in failed]
 
     header = ['CHR', 'START', 'END', 'ID', 'MEAN_SIGNAL', 'STD']
     with gzip.open(output_f, 'wt') as ofd:
@@ -73,5 +109,29 @@ def main(cancer_type, bins_f, url, output_f):
             ofd.write('{}\n'.format('\t'.join(list(error))))
 
 
+@click.command()
+@click.option('--cancer-type', default=None, required=True, type=str)
+@click.option('--bins_f', default=None, required=True, type=str)
+@click.option('--url', default=None, required=True, type=str)
+@click.option('--output_f', default=None, required=True, type=str)
+@click.option('--batch', is_flag=True, default=False,
+              help='Read the intervals of each chromosome once per cell line instead of querying each bin')
+@click.option('--cache_dir', default=None, type=str,
+              help='Read the signal from the cache built with signal_cache.py instead of the bigWig files')
+def main(cancer_type, bins_f, url, output_f, batch, cache_dir):
+
+    """Get Replication timing signal from available Roadmap/ENCODE epigenomes"""
+
+    # Input bins
+    bins_df = load_bins(bins_f)
+
+    results = []
+    for cell in ctype_epigenomes(cancer_type):
+        values, failed = epigenome_signal(epigenome_files(url, cell), bins_df, batch, cache_dir)
+        results.append((cell, values, failed))
+
+    write_results(bins_df, results, output_f)
+
+
 if __name__ == '__main__':
     main()
@@ -7,6 +7,9 @@ import numpy as np
 import pandas as pd
 import pyBigWig
 
+from bigwig_signal import BatchStats
+from signal_cache import SignalCache
+
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -70,87 +73,131 @@ available_epigenomes = [
 
 no_strand_epigenomes = ['E028', 'E037', 'E038', 'E047', 'E050', 'E062', 'E084', 'E085']
 
-@click.command()
-@click.option('--cancer-type', default=None, required=True, type=str)
-@click.option('--bins_f', default=None, required=True, type=str)
-@click.option('--metadata_f', default=None, required=True, type=str)
-@click.option('--cov_f', default=None, required=True, type=str)
-@click.option('--url', default=None, required=True, type=str)
-@click.option('--output_f', default=None, required=True, type=str)
-def main(cancer_type, bins_f, metadata_f, cov_f, url, output_f):
-    """Get RNA coverage signal from available Roadmap/ENCODE epigenomes"""
+def ctype_epigenomes(cancer_type, cov_f):
+    """Get epigenomes with RNA data for a cancer type"""
 
-    # Output files
-    output_log = output_f + '.log'
+    # Get epigenomes cancer type specific
+    table2_df = pd.read_csv(cov_f, sep='\t', header=0)
+    ctype_epigenomes = table2_df.loc[table2_df['CANCER_TYPE'] == cancer_type]['DNA_HISTONES_RNA_EPIGENOME'].iloc[0].split(',')
+
+    # Intersect epigenomes for analysis
+    return list(set(available_epigenomes).intersection(set(ctype_epigenomes)))
+
+
+def epigenome_files(url, epigenome, metadata_f):
+    """BigWig files of an epigenome (positive and negative strands, or a single file when not stranded)"""
 
     metadata_df = pd.read_csv(metadata_f, sep='\t', header=0)
     epigenome_names = dict(
         zip(metadata_df['Epigenome ID (EID)'], metadata_df['Epigenome name (from EDACC Release 9 directory)']))
+    fullname = epigenome_names[epigenome]
 
-    # Get epigenomes cancer type specific
-    table2_df = pd.read_csv(cov_f, sep='\t', header=0)
-    ctype_epigenomes = table2_df.loc[table2_df['CANCER_TYPE'] == cancer_type]['DNA_HISTONES_RNA_EPIGENOME'].iloc[0].split(',')
+    # Define file and analysis type (stranded or not)
+    if epigenome not in set(no_strand_epigenomes):
+        return [
+            os.path.join(url, f'{epigenome}.{fullname}.norm.pos.bw'),
+            os.path.join(url, f'{epigenome}.{fullname}.norm.neg.bw')
+        ]
+    else:
+        return [os.path.join(url, f'{epigenome}.{fullname}.norm.bw')]
 
-    # Intersect epigenomes for analysis
-    epigenomes = list(set(available_epigenomes).intersection(set(ctype_epigenomes)))
 
-    # Input bins
+def load_bins(bins_f):
+    """Read bins sorted by coordinates"""
+
     bins_df = pd.read_csv(bins_f, sep='\t', header=0)
     bins_df.sort_values(by=['CHR', 'START'], ascending=[True, True], inplace=True)
 
-    results_per_bin = defaultdict(list)
-    failed_bins = []
-    for epigenome in epigenomes:
-        fullname = epigenome_names[epigenome]
+    return bins_df
 
-        # Define file and analysis type (stranded or not)
-        if epigenome not in set(no_strand_epigenomes):
-            rna_pos_file = os.path.join(url, f'{epigenome}.{fullname}.norm.pos.bw')
-            rna_neg_file = os.path.join(url, f'{epigenome}.{fullname}.norm.neg.bw')
-            rna_pos_bw = pyBigWig.open(rna_pos_file)
-            rna_neg_bw = pyBigWig.open(rna_neg_file)
 
-            # Iterate through bins and get data
-            for _, x in bins_df.iterrows():
-                chrom, start, end, binid = x["CHR"], x["START"], x["END"], x['BINID']
+def epigenome_signal(files, bins_df, batch=False, cache_dir=None):
+    """Get the signal per bin of an epigenome (NaN when the bin cannot be queried) and the failed bins"""
 
-                try:
+    values = np.full(len(bins_df), np.nan)
+    failed = []
+    if len(files) == 2:
+        if cache_dir:
+            batch = True
+            batch_pos = SignalCache(cache_dir, files[0]).batch_stats(bins_df)
+            batch_neg = SignalCache(cache_dir, files[1]).batch_stats(bins_df)
+        else:
+            rna_pos_bw = pyBigWig.open(files[0])
+            rna_neg_bw = pyBigWig.open(files[1])
+            if batch:
+                batch_pos = BatchStats(rna_pos_bw, bins_df)
+                batch_neg = BatchStats(rna_neg_bw, bins_df)
+
+        # Iterate through bins and get data
+        for i, (_, x) in enumerate(bins_df.iterrows()):
+            chrom, start, end, binid = x["CHR"], x["START"], x["END"], x['BINID']
+
+            try:
+                if batch:
+                    bin_data_pos = batch_pos.stats(i)
+                    bin_data_neg = batch_neg.stats(i)
+                else:
                     bin_data_pos = rna_pos_bw.stats(chrom, start, end, type='mean')
                     bin_data_neg = rna_neg_bw.stats(chrom, start, end, type='mean')
 
-                    if bin_data_pos[0]:
-                        bin_data_pos = bin_data_pos[0]
-                    else:
-                        bin_data_pos = 0.0
-                        failed_bins.append((epigenome, binid, 'pos'))
-                    if bin_data_neg[0]:
-                        bin_data_neg = -bin_data_neg[0]    # values are given in negative, check README at FTP
-                    else:
-                        bin_data_neg = 0.0
-                        failed_bins.append((epigenome, binid, 'neg'))
-
-                    # Add up pos and neg strands
-                    bin_data = bin_data_pos + bin_data_neg
-                    results_per_bin[binid].append(bin_data)
-
-                except RuntimeError:
-                    failed_bins.append((epigenome, binid, 'pos_neg'))
+                if bin_data_pos[0]:
+                    bin_data_pos = bin_data_pos[0]
+                else:
+                    bin_data_pos = 0.0
+                    failed.append((binid, 'pos'))
+                if bin_data_neg[0]:
+                    bin_data_neg = -bin_data_neg[0]    # values are given in negative, check README at FTP
+                else:
+                    bin_data_neg = 0.0
+                    failed.append((binid, 'neg'))
+
+                # Add up pos and neg strands
+                values[i] = bin_data_pos + bin_data_neg
+
+            except RuntimeError:
+                failed.append((binid, 'pos_neg'))
+    else:
+        if cache_dir:
+            batch, batch_bw = True, SignalCache(cache_dir, files[0]).batch_stats(bins_df)
         else:
-            file = os.path.join(url, f'{epigenome}.{fullname}.norm.bw')
-            bw = pyBigWig.open(file)
-
-            # Iterate through bins and get data
-            for _, x in bins_df.iterrows():
-                chrom, start, end, binid = x["CHR"], x["START"], x["END"], x['BINID']
-                try:
+            bw = pyBigWig.open(files[0])
+            if batch:
+                batch_bw = BatchStats(bw, bins_df)
+
+        # Iterate through bins and get data
+        for i, (_, x) in enumerate(bins_df.iterrows()):
+            chrom, start, end, binid = x["CHR"], x["START"], x["END"], x['BINID']
+            try:
+                if batch:
+                    bin_data = batch_bw.stats(i)
+                else:
                     bin_data = bw.stats(chrom, start, end, type='mean')
-                    if bin_data[0]:
-                        results_per_bin[binid].append(bin_data[0])
-                    else:
-                        results_per_bin[binid].append(0.0)
-                        failed_bins.append((epigenome, binid, 'unknown'))
-                except RuntimeError:
-                    failed_bins.append((epigenome, binid, 'unknown'))
+                if bin_data[0]:
+                    values[i] = bin_data[0]
+                else:
+                    values[i] = 0.0
+                    failed.append((binid, 'unknown'))
+            except RuntimeError:
+                failed.append((binid, 'unknown'))
+
+    return values, failed
+
+
+def write_results(bins_df, results, output_f):
+    """Write the mean and standard deviation of the signal across epigenomes per bin.
+
+    Results is a list of (epigenome, values, failed) as returned by epigenome_signal for each epigenome
+    """
+
+    output_log = output_f + '.log'
+    results_per_bin = defaultdict(list)
+    failed_bins = []
+    binids = bins_df['BINID'].tolist()
+    for epigenome, values, failed in results:
+        for binid, value in zip(binids, values):
+            if not np.isnan(value):
+                results_per_bin[binid].append(value)
+        failed_bins += [(epigenome, ) + tuple(error) for error in failed]
 
     header = ['CHR', 'START', 'END', 'ID', 'MEAN_SIGNAL', 'STD']
     with gzip.open(output_f, 'wt') as ofd:
@@ -174,5 +221,33 @@ def main(cancer_type, bins_f, metadata_f, cov_f, url, output_f):
             ofd.write('{}\n'.format('\t'.join(list(error))))
 
 
+@click.command()
+@click.option('--cancer-type', default=None, required=True, type=str)
+@click.option('--bins_f', default=None, required=True, type=str)
+@click.option('--metadata_f', default=None, required=True, type=str)
+@click.option('--cov_f', default=None, required=True, type=str)
+@click.option('--url', default=None, required=True, type=str)
+@click.option('--output_f', default=None, required=True, type=str)
+@click.option('--batch', is_flag=True, default=False,
+              help='Read the intervals of each chromosome once per epigenome instead of querying each bin')
+@click.option('--cache_dir', default=None, type=str,
+              help='Read the signal from the cache built with signal_cache.py instead of the bigWig files')
+def main(cancer_type, bins_f, metadata_f, cov_f, url, output_f, batch, cache_dir):
+    """Get RNA coverage signal from available Roadmap/ENCODE epigenomes"""
+
+    # Epigenomes
+    epigenomes = ctype_epigenomes(cancer_type, cov_f)
+
+    # Input bins
+    bins_df = load_bins(bins_f)
+
+    results = []
+    for epigenome in epigenomes:
+        values, failed = epigenome_signal(epigenome_files(url, epigenome, metadata_f), bins_df, batch, cache_dir)
+        results.append((epigenome, values, failed))
+
+    write_results(bins_df, results, output_f)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,159 @@
+"""Cache of bigWig tracks as covered bases and summed signal per fixed-size tile (10 kb by default).
+
+The cache of a track is made of memory-mappable arrays (.bases.npy and .signal.npy, all chromosomes concatenated)
+and an index (.index.json) with the offset of each chromosome. The mean signal of any set of bins (e.g., coarser
+bins or liftover coordinates) is computed from cumulative sums of the tiles without reading the bigWig again.
+Tiles partially overlapping a bin contribute proportionally to the overlap, so the mean is exact for bins aligned
+to the tiles.
+"""
+
+import json
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'mappable_genome'))
+
+import click
+import numpy as np
+import pyBigWig
+
+from bigwig_signal import BatchStats
+from genome_mask import atomic_save
+
+RESOLUTION = 10000
+
+
+def cache_prefix(cache_dir, file):
+    """Prefix of the cache files of a bigWig file (or URL)"""
+
+    return os.path.join(cache_dir, os.path.basename(file))
+
+
+def tiles_signal(intervals, chrom_size, resolution):
+    """Covered bases and summed signal per tile of a chromosome given its bigWig intervals (start, end, value rows)"""
+
+    boundaries = np.minimum(np.arange(0, chrom_size + resolution, resolution, dtype=np.int64), chrom_size)
+    boundaries = np.unique(boundaries)
+    if len(intervals) == 0:
+        return np.zeros(len(boundaries) - 1, dtype=np.int32), np.zeros(len(boundaries) - 1)
+
+    iv_starts = intervals[:, 0]
+    iv_ends = intervals[:, 1]
+    iv_values = intervals[:, 2]
+    lengths = iv_ends - iv_starts
+    cum_bases = np.concatenate([[0.0], np.cumsum(lengths)])
+    cum_signal = np.concatenate([[0.0], np.cumsum(lengths * iv_values)])
+
+    # Covered bases and signal upstream of each tile boundary
+    closed = np.searchsorted(iv_ends, boundaries, side='right')
+    spanning = np.minimum(closed, len(iv_starts) - 1)
+    partial = np.where((closed < len(iv_starts)) & (iv_starts[spanning] < boundaries), boundaries - iv_starts[spanning], 0)
+    bases = cum_bases[closed] + partial
+    signal = cum_signal[closed] + partial * iv_values[spanning]
+
+    return np.diff(bases).astype(np.int32), np.diff(signal)
+
+
+def build_cache(file, cache_dir, resolution=RESOLUTION):
+    """Read a bigWig once and save its covered bases and summed signal per tile"""
+
+    bw = pyBigWig.open(file)
+    index = {'resolution': resolution, 'chromosomes': {}}
+    all_bases, all_signal = [], []
+    offset = 0
+    for chrom, chrom_size in bw.chroms().items():
+        intervals = bw.intervals(chrom)
+        intervals = np.array(intervals, dtype=np.float64) if intervals else np.zeros((0, 3))
+        bases, signal = tiles_signal(intervals, chrom_size, resolution)
+        index['chromosomes'][chrom] = {'offset': offset, 'tiles': len(bases), 'size': chrom_size}
+        all_bases.append(bases)
+        all_signal.append(signal)
+        offset += len(bases)
+    bw.close()
+
+    # Write the index last: a cache is only used when its index exists
+    prefix = cache_prefix(cache_dir, file)
+    for name, values in [('bases', np.concatenate(all_bases)), ('signal', np.concatenate(all_signal))]:
+        atomic_save(f'{prefix}.{name}.npy', lambda ofd: np.save(ofd, values))
+    atomic_save(f'{prefix}.index.json', lambda ofd: json.dump(index, ofd), mode='w')
+
+
+class SignalCache:
+    """Memory-mapped cache of a bigWig track"""
+
+    def __init__(self, cache_dir, file):
+        prefix = cache_prefix(cache_dir, file)
+        with open(f'{prefix}.index.json', 'r') as fd:
+            index = json.load(fd)
+        self.resolution = index['resolution']
+        self.chromosomes = index['chromosomes']
+        self.bases = np.load(f'{prefix}.bases.npy', mmap_mode='r')
+        self.signal = np.load(f'{prefix}.signal.npy', mmap_mode='r')
+
+    def mean_signal(self, chromosomes, starts, ends):
+        """Mean signal of the covered bases of each bin [start, end).
+
+        Returns the same as bigwig_signal.bins_mean_signal: the mean signal per bin (NaN when the bin has no data)
+        and a boolean array marking bins that cannot be queried
+        """
+
+        chromosomes = np.asarray(chromosomes, dtype=object)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        mean = np.full(len(starts), np.nan)
+        errors = np.ones(len(starts), dtype=bool)
+
+        for chrom in np.unique(chromosomes):
+            if chrom not in self.chromosomes:
+                continue
+            info = self.chromosomes[chrom]
+            rows = np.flatnonzero(chromosomes == chrom)
+            rows = rows[(starts[rows] >= 0) & (starts[rows] < ends[rows]) & (ends[rows] <= info['size'])]
+            errors[rows] = False
+
+            tiles = slice(info['offset'], info['offset'] + info['tiles'])
+            bases = np.asarray(self.bases[tiles], dtype=np.float64)
+            signal = np.asarray(self.signal[tiles])
+            tile_sizes = np.minimum(
+                self.resolution, info['size'] - np.arange(info['tiles'], dtype=np.int64) * self.resolution)
+            cum_bases = np.concatenate([[0.0], np.cumsum(bases)])
+            cum_signal = np.concatenate([[0.0], np.cumsum(signal)])
+
+            def upstream(coordinates):
+                """Covered bases and summed signal upstream of each coordinate (partial tiles weighted by overlap)"""
+                tile = np.minimum(coordinates // self.resolution, info['tiles'] - 1)
+                fraction = (coordinates - tile * self.resolution) / tile_sizes[tile]
+                return (cum_bases[tile] + fraction * bases[tile]), (cum_signal[tile] + fraction * signal[tile])
+
+            start_bases, start_signal = upstream(starts[rows])
+            end_bases, end_signal = upstream(ends[rows])
+            covered_bases = end_bases - start_bases
+            covered = covered_bases > 0
+            mean[rows[covered]] = (end_signal - start_signal)[covered] / covered_bases[covered]
+
+        return mean, errors
+
+    def batch_stats(self, bins_df):
+        """Statistics of the bins of a dataframe (CHR, START, END columns) queried as bigwig_signal.BatchStats"""
+
+        return BatchStats.from_signal(
+            *self.mean_signal(bins_df['CHR'].values, bins_df['START'].values, bins_df['END'].values))
+
+
+@click.command()
+@click.option('-f', '--file', default=None, required=True, multiple=True, help='BigWig file or URL (multiple)')
+@click.option('-c', '--cache_dir', default=None, required=True)
+@click.option('-r', '--resolution', default=RESOLUTION, type=int, help='Tile size (bp)')
+def main(file, cache_dir, resolution):
+    """Build the signal cache of bigWig tracks"""
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for f in file:
+        if os.path.exists(f'{cache_prefix(cache_dir, f)}.index.json'):
+            print(f'{f}\tcached')
+            continue
+        build_cache(f, cache_dir, resolution)
+        print(f'{f}\tdone')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Trinucleotide composition of the mappable positions of each bin for several bin sizes.
+
+Each chromosome sequence is read once and encoded as a uint8 array (A=0, C=1, G=2, T=3, other=4). The trinucleotide
+centered at each position is computed with shifted views of the array and collapsed to the 32 pyrimidine-based
+reference trinucleotides (adding up complementary trinucleotides), so the counts per bin are a bincount over the
+mappable positions of the bin. Trinucleotides with other characters than A, C, G and T are not counted.
+"""
+
+from collections import OrderedDict
+import json
+
+from bgreference import hg38
+import click
+import numpy as np
+import pandas as pd
+
+BIN_SIZES = [1000000, 500000, 250000, 100000, 50000, 25000, 10000]
+NUCLEOTIDES = 'ACGT'
+
+# Pyrimidine-based reference trinucleotides
+sorted_trinuc = []
+for n2 in ['C', 'T']:
+    for n1 in NUCLEOTIDES:
+        for n3 in NUCLEOTIDES:
+            sorted_trinuc.append(n1 + n2 + n3)
+
+# Nucleotide code of each character
+ENCODING = np.full(256, 4, dtype=np.uint8)
+for code, nucleotide in enumerate(NUCLEOTIDES):
+    ENCODING[ord(nucleotide)] = code
+
+# Index in sorted_trinuc of each trinucleotide code (16 * n1 + 4 * n2 + n3), the same as its reverse complement
+TRINUC_INDEX = np.zeros(64, dtype=np.int8)
+for code in range(64):
+    n1, n2, n3 = code // 16, code // 4 % 4, code % 4
+    if NUCLEOTIDES[n2] not in 'CT':
+        n1, n2, n3 = 3 - n3, 3 - n2, 3 - n1    # reverse complement
+    TRINUC_INDEX[code] = sorted_trinuc.index(NUCLEOTIDES[n1] + NUCLEOTIDES[n2] + NUCLEOTIDES[n3])
+
+
+def encode(sequence):
+    """Encode a nucleotide sequence as an uint8 array"""
+
+    return ENCODING[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+
+
+def trinucleotide_index(codes):
+    """Index in sorted_trinuc of the trinucleotide centered at each position of an encoded sequence (-1 when the
+    trinucleotide is not defined)"""
+
+    index = np.full(len(codes), -1, dtype=np.int8)
+    if len(codes) < 3:
+        return index
+    left, center, right = codes[:-2], codes[1:-1], codes[2:]
+    valid = (left < 4) & (center < 4) & (right < 4)
+    trinuc = 16 * left + 4 * center + right    # fits in uint8 for valid trinucleotides
+    index[1:-1] = np.where(valid, TRINUC_INDEX[np.where(valid, trinuc, 0)], -1)
+
+    return index
+
+
+def count_intervals(index, starts, ends, rows, n_rows, chunk_size=10000000):
+    """Trinucleotide counts (rows x trinucleotides array) of the positions in the intervals [start, end) of each row"""
+
+    counts = np.zeros(n_rows * len(sorted_trinuc), dtype=np.int64)
+    starts = np.clip(starts, 0, len(index))
+    ends = np.clip(ends, 0, len(index))
+    lengths = np.maximum(ends - starts, 0)
+
+    # Expand the intervals to positions in chunks of about chunk_size positions
+    chunk = np.cumsum(lengths) // chunk_size
+    for c in np.unique(chunk):
+        selected = chunk == c
+        c_starts, c_lengths, c_rows = starts[selected], lengths[selected], rows[selected]
+        offsets = np.cumsum(c_lengths) - c_lengths
+        positions = np.arange(c_lengths.sum()) - np.repeat(offsets - c_starts, c_lengths)
+        trinuc = index[positions]
+        valid = trinuc >= 0
+        counts += np.bincount(
+            np.repeat(c_rows, c_lengths)[valid] * len(sorted_trinuc) + trinuc[valid], minlength=len(counts))
+
+    return counts.reshape(n_rows, len(sorted_trinuc))
+
+
+def load_intervals(bins_f, all_bins_f):
+    """Mappable intervals of the bins and whole bins without mappable intervals.
+
+    Returns a dataframe with CHR, START, END (trinucleotide centers, 0-based half-open) and ROW (bin index) columns
+    and the bin identifiers in order of appearance (bins without mappable intervals at the end)
+    """
+
+    bins_df = pd.read_csv(bins_f, sep='\t', header=0, dtype={'CHR': str})
+    binids = list(OrderedDict.fromkeys(bins_df['BINID']))
+
+    # Bins without mappable positions are counted along the whole bin
+    all_bins_df = pd.read_csv(all_bins_f, sep='\t', header=0, dtype={'CHR': str})
+    missing_bins = sorted(set(all_bins_df['BINID'].unique()).difference(binids))
+    missing = pd.Series(missing_bins, dtype=object).str.extract(r'^([^:]+):(\d+)-(\d+)$')
+    missing_df = pd.DataFrame({
+        'CHR': missing[0].values,
+        'START': np.maximum(missing[1].values.astype(np.int64), 1),
+        'END': missing[2].values.astype(np.int64),
+        'BINID': missing_bins
+    })
+    binids += missing_bins
+
+    intervals_df = pd.concat([bins_df[['CHR', 'START', 'END', 'BINID']], missing_df], ignore_index=True)
+    intervals_df['ROW'] = pd.Categorical(intervals_df['BINID'], categories=binids).codes.astype(np.int64)
+
+    return intervals_df, binids
+
+
+def write_counts(counts, binids, output_f, merged_output_f):
+    """Save the trinucleotide counts per bin (bins as keys) and across bins (trinucleotides as keys)"""
+
+    trinucleotides_per_bin = OrderedDict(
+        [(binid, OrderedDict(zip(sorted_trinuc, bin_counts))) for binid, bin_counts in zip(binids, counts.tolist())])
+    with open(output_f, 'w') as ofd:
+        json.dump(trinucleotides_per_bin, ofd)
+
+    counts_per_trinucleotide = OrderedDict(zip(sorted_trinuc, counts.T.tolist()))
+    with open(merged_output_f, 'w') as ofd:
+        json.dump(counts_per_trinucleotide, ofd)
+
+
+@click.command()
+@click.option('-bs', '--bin_size', default=BIN_SIZES, multiple=True, type=int, help='Bin sizes (bp)')
+@click.option('-b', '--bins_f', default=None, required=True,
+              help='Mappable positions per bin with {bin_name} placeholder '
+                   '(e.g., hg38_{bin_name}_bin.nodrivers.filtered.mappable_positions.autosomes.bed.gz)')
+@click.option('-a', '--all_bins_f', default=None, required=True,
+              help='All positions per bin with {bin_name} placeholder '
+                   '(e.g., hg38_{bin_name}_bin.nodrivers.filtered.all_positions.autosomes.bed.gz)')
+@click.option('-o', '--output_f', default=None, required=True,
+              help='Trinucleotides per bin output file with {bin_name} placeholder')
+@click.option('-om', '--merged_output_f', default=None, required=True,
+              help='Trinucleotides across bins output file with {bin_name} placeholder')
+def main(bin_size, bins_f, all_bins_f, output_f, merged_output_f):
+    """Count the trinucleotides of the mappable positions per bin for several bin sizes reading the genome once"""
+
+    bin_names = [f'{int(size/1000)}kb' for size in bin_size]
+    intervals, binids, counts = {}, {}, {}
+    for bin_name in bin_names:
+        intervals[bin_name], binids[bin_name] = load_intervals(
+            bins_f.format(bin_name=bin_name), all_bins_f.format(bin_name=bin_name))
+        counts[bin_name] = np.zeros((len(binids[bin_name]), len(sorted_trinuc)), dtype=np.int64)
+
+    chromosomes = sorted(set().union(*[set(df['CHR'].unique()) for df in intervals.values()]))
+    for chrom in chromosomes:
+        # Bases up to the right flank of the last position of any bin
+        max_end = max([df.loc[df['CHR'] == chrom, 'END'].max() for df in intervals.values()
+                       if (df['CHR'] == chrom).any()])
+        index = trinucleotide_index(encode(hg38(chrom, 1, size=int(max_end) + 1)))
+        for bin_name, df in intervals.items():
+            chrom_df = df[df['CHR'] == chrom]
+            counts[bin_name] += count_intervals(
+                index, chrom_df['START'].values, chrom_df['END'].values, chrom_df['ROW'].values, len(binids[bin_name]))
+        print(f'{chrom}\tdone')
+
+    for bin_name in bin_names:
+        write_counts(counts[bin_name], binids[bin_name],
+                     output_f.format(bin_name=bin_name), merged_output_f.format(bin_name=bin_name))
+
+
+if __name__ == '__main__':
+    main()
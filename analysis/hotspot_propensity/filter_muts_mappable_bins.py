@@ -1,9 +1,11 @@
-from collections import defaultdict
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'genomic_bins'))
 
 import click
-from intervaltree import IntervalTree
 import pandas as pd
 
+from bin_index import BinIndex
+
 autosomes = list(map(lambda n: f'chr{n}', range(1,23)))
 
 
@@ -11,34 +13,27 @@ autosomes = list(map(lambda n: f'chr{n}', range(1,23)))
 @click.option('-i', '--input_f', default=None, help='Input directory')
 @click.option('-o', '--output_f', default=None, help='Output file')
 @click.option('-b', '--bins_f', default=None, help='Output file')
-def main(input_f, output_f, bins_f):
+@click.option('--chunksize', default=1000000, type=int, help='Number of mutations read at once')
+def main(input_f, output_f, bins_f, chunksize):
     """Filter mutations in mappable bins"""
 
     # Load bins and get those in autosomes
     bins_df = pd.read_csv(bins_f, sep='\t', header=0)
     bins_autosom_df = bins_df.loc[bins_df['CHR'].isin(autosomes)].copy()
 
-    # Load bins into intervaltree
-    tree = defaultdict(IntervalTree)
-    columns = bins_autosom_df.columns
-    for _, row in bins_autosom_df.iterrows():
-        chrom, start, end, binid = [row[c] for c in columns]
-        chrom = chrom[3:]
-        tree[chrom].addi(start, end + 1, binid)  # +1 open end
+    # Load bins into index
+    index = BinIndex.from_bed(bins_autosom_df)
 
     # Filter mutations
     header = ['SAMPLE', 'CHROMOSOME', 'POSITION', 'REF', 'ALT', 'BASE', 'CONTEXT', 'SIGNATURE', 'PROB']
     with open(output_f, 'w') as ofd:
         ofd.write('{}\n'.format('\t'.join(header)))
-        with open(input_f, 'r') as fd:
-            next(fd)
-            for line in fd:
-                # Parse data
-                sample, chrom, pos, ref, alt, base, content, sig, prob = line.strip().split('\t')
-                for interval in tree[chrom][int(pos)]:
-                    ofd.write('{}\n'.format('\t'.join([sample, chrom, pos, ref, alt, base, content, sig, prob])))
+        for muts_df in pd.read_csv(
+                input_f, sep='\t', header=None, skiprows=1, dtype=str, na_filter=False, chunksize=chunksize):
+            # Write each mutation once per overlapping bin, keeping the order of the input
+            rows, _ = index.assign(muts_df[1].values, muts_df[2].values.astype(int))
+            muts_df.iloc[rows].to_csv(ofd, sep='\t', header=False, index=False)
 
 
 if __name__ == '__main__':
     main()
-
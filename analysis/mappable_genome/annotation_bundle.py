@@ -0,0 +1,148 @@
+"""Bundle of the annotations used to filter mutations, compiled once into memory-mappable binary files.
+
+The bundle is a directory with the masks of the mappable genome, the blacklisted regions and the driver regions
+(see genome_mask.py), the population variants index (see variant_index.py) and a manifest (manifest.json) with the
+bundle version, the source files and the SHA-256 checksum of each file of the bundle. The manifest is written
+last, so a bundle is only opened once complete.
+"""
+
+import hashlib
+import json
+import os
+
+import click
+
+from genome_mask import GenomeMask
+from variant_index import VariantIndex
+
+BUNDLE_VERSION = 1
+
+# Annotation name: class
+ANNOTATIONS = {
+    'mappable': GenomeMask,
+    'blacklisted': GenomeMask,
+    'variation': VariantIndex,
+    'drivers': GenomeMask
+}
+
+
+def checksum(file, blocksize=2 ** 20):
+    """SHA-256 checksum of a file"""
+
+    sha = hashlib.sha256()
+    with open(file, 'rb') as fd:
+        for block in iter(lambda: fd.read(blocksize), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def bundle_files(bundle_dir, name):
+    """Files of an annotation of the bundle"""
+
+    prefix = os.path.join(bundle_dir, name)
+    data = 'positions' if ANNOTATIONS[name] is VariantIndex else 'bits'
+
+    return [f'{prefix}.{data}.npy', f'{prefix}.index.json']
+
+
+class AnnotationBundle:
+    """Annotations of a bundle (memory-mapped). Annotations not in the bundle are None"""
+
+    def __init__(self, bundle_dir, manifest, annotations):
+        self.bundle_dir = bundle_dir
+        self.manifest = manifest
+        self.mappable = annotations.get('mappable')
+        self.blacklisted = annotations.get('blacklisted')
+        self.variation = annotations.get('variation')
+        self.drivers = annotations.get('drivers')
+
+    @classmethod
+    def build(cls, bundle_dir, mappable_f, blacklisted_f, variation_f, drivers_f=None):
+        """
+        Compile the annotations into a bundle
+        Args:
+            bundle_dir (path): output directory
+            mappable_f (path): mappable regions (1-based CHR, START, END without header)
+            blacklisted_f (path): blacklisted regions (1-based CHR, START, END without header)
+            variation_f (path): population variants (chromosome and position columns)
+            drivers_f (path): driver regions (1-based CHR, START, END with header), optional
+
+        Returns:
+            bundle (AnnotationBundle): the bundle
+        """
+
+        os.makedirs(bundle_dir, exist_ok=True)
+        sources = {'mappable': mappable_f, 'blacklisted': blacklisted_f, 'variation': variation_f}
+        if drivers_f is not None:
+            sources['drivers'] = drivers_f
+
+        manifest = {'version': BUNDLE_VERSION, 'sources': {}, 'files': {}}
+        for name, file in sources.items():
+            if name == 'variation':
+                annotation = VariantIndex.from_file(file)
+            else:
+                annotation = GenomeMask.from_regions(file, one_based=True, header=0 if name == 'drivers' else None)
+            annotation.save(os.path.join(bundle_dir, name))
+            manifest['sources'][name] = {'file': os.path.abspath(file), 'sha256': checksum(file)}
+            for f in bundle_files(bundle_dir, name):
+                manifest['files'][os.path.basename(f)] = checksum(f)
+            print(f'{name}\tdone')
+
+        manifest_f = os.path.join(bundle_dir, 'manifest.json')
+        with open(f'{manifest_f}.tmp', 'w') as ofd:
+            json.dump(manifest, ofd, indent=2)
+        os.replace(f'{manifest_f}.tmp', manifest_f)
+
+        return cls.open(bundle_dir)
+
+    @classmethod
+    def open(cls, bundle_dir, verify=False):
+        """Open a bundle (checking the checksums of its files if verify)"""
+
+        with open(os.path.join(bundle_dir, 'manifest.json'), 'r') as fd:
+            manifest = json.load(fd)
+        if manifest.get('version') != BUNDLE_VERSION:
+            raise ValueError(f'Bundle {bundle_dir} has version {manifest.get("version")}, '
+                             f'expected {BUNDLE_VERSION}. Please rebuild it')
+        if verify:
+            for file, sha in manifest['files'].items():
+                if checksum(os.path.join(bundle_dir, file)) != sha:
+                    raise ValueError(f'Checksum of {file} does not match the manifest of bundle {bundle_dir}')
+
+        annotations = {}
+        for name in manifest['sources']:
+            annotations[name] = ANNOTATIONS[name].load(os.path.join(bundle_dir, name))
+
+        return cls(bundle_dir, manifest, annotations)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command('build-annotations')
+@click.option('-o', '--bundle_dir', default=None, required=True, help='Output directory of the bundle')
+@click.option('-m', '--mappable_f', default='hg38_100bp.coverage.regions.gz', help='Mappable regions')
+@click.option('-b', '--blacklisted_f', default='ENCFF356LFX.bed.gz', help='Blacklisted regions')
+@click.option('-v', '--variation_f', default='gnomad.genomes.r3.0.sites.allchr.af_0.01.tsv.gz',
+              help='Population variants')
+@click.option('-d', '--drivers_f', default=None, help='Driver genes regions (used by remove_drivers.py)')
+def build_annotations(bundle_dir, mappable_f, blacklisted_f, variation_f, drivers_f):
+    """Compile the filtering annotations into a bundle"""
+
+    AnnotationBundle.build(bundle_dir, mappable_f, blacklisted_f, variation_f, drivers_f)
+
+
+@cli.command('verify')
+@click.option('-i', '--bundle_dir', default=None, required=True, help='Directory of the bundle')
+def verify(bundle_dir):
+    """Check the version and checksums of a bundle"""
+
+    bundle = AnnotationBundle.open(bundle_dir, verify=True)
+    print(f'{bundle_dir}\tOK\t{", ".join(bundle.manifest["sources"])}')
+
+
+if __name__ == '__main__':
+    cli()
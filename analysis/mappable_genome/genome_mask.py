@@ -0,0 +1,170 @@
+"""One bit per base mask of genomic regions (e.g., the mappable genome) that can be memory-mapped.
+
+The mask is saved as the packed bits of all chromosomes (.bits.npy) and an index (.index.json) with the byte offset
+and length of each chromosome. Chromosome names are stored without "chr", and queries accept both formats.
+"""
+
+import json
+import os
+
+import click
+import numpy as np
+import pandas as pd
+
+import intervals
+
+# Number of set bits of each byte value
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.int64)
+
+
+def chromosome_name(chrom):
+    """Chromosome name without "chr" """
+
+    chrom = str(chrom)
+
+    return chrom[3:] if chrom.startswith('chr') else chrom
+
+
+def atomic_save(path, writer, mode='wb'):
+    """
+    Write a file to a temporary file of this process and rename it, so a file is only read once complete and a
+    memory-mapped file is never overwritten
+    Args:
+        path (str): output file
+        writer (function): writes the content to the open temporary file
+        mode (str): mode of the temporary file ('w' for text)
+    """
+
+    tmp = f'{path}.tmp{os.getpid()}'
+    try:
+        with open(tmp, mode) as ofd:
+            writer(ofd)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class GenomeMask:
+    """Bases covered by a set of regions, queried by 1-based position or counted in 0-based [start, end) bins"""
+
+    def __init__(self, bits, chromosomes):
+        self.bits = bits
+        self.chromosomes = chromosomes
+        self._cumulative = {}
+
+    @classmethod
+    def from_intervals(cls, interval_set):
+        """Build the mask from an interval set (chromosome -> 0-based half-open starts and ends, see intervals.py)"""
+
+        chromosomes, all_bits = {}, []
+        offset = 0
+        for chrom, (starts, ends) in interval_set.items():
+            starts, ends = intervals.merge(starts, ends)
+            length = int(ends[-1]) if len(ends) > 0 else 0
+            # Merged intervals are disjoint, so the cumulative sum of the boundaries is 1 inside the regions
+            boundaries = np.zeros(length + 1, dtype=np.int8)
+            boundaries[starts] += 1
+            boundaries[ends] -= 1
+            bits = np.packbits(np.cumsum(boundaries[:-1], dtype=np.int8).astype(bool))
+            chromosomes[chromosome_name(chrom)] = {'offset': offset, 'length': length}
+            all_bits.append(bits)
+            offset += len(bits)
+
+        return cls(np.concatenate(all_bits + [np.array([], dtype=np.uint8)]), chromosomes)
+
+    @classmethod
+    def from_regions(cls, file, one_based=True, header=None):
+        """Build the mask from a file of regions (CHR, START, END in the first three columns)"""
+
+        df = pd.read_csv(file, sep='\t', header=header, usecols=[0, 1, 2])
+        df.columns = ['CHR', 'START', 'END']
+
+        return cls.from_intervals(intervals.from_dataframe(df, one_based=one_based))
+
+    @classmethod
+    def load(cls, prefix):
+        """Open a saved mask (memory-mapped)"""
+
+        with open(f'{prefix}.index.json', 'r') as fd:
+            chromosomes = json.load(fd)
+
+        return cls(np.load(f'{prefix}.bits.npy', mmap_mode='r'), chromosomes)
+
+    def save(self, prefix):
+        """Save the mask (the index is written last, so a mask is only loaded once complete)"""
+
+        atomic_save(f'{prefix}.bits.npy', lambda ofd: np.save(ofd, np.asarray(self.bits)))
+        atomic_save(f'{prefix}.index.json', lambda ofd: json.dump(self.chromosomes, ofd), mode='w')
+
+    def contains(self, chrom, positions):
+        """Whether each 1-based position of a chromosome is in the mask"""
+
+        positions = np.asarray(positions, dtype=np.int64) - 1
+        result = np.zeros(len(positions), dtype=bool)
+        info = self.chromosomes.get(chromosome_name(chrom))
+        if info is None:
+            return result
+        valid = (positions >= 0) & (positions < info['length'])
+        index = positions[valid]
+        byte = np.asarray(self.bits[info['offset'] + index // 8])
+        result[valid] = (byte >> (7 - index % 8)) & 1 == 1
+
+        return result
+
+    def contains_position(self, chrom, position):
+        """Whether a 1-based position of a chromosome is in the mask"""
+
+        info = self.chromosomes.get(chromosome_name(chrom))
+        index = int(position) - 1
+        if info is None or index < 0 or index >= info['length']:
+            return False
+
+        return (int(self.bits[info['offset'] + index // 8]) >> (7 - index % 8)) & 1 == 1
+
+    def count(self, chrom, starts, ends):
+        """Number of bases in the mask in each 0-based half-open interval [start, end) of a chromosome"""
+
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        info = self.chromosomes.get(chromosome_name(chrom))
+        if info is None:
+            return np.zeros(len(starts), dtype=np.int64)
+
+        # Cumulative popcount of the bytes of the chromosome
+        name = chromosome_name(chrom)
+        if name not in self._cumulative:
+            n_bytes = (info['length'] + 7) // 8
+            bits = np.asarray(self.bits[info['offset']:info['offset'] + n_bytes])
+            self._cumulative[name] = (bits, np.concatenate([[0], np.cumsum(POPCOUNT[bits])]))
+        bits, cumulative = self._cumulative[name]
+
+        def upstream(coordinates):
+            """Bases in the mask before each coordinate"""
+            coordinates = np.clip(coordinates, 0, info['length'])
+            byte = coordinates // 8
+            remainder = coordinates % 8
+            partial = np.where(
+                remainder > 0, POPCOUNT[np.asarray(bits[np.minimum(byte, len(bits) - 1)]) >> (8 - remainder)], 0)
+            return cumulative[byte] + partial
+
+        if len(bits) == 0:
+            return np.zeros(len(starts), dtype=np.int64)
+
+        return np.maximum(upstream(ends) - upstream(starts), 0)
+
+
+@click.command()
+@click.option('-i', '--input_f', default=None, required=True, help='Regions file (CHR, START, END)')
+@click.option('-o', '--output_prefix', default=None, required=True, help='Output prefix of the mask files')
+@click.option('--header/--no-header', default=True, help='Whether the regions file has a header')
+@click.option('--one-based/--zero-based', default=True, help='Coordinates of the regions file (1-based or BED)')
+def main(input_f, output_prefix, header, one_based):
+    """Build the bit mask of a regions file (e.g., the mappable genome)"""
+
+    mask = GenomeMask.from_regions(input_f, one_based, 0 if header else None)
+    mask.save(output_prefix)
+
+
+if __name__ == '__main__':
+    main()
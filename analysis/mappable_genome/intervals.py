@@ -0,0 +1,156 @@
+"""Interval set operations on sorted int64 arrays of 0-based half-open [start, end) coordinates.
+
+Interval sets are dictionaries of chromosome -> (starts, ends). Merge follows bedtools merge (overlapping and
+book-ended intervals are merged), subtract and intersect follow bedtools subtract and intersect: each interval of
+the first set is reported as the fragments that do (intersect) or do not (subtract) overlap the second set.
+"""
+
+import numpy as np
+import pandas as pd
+
+MAX_POSITION = np.iinfo(np.int64).max
+
+
+def merge(starts, ends):
+    """Merge overlapping and book-ended intervals. Returns sorted and disjoint starts and ends"""
+
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        return starts, ends
+    order = np.lexsort((ends, starts))
+    starts, ends = starts[order], ends[order]
+
+    # A new interval begins where the start is beyond all the previous ends
+    max_ends = np.maximum.accumulate(ends)
+    first = np.concatenate([[True], starts[1:] > max_ends[:-1]])
+    last = np.concatenate([first[1:], [True]])
+
+    return starts[first], max_ends[last]
+
+
+def complement(starts, ends):
+    """Gaps between sorted and disjoint intervals, from 0 to MAX_POSITION"""
+
+    gap_starts = np.concatenate([[0], ends]).astype(np.int64)
+    gap_ends = np.concatenate([starts, [MAX_POSITION]]).astype(np.int64)
+    keep = gap_starts < gap_ends
+
+    return gap_starts[keep], gap_ends[keep]
+
+
+def intersect(starts, ends, other_starts, other_ends):
+    """Fragments of each interval overlapping sorted and disjoint intervals.
+
+    Returns the starts and ends of the fragments and the index of their interval, in the order of the intervals
+    """
+
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    # Range of the other intervals overlapping each interval
+    first = np.searchsorted(other_ends, starts, side='right')
+    last = np.searchsorted(other_starts, ends, side='left')
+    n_overlaps = np.maximum(last - first, 0)
+
+    index = np.repeat(np.arange(len(starts)), n_overlaps)
+    other = np.arange(n_overlaps.sum()) - np.repeat(np.cumsum(n_overlaps) - n_overlaps - first, n_overlaps)
+    fragment_starts = np.maximum(starts[index], other_starts[other])
+    fragment_ends = np.minimum(ends[index], other_ends[other])
+    keep = fragment_starts < fragment_ends
+
+    return fragment_starts[keep], fragment_ends[keep], index[keep]
+
+
+def subtract(starts, ends, other_starts, other_ends):
+    """Fragments of each interval not overlapping other intervals (any order).
+
+    Returns the starts and ends of the fragments and the index of their interval, in the order of the intervals
+    """
+
+    return intersect(starts, ends, *complement(*merge(other_starts, other_ends)))
+
+
+def from_dataframe(df, chrom='CHR', start='START', end='END', one_based=False):
+    """Interval set from a dataframe (1-based closed coordinates are converted to 0-based half-open)"""
+
+    chromosomes = df[chrom].astype(str).values
+    starts = df[start].values.astype(np.int64) - (1 if one_based else 0)
+    ends = df[end].values.astype(np.int64)
+
+    interval_set = {}
+    for c in pd.unique(chromosomes):
+        rows = chromosomes == c
+        interval_set[c] = (starts[rows], ends[rows])
+
+    return interval_set
+
+
+def to_dataframe(interval_set, one_based=False):
+    """Dataframe with CHR, START and END columns sorted by coordinates (converted to 1-based closed if requested)"""
+
+    chromosomes = [np.full(len(s), c, dtype=object) for c, (s, _) in interval_set.items()]
+    df = pd.DataFrame({
+        'CHR': np.concatenate(chromosomes) if chromosomes else np.array([], dtype=object),
+        'START': np.concatenate([s for s, _ in interval_set.values()] + [np.array([], dtype=np.int64)]),
+        'END': np.concatenate([e for _, e in interval_set.values()] + [np.array([], dtype=np.int64)])
+    })
+    df.sort_values(by=['CHR', 'START', 'END'], inplace=True)
+    if one_based:
+        df['START'] += 1
+    df.reset_index(drop=True, inplace=True)
+
+    return df
+
+
+def merge_sets(interval_sets):
+    """Merge interval sets"""
+
+    chromosomes = []
+    for interval_set in interval_sets:
+        chromosomes += [c for c in interval_set if c not in chromosomes]
+
+    merged = {}
+    for c in chromosomes:
+        merged[c] = merge(
+            np.concatenate([s[c][0] for s in interval_sets if c in s]),
+            np.concatenate([s[c][1] for s in interval_sets if c in s]))
+
+    return merged
+
+
+def merge_chunks(chunks, chrom='CHR', start='START', end='END', one_based=False):
+    """Merge the intervals of an iterable of dataframes (e.g., read with chunksize). Each chunk is merged when read,
+    so only its merged intervals are kept in memory"""
+
+    chunk_sets = []
+    for chunk in chunks:
+        chunk_sets.append(dict([(c, merge(s, e)) for c, (s, e) in
+                                from_dataframe(chunk, chrom, start, end, one_based).items()]))
+
+    return merge_sets(chunk_sets)
+
+
+def subtract_sets(interval_set, other_set):
+    """Subtract an interval set from another (see subtract)"""
+
+    result = {}
+    for c, (starts, ends) in interval_set.items():
+        if c in other_set:
+            starts, ends, _ = subtract(starts, ends, *other_set[c])
+        result[c] = (starts, ends)
+
+    return result
+
+
+def intersect_sets(interval_set, other_set):
+    """Intersect an interval set with another (see intersect)"""
+
+    result = {}
+    for c, (starts, ends) in interval_set.items():
+        if c in other_set:
+            other_starts, other_ends = merge(*other_set[c])
+            starts, ends, _ = intersect(starts, ends, other_starts, other_ends)
+            result[c] = (starts, ends)
+
+    return result
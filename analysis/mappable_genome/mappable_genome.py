@@ -1,59 +1,47 @@
 """Compute mappable genome coordinates"""
 
-import os, sys
-os.environ["PATH"] = os.path.dirname(sys.executable) + os.pathsep + os.environ["PATH"]
-
 import click
 import pandas as pd
-import pybedtools
+
+import intervals
+
 
 @click.command()
 @click.option('-m', '--mappable_regions_f', default=None, help='Mappable regions')
 @click.option('-b', '--mappable_blacklist_f', default=None, help='Blacklisted regions of low mappability')
 @click.option('-pv', '--pop_variants_f', default=None, help='Population variants (blacklisted')
 @click.option('-o', '--output_file', default=None, help='Output file')
-def main(mappable_regions_f, mappable_blacklist_f, pop_variants_f, output_file):
+@click.option('--chunksize', default=1000000, type=int, help='Population variants read at once')
+def main(mappable_regions_f, mappable_blacklist_f, pop_variants_f, output_file, chunksize):
     """
     Create mappable genome annotations: read mappable regions, remove blacklisted regions and population variants
 
     """
 
-    # Load high mappability regions
+    # Load high mappability regions (1-based, transformed to 0-based half-open intervals)
     header = ['CHR', 'START', 'END']
-    df = pd.read_csv(mappable_regions_f, sep='\t', header=None)
-    df.columns = header
-    # Transform to BED format (subtract 1 from start, BED is 0 based)
-    df['START'] = df.apply(lambda x: x['START'] - 1, axis=1)
-    bed_mappable = pybedtools.BedTool.from_dataframe(df)
-
-    # Load blacklisted regions
-    blacklist_map_df = pd.read_csv(mappable_blacklist_f, sep='\t', header=None)
-    blacklist_map_df.columns = header
-
-    # Load population variants
-    blacklist_snp_df = pd.read_csv(pop_variants_f, sep='\t', header=None)
-    blacklist_snp_df = blacklist_snp_df[[0,1]]
-    blacklist_snp_df[2] = blacklist_snp_df[1]
-    blacklist_snp_df.columns = header
-
-    # Concat annotations to exclude
-    blacklist_df = pd.concat([blacklist_map_df, blacklist_snp_df])
-    blacklist_df.sort_values(by=header, axis=0, ascending=True, inplace=True)
-    # Transform to BED format (subtract 1 from start, BED is 0 based)
-    blacklist_df['START'] = blacklist_df.apply(lambda x: x['START'] - 1, axis=1)
-    bed_blacklist = pybedtools.BedTool.from_dataframe(blacklist_df)
-    # Merge
-    bed_blacklist_merged = bed_blacklist.merge()
+    df = pd.read_csv(mappable_regions_f, sep='\t', header=None, names=header, usecols=[0, 1, 2], dtype={'CHR': str})
+    mappable = intervals.from_dataframe(df, one_based=True)
+
+    # Load blacklisted regions (start is also shifted 1 position, as done for the other annotations)
+    blacklist_map_df = pd.read_csv(
+        mappable_blacklist_f, sep='\t', header=None, names=header, usecols=[0, 1, 2], dtype={'CHR': str})
+    blacklist_map = intervals.from_dataframe(blacklist_map_df, one_based=True)
+
+    # Load population variants in chunks, merging the positions of each chunk
+    pop_variants = intervals.merge_chunks(
+        pd.read_csv(pop_variants_f, sep='\t', header=None, usecols=[0, 1], dtype={0: str}, chunksize=chunksize),
+        chrom=0, start=1, end=1, one_based=True)
+
+    # Merge annotations to exclude
+    blacklist = intervals.merge_sets([blacklist_map, pop_variants])
 
     # Compute mappable genome
     # Subtract blacklisted regions from mappable regions
-    mappable_genome_bed = bed_mappable.subtract(bed_blacklist_merged)
+    mappable_genome = intervals.subtract_sets(mappable, blacklist)
 
-    # Return to df and 1-based format
-    mappable_genome_df = pd.read_csv(mappable_genome_bed.fn, sep='\t', header=None)
-    mappable_genome_df.sort_values(by=[0, 1, 2], axis=0, ascending=True, inplace=True)
-    mappable_genome_df.columns = ['CHR', 'START', 'END']
-    mappable_genome_df['START'] = mappable_genome_df.apply(lambda x: x['START'] + 1, axis=1)    # 1 based format
+    # Return to 1-based format
+    mappable_genome_df = intervals.to_dataframe(mappable_genome, one_based=True)
 
     # Save
     mappable_genome_df.to_csv(output_file, sep="\t", compression='gzip', index=None, header=True)
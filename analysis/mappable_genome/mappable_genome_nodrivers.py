@@ -1,11 +1,10 @@
 """Substract driver coordinates from the mappable genome"""
 
-import os, sys
-os.environ["PATH"] = os.path.dirname(sys.executable) + os.pathsep + os.environ["PATH"]
-
 import click
 import pandas as pd
-import pybedtools
+
+import intervals
+
 
 @click.command()
 @click.option('-m', '--mappable_genome_f', default=None, help='Mappable genome regions')
@@ -16,27 +15,20 @@ def main(mappable_genome_f, drivers_f, output_file):
     Remove driver coordinate annotations from the mappable genome
     """
 
-    # Load mappable genome
-    df = pd.read_csv(mappable_genome_f, sep='\t', header=0)
-    # Transform to BED format (subtract 1 from start, BED is 0 based)
-    df['START'] = df.apply(lambda x: x['START'] - 1, axis=1)
-    bed_mappable = pybedtools.BedTool.from_dataframe(df)
+    # Load mappable genome (1-based, transformed to 0-based half-open intervals)
+    df = pd.read_csv(mappable_genome_f, sep='\t', header=0, dtype={'CHR': str})
+    mappable = intervals.from_dataframe(df, one_based=True)
 
     # Load driver regions
-    drivers_df = pd.read_csv(drivers_f, sep='\t', header=0)
-    drivers_df['CHR'] = [f'chr{c}' for c in drivers_df['CHR'].tolist()]
-    # Transform to BED format (subtract 1 from start, BED is 0 based)
-    drivers_df['START'] = drivers_df.apply(lambda x: x['START'] - 1, axis=1)
-    drivers_bed = pybedtools.BedTool.from_dataframe(drivers_df)
+    drivers_df = pd.read_csv(drivers_f, sep='\t', header=0, dtype={'CHR': str})
+    drivers_df['CHR'] = 'chr' + drivers_df['CHR']
+    drivers = intervals.from_dataframe(drivers_df, one_based=True)
 
     # Subtract driver regions from mappable genome
-    mappable_genome_bed = bed_mappable.subtract(drivers_bed)
+    mappable_genome = intervals.subtract_sets(mappable, drivers)
 
-    # Return to df and 1-based format
-    mappable_genome_df = pd.read_csv(mappable_genome_bed.fn, sep='\t', header=None)
-    mappable_genome_df.sort_values(by=[0, 1, 2], axis=0, ascending=True, inplace=True)
-    mappable_genome_df.columns = ['CHR', 'START', 'END']
-    mappable_genome_df['START'] = mappable_genome_df.apply(lambda x: x['START'] + 1, axis=1)    # 1 based format
+    # Return to 1-based format
+    mappable_genome_df = intervals.to_dataframe(mappable_genome, one_based=True)
 
     # Save
     mappable_genome_df.to_csv(output_file, sep="\t", compression='gzip', index=None, header=True)
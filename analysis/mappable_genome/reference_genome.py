@@ -0,0 +1,92 @@
+"""Reference genome sequence queried by batches of positions.
+
+The positions of a batch are sorted and grouped in clusters (consecutive positions at most max_gap bases apart,
+spanning at most max_span bases), and the sequence of each cluster is read with one bgreference call. Only the
+bases around the queried positions are read, whatever the order of the positions, and no chromosome is kept in
+memory.
+"""
+
+import bgreference as bgref
+import numpy as np
+
+
+class Reference:
+    """Reference genome sequence queried by batches of positions"""
+
+    def __init__(self, genome, max_gap=1000, max_span=1000000):
+        self.genome = genome
+        self.max_gap = max_gap
+        self.max_span = max_span
+
+    def clusters(self, positions):
+        """
+        Group sorted positions in clusters read at once
+        Args:
+            positions (numpy.ndarray): sorted positions
+
+        Returns:
+            boundaries (numpy.ndarray): index of the first position of each cluster, followed by the number of
+                positions
+        """
+
+        first = np.ones(len(positions), dtype=bool)
+        first[1:] = np.diff(positions) > self.max_gap
+
+        # Split clusters longer than max_span
+        cluster_start = positions[np.maximum.accumulate(np.where(first, np.arange(len(positions)), 0))]
+        span_id = (positions - cluster_start) // self.max_span
+        first[1:] |= span_id[1:] != span_id[:-1]
+
+        return np.append(np.flatnonzero(first), len(positions))
+
+    def windows(self, chrom, positions, size):
+        """
+        Get the sequence of windows of the same size
+        Args:
+            chrom (str): chromosome
+            positions (numpy.ndarray): 1-based start of each window
+            size (int): length of the windows
+
+        Returns:
+            windows (numpy.ndarray): bytes of each window (rows), 0 outside the chromosome
+        """
+
+        positions = np.asarray(positions, dtype=np.int64)
+        windows = np.zeros((len(positions), size), dtype=np.uint8)
+        order = np.argsort(positions, kind='stable')
+        starts = positions[order]
+        boundaries = self.clusters(starts)
+        for first, last in zip(boundaries[:-1], boundaries[1:]):
+            fetch_start = max(int(starts[first]), 1)
+            fetch_end = int(starts[last - 1]) + size - 1
+            if fetch_end < fetch_start:
+                continue
+            sequence = bgref.refseq(self.genome, chrom, fetch_start, fetch_end - fetch_start + 1)
+            sequence = np.frombuffer(sequence.encode(), dtype=np.uint8)
+            index = starts[first:last, None] - fetch_start + np.arange(size)
+            inside = (index >= 0) & (index < len(sequence))
+            if len(sequence) > 0:
+                windows[order[first:last]] = np.where(inside, sequence[np.clip(index, 0, len(sequence) - 1)], 0)
+
+        return windows
+
+    def matches(self, chrom, positions, sequences):
+        """
+        Check whether sequences are equal to the reference starting at each position
+        Args:
+            chrom (str): chromosome
+            positions (numpy.ndarray): 1-based positions
+            sequences (numpy.ndarray): sequences (str)
+
+        Returns:
+            matches (numpy.ndarray): whether each sequence is equal to the reference
+        """
+
+        matches = np.zeros(len(positions), dtype=bool)
+        lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+        for length in np.unique(lengths):
+            rows = np.flatnonzero(lengths == length)
+            encoded = np.frombuffer(''.join(sequences[rows]).encode(), dtype=np.uint8).reshape(len(rows), length)
+            matches[rows] = (self.windows(chrom, positions[rows], length) == encoded).all(axis=1)
+
+        return matches
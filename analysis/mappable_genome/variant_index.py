@@ -0,0 +1,103 @@
+"""Index of genomic positions (e.g., population variants) as sorted int32 arrays per chromosome that can be
+memory-mapped.
+
+The index is saved as the positions of all chromosomes (.positions.npy) and an index (.index.json) with the offset
+and number of positions of each chromosome. Chromosome names are stored without "chr", and queries accept both
+formats.
+"""
+
+import json
+
+import click
+import numpy as np
+import pandas as pd
+
+from genome_mask import atomic_save, chromosome_name
+
+
+class VariantIndex:
+    """Set of 1-based positions per chromosome"""
+
+    def __init__(self, positions, chromosomes):
+        self.positions = positions
+        self.chromosomes = chromosomes
+
+    @classmethod
+    def from_file(cls, file, chunksize=1000000):
+        """Build the index from a file with chromosome and position in the first two columns (read in chunks)"""
+
+        chunks = {}
+        for chunk in pd.read_csv(file, sep='\t', header=None, usecols=[0, 1], dtype=str, chunksize=chunksize):
+            positions = pd.to_numeric(chunk[1], errors='coerce')
+            valid = positions.notnull().values    # skip the header, if any
+            chunk_chromosomes = chunk[0].values[valid]
+            positions = positions.values[valid].astype(np.int32)
+            for chrom in pd.unique(chunk_chromosomes):
+                chunks.setdefault(chromosome_name(chrom), []).append(positions[chunk_chromosomes == chrom])
+
+        chromosomes, all_positions = {}, []
+        offset = 0
+        for chrom, chrom_chunks in chunks.items():
+            positions = np.unique(np.concatenate(chrom_chunks))
+            chromosomes[chrom] = {'offset': offset, 'size': len(positions)}
+            all_positions.append(positions)
+            offset += len(positions)
+
+        return cls(np.concatenate(all_positions + [np.array([], dtype=np.int32)]), chromosomes)
+
+    @classmethod
+    def load(cls, prefix):
+        """Open a saved index (memory-mapped)"""
+
+        with open(f'{prefix}.index.json', 'r') as fd:
+            chromosomes = json.load(fd)
+
+        return cls(np.load(f'{prefix}.positions.npy', mmap_mode='r'), chromosomes)
+
+    def save(self, prefix):
+        """Save the index (the chromosome index is written last, so an index is only loaded once complete)"""
+
+        atomic_save(f'{prefix}.positions.npy', lambda ofd: np.save(ofd, np.asarray(self.positions)))
+        atomic_save(f'{prefix}.index.json', lambda ofd: json.dump(self.chromosomes, ofd), mode='w')
+
+    def _chromosome(self, chrom):
+        """Sorted positions of a chromosome"""
+
+        info = self.chromosomes.get(chromosome_name(chrom))
+        if info is None:
+            return self.positions[:0]
+
+        return self.positions[info['offset']:info['offset'] + info['size']]
+
+    def contains(self, chrom, positions):
+        """Whether each position of a chromosome is in the index"""
+
+        positions = np.asarray(positions, dtype=np.int64)
+        chrom_positions = self._chromosome(chrom)
+        if len(chrom_positions) == 0:
+            return np.zeros(len(positions), dtype=bool)
+        index = np.minimum(np.searchsorted(chrom_positions, positions), len(chrom_positions) - 1)
+
+        return np.asarray(chrom_positions[index]) == positions
+
+    def contains_position(self, chrom, position):
+        """Whether a position of a chromosome is in the index"""
+
+        chrom_positions = self._chromosome(chrom)
+        index = np.searchsorted(chrom_positions, int(position))
+
+        return bool(index < len(chrom_positions) and chrom_positions[index] == int(position))
+
+
+@click.command()
+@click.option('-i', '--input_f', default=None, required=True, help='Variants file (chromosome and position columns)')
+@click.option('-o', '--output_prefix', default=None, required=True, help='Output prefix of the index files')
+@click.option('--chunksize', default=1000000, type=int, help='Variants read at once')
+def main(input_f, output_prefix, chunksize):
+    """Build the position index of a variants file (e.g., gnomAD variants with allele frequency above 1%)"""
+
+    VariantIndex.from_file(input_f, chunksize).save(output_prefix)
+
+
+if __name__ == '__main__':
+    main()
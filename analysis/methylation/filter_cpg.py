@@ -1,14 +1,17 @@
 import gzip
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'mappable_genome'))
 
 import click
-from collections import defaultdict
-from intervaltree import IntervalTree
 import pandas as pd
 
+from genome_mask import GenomeMask
+
 @click.command()
 @click.option('--input_file', default=None, required=True, type=str)
 @click.option('--output_file', default=None, required=True, type=str)
-@click.option('--mappable_f', default=None, required=True, type=str)
+@click.option('--mappable_f', default=None, required=True, type=str,
+              help='Mappable positions (BED) or prefix of their mask built with genome_mask.py')
 def main(input_file, mappable_f, output_file):
     """
     Intersect CpG sites with mappable (driver free) positions
@@ -16,13 +19,12 @@ def main(input_file, mappable_f, output_file):
 
     log_output = output_file + '.log'
 
-    tree = defaultdict(IntervalTree)
-    with gzip.open(mappable_f, 'rt') as fd:
-        next(fd)  # skip header
-        for line in fd:
-            chrom, start, end, _ = line.strip().split('\t')
-            tree[chrom].addi(int(start) + 1, int(end) + 1)
-            
+    # Mappable positions (BED format) as a bit mask, or a mask built with genome_mask.py
+    if os.path.exists(f'{mappable_f}.index.json'):
+        mask = GenomeMask.load(mappable_f)
+    else:
+        mask = GenomeMask.from_regions(mappable_f, one_based=False, header=0)
+
     # Drop duplicates (two hg19 positions mapping to the same hg38 position)
     # Keep data from the first CpG in hg19
     cpg_df = pd.read_csv(input_file, sep='\t', header=0)
@@ -43,7 +45,7 @@ def main(input_file, mappable_f, output_file):
                 total += 1
                 chromosome = 'chr' + line.strip().split()[0]
                 position = int(line.strip().split()[1])
-                if tree[chromosome][position]:
+                if mask.contains_position(chromosome, position):
                     mappable += 1
                     ofd.write('{}\n'.format('\t'.join(line.strip().split())))
 
@@ -1,9 +1,16 @@
 """Module to compute the probability of a signature in a hotspot"""
 
-from collections import defaultdict
-import gzip
+from multiprocessing import Pool
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'assign_muts_to_sigs'))
 
 import click
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from probability_tensor import ProbabilityTensor
 
 
 def rev_comp(seq):
@@ -58,67 +65,160 @@ artifact_sigs = [
 ]
 
 
+header = ['HOTSPOT_ID', 'CHROMOSOME', 'POSITION', 'MUT_SAMPLES', 'CONTEXT', 'SIGNATURE', 'NAME', 'PROBABILITY']
+
+
+def probabilities_context(context):
+    """Context of the probabilities file (pyrimidine reference, e.g. A[C>T]G) of a hotspot context (e.g. ACG>T)"""
+
+    if context[1] not in 'CT':
+        context = rev_comp(context[:3]) + '>' + rev_comp(context[4])
+
+    return f'{context[0]}[{context[1]}>{context[4]}]{context[2]}'
+
+
+def read_hotspots(hotspots_f):
+    """
+    Read the SNV hotspots of a HotspotFinder results file
+    Args:
+        hotspots_f (path): HotspotFinder results
+
+    Returns:
+        hotspots_df (pandas.DataFrame): HOTSPOT_ID, CHROMOSOME, POSITION, CONTEXT (e.g. ACG>T) and SAMPLES (list of
+            mutated samples) columns
+    """
+
+    df = pd.read_csv(hotspots_f, sep='\t', header=0, usecols=[0, 1, 3, 4, 13, 21], dtype=str, keep_default_na=False)
+    df = df.loc[df.iloc[:, 3] == 'snv']
+    hotspots_df = pd.DataFrame({
+        'HOTSPOT_ID': df.iloc[:, 2].values,
+        'CHROMOSOME': df.iloc[:, 0].values,
+        'POSITION': df.iloc[:, 1].values,
+        'CONTEXT': (df.iloc[:, 4] + '>' + df.iloc[:, 2].str[-1]).values,
+        'SAMPLES': df.iloc[:, 5].str.split(';').values
+    })
+
+    return hotspots_df
+
+
+def hotspots_probabilities(hotspots_df, probabilities, signatures, p_mode):
+    """
+    Probability of the signatures in each hotspot, as the product of a sparse hotspot x (sample, context) incidence
+    matrix and the probabilities of the (sample, context) pairs
+    Args:
+        hotspots_df (pandas.DataFrame): hotspots (see read_hotspots)
+        probabilities (ProbabilityTensor): signature probabilities per sample and context
+        signatures (list): signatures
+        p_mode (str): sum or normsum (normalized sum)
+
+    Returns:
+        hotspots_probs (numpy.ndarray): one row per hotspot and one column per signature
+    """
+
+    # Mutated (sample, context) pairs of each hotspot
+    lengths = hotspots_df['SAMPLES'].map(len).values
+    rows = np.repeat(np.arange(len(hotspots_df)), lengths)
+    contexts = pd.unique(hotspots_df['CONTEXT'].values)
+    contexts_ids = probabilities.contexts.get_indexer([probabilities_context(c) for c in contexts])
+    context_ids = np.repeat(contexts_ids[pd.Index(contexts).get_indexer(hotspots_df['CONTEXT'])], lengths)
+    sample_ids = probabilities.samples.get_indexer(np.concatenate(hotspots_df['SAMPLES'].values)
+                                                   if len(rows) else [])
+
+    # Pairs missing in the probabilities file do not contribute
+    found = (sample_ids >= 0) & (context_ids >= 0)
+    pairs, pair_ids = np.unique(sample_ids[found] * len(probabilities.contexts) + context_ids[found],
+                                return_inverse=True)
+    incidence = sparse.csr_matrix((np.ones(len(pair_ids)), (rows[found], pair_ids.ravel())),
+                                  shape=(len(hotspots_df), len(pairs)))
+    signature_ids = [probabilities.signatures.index(s) for s in signatures]
+    pairs_probs = probabilities.tensor[pairs // len(probabilities.contexts), pairs % len(probabilities.contexts)]
+    pairs_probs = np.nan_to_num(np.asarray(pairs_probs, dtype=np.float64)[:, signature_ids])
+    hotspots_probs = np.asarray(incidence @ pairs_probs)
+
+    # Normalize probabilities if specified
+    if p_mode == 'normsum':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            hotspots_probs = hotspots_probs / hotspots_probs.sum(axis=1, keepdims=True)
+
+    return hotspots_probs
+
+
+def assign_hotspots(unit):
+    """Write the probability of the signatures (except artifacts) in each SNV hotspot"""
+
+    context_probs_f, hotspots_f, output_f, p_mode = unit
+
+    probabilities = ProbabilityTensor.load(context_probs_f, 'float64')
+    signatures = [s for s in probabilities.signatures if s not in artifact_sigs]
+    hotspots_df = read_hotspots(hotspots_f)
+    hotspots_probs = hotspots_probabilities(hotspots_df, probabilities, signatures, p_mode)
+
+    # One row per hotspot and signature
+    names = pd.Series(signatures).map(sigs_names).fillna('Other').values
+    output_df = pd.DataFrame({
+        'HOTSPOT_ID': np.repeat(hotspots_df['HOTSPOT_ID'].values, len(signatures)),
+        'CHROMOSOME': np.repeat(hotspots_df['CHROMOSOME'].values, len(signatures)),
+        'POSITION': np.repeat(hotspots_df['POSITION'].values, len(signatures)),
+        'MUT_SAMPLES': np.repeat(hotspots_df['SAMPLES'].map(len).values, len(signatures)),
+        'CONTEXT': np.repeat(hotspots_df['CONTEXT'].values, len(signatures)),
+        'SIGNATURE': np.tile(np.array(signatures, dtype=object), len(hotspots_df)),
+        'NAME': np.tile(names, len(hotspots_df)),
+        'PROBABILITY': hotspots_probs.ravel()
+    })
+    output_df.to_csv(output_f, sep='\t', header=True, index=False, na_rep='nan')
+
+    return output_f
+
+
 @click.command()
 @click.option('-s', '--context_probs_f', default=None, type=click.Path(exists=True),
               help='Signature probabilities per sample and context')
 @click.option('-h', '--hotspots_f', default=None, help='Directory containing input mutations')
 @click.option('-o', '--output_f', default=None, help='Output file')
-@click.option('-p', '--p_mode', default=None, help='Probabilities as sum or normalized sum')
-def main(context_probs_f, hotspots_f, output_f, p_mode):
-    """"""
-
-    # Load signature probabilities per sample and trinucleotide context
-    probs_dict = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
-    with open(context_probs_f, 'r') as fd:
-        for i, line in enumerate(fd):
-            # Parse data
-            if i > 0:
-                data = line.strip().split('\t')
-                sample = data[0]
-                context = data[1]
-                context_for = context[0] + context[2] + context[-1] + '>' + context[4]
-                context_rev = rev_comp(context[0] + context[2] + context[-1]) + '>' + rev_comp(context[4])
-                probabilities = data[2:]
-                # Load
-                for s, p in list(zip(signatures, probabilities)):
-                    probs_dict[sample][context_for][s] = float(p)
-                    probs_dict[sample][context_rev][s] = float(p)
-            # Parse header
-            else:
-                header = line.strip().split('\t')
-                signatures = header[2:]
-    noartifact_signatures = list(set(signatures).difference(set(artifact_sigs)))
-
-    # Write to output file
-    header = ['HOTSPOT_ID', 'CHROMOSOME', 'POSITION', 'MUT_SAMPLES', 'CONTEXT', 'SIGNATURE', 'NAME', 'PROBABILITY']
-    with open(output_f, 'w') as ofd:
-        ofd.write('{}\n'.format('\t'.join(header)))
-
-        with gzip.open(hotspots_f, 'rt') as fd:
-            next(fd)
-            for line in fd:
-                # Read only SNVs
-                if line.strip().split('\t')[4] == 'snv':
-                    chrom, pos, _, hotspot_id = line.strip().split('\t')[:4]
-                    mutated_samples = line.strip().split('\t')[21].split(';')
-                    context_tri = line.strip().split('\t')[13] + '>' + hotspot_id[-1]
-
-                    # Get probabilities
-                    probs_hotspot = defaultdict(float)
-                    for sample in mutated_samples:
-                        for signature in noartifact_signatures:
-                            probs_hotspot[signature] += float(probs_dict[sample][context_tri][signature])
-                    # Normalize probabilities if specified
-                    if p_mode == 'normsum':
-                        total_p = sum(probs_hotspot.values())
-                        probs_hotspot = dict([(k, v / total_p) for k, v in probs_hotspot.items()])
-                    # Write output
-                    for signature in noartifact_signatures:
-                        line = list(map(str, [
-                            hotspot_id, chrom, pos, len(mutated_samples), context_tri,
-                            signature, sigs_names.get(signature, 'Other'), probs_hotspot[signature]
-                        ]))
-                        ofd.write('{}\n'.format('\t'.join(line)))
+@click.option('-p', '--p_mode', default='sum', type=click.Choice(['sum', 'normsum']),
+              help='Probabilities as sum or normalized sum')
+@click.option('-sd', '--sigs_dir', default=None,
+              help='SigProfilerExtractor output directory of all cancer types (<cancer type>_<sigstype>), '
+                   'processed in one run')
+@click.option('-hd', '--hotspots_dir', default=None,
+              help='Directory with the hotspots of all cancer types (<cancer type>.results.tsv.gz)')
+@click.option('-od', '--output_dir', default=None,
+              help='Output directory (<cancer type>_sigsprobs<suffix>.<p_mode>.txt)')
+@click.option('--suffix', default='', help='Suffix of the output files of all cancer types')
+@click.option('-st', '--sigstype', default='SBS96')
+@click.option('--cores', default=1, type=int)
+def main(context_probs_f, hotspots_f, output_f, p_mode, sigs_dir, hotspots_dir, output_dir, suffix, sigstype, cores):
+    """Compute the probability of each signature in the SNV hotspots"""
+
+    # Single cancer type
+    if sigs_dir is None:
+        if context_probs_f is None or hotspots_f is None or output_f is None:
+            raise click.UsageError('Missing --context_probs_f, --hotspots_f and --output_f, '
+                                   'or --sigs_dir, --hotspots_dir and --output_dir')
+        assign_hotspots((context_probs_f, hotspots_f, output_f, p_mode))
+        return
+
+    # All cancer types
+    if hotspots_dir is None or output_dir is None:
+        raise click.UsageError('Missing --hotspots_dir and --output_dir')
+    os.makedirs(output_dir, exist_ok=True)
+    units = []
+    for entry in sorted(os.scandir(sigs_dir), key=lambda e: e.name):
+        if entry.is_dir() and entry.name.endswith(f'_{sigstype}'):
+            ctype = entry.name[:-len(f'_{sigstype}')]
+            context_probs_f = os.path.join(
+                entry.path, sigstype, 'Suggested_Solution', f'COSMIC_{sigstype}_Decomposed_Solution', 'Activities',
+                'Decomposed_Mutation_Probabilities.txt')
+            hotspots_f = os.path.join(hotspots_dir, f'{ctype}.results.tsv.gz')
+            if not os.path.exists(context_probs_f) or not os.path.exists(hotspots_f):
+                print(f'{ctype}\tmissing input')
+                continue
+            output_f = os.path.join(output_dir, f'{ctype}_sigsprobs{suffix}.{p_mode}.txt')
+            units.append((context_probs_f, hotspots_f, output_f, p_mode))
+
+    with Pool(cores) as pool:
+        for output_f in pool.imap(assign_hotspots, units):
+            print(f'{output_f}\tdone')
 
 
 if __name__ == '__main__':
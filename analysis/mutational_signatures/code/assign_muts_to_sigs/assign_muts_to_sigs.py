@@ -1,9 +1,48 @@
 """Compute likelihood of a mutation arising from a signature"""
 
 import os
-from collections import defaultdict
 
 import click
+import numpy as np
+import pandas as pd
+
+from probability_tensor import ProbabilityTensor
+
+
+def read_seqinfo(file, chunksize):
+    """
+    Read mutations of a SigProfilerMatrixGenerator seqinfo file in chunks
+    Args:
+        file (path): seqinfo file (sample, chromosome, position, context and strand columns, without header)
+        chunksize (int): number of mutations read at once
+
+    Yields:
+        muts_df (pandas.DataFrame): mutations with SAMPLE, CHROMOSOME, POSITION and CONTEXT (trinucleotide) columns
+    """
+
+    for muts_df in pd.read_csv(file, sep='\t', header=None, usecols=[0, 1, 2, 3], dtype=str, na_filter=False,
+                               chunksize=chunksize):
+        muts_df.columns = ['SAMPLE', 'CHROMOSOME', 'POSITION', 'CONTEXT']
+        muts_df['CONTEXT'] = muts_df['CONTEXT'].str[3:-1]
+        yield muts_df
+
+
+def write_rows(ofd, muts_df, probabilities):
+    """Write mutations with their probabilities. Mutations without probabilities are written without them"""
+
+    df = pd.concat([muts_df.reset_index(drop=True), pd.DataFrame(probabilities)], axis=1)
+    missing = np.isnan(probabilities).all(axis=1) if probabilities.shape[1] > 0 else np.zeros(len(df), dtype=bool)
+    if not missing.any():
+        df.to_csv(ofd, sep='\t', header=False, index=False)
+        return
+
+    # Write runs of rows with and without probabilities in order
+    boundaries = np.flatnonzero(np.diff(missing.astype(np.int8))) + 1
+    for start, end in zip(np.concatenate([[0], boundaries]), np.concatenate([boundaries, [len(df)]])):
+        if missing[start]:
+            muts_df.iloc[start:end].to_csv(ofd, sep='\t', header=False, index=False)
+        else:
+            df.iloc[start:end].to_csv(ofd, sep='\t', header=False, index=False)
 
 
 @click.command()
@@ -12,45 +51,29 @@ import click
 @click.option('-m', '--muts_dir', default=None, help='Directory containing input mutations')
 @click.option('-st', '--sigstype', default=None, help='SBS96 or ID83')
 @click.option('-o', '--output_f', default=None, help='Output file')
-def main(context_probs_f, muts_dir, sigstype, output_f):
-    """"""
+@click.option('--dtype', default='float32', type=click.Choice(['float32', 'float64']),
+              help='Precision of the probabilities (float64 keeps the values of the probabilities file)')
+@click.option('--chunksize', default=1000000, type=int, help='Number of mutations read at once')
+def main(context_probs_f, muts_dir, sigstype, output_f, dtype, chunksize):
+    """Write the probabilities of the signatures (sorted by name) of each mutation"""
 
     # Load signature probabilities per sample and trinucleotide context
-    probs_dict = defaultdict(lambda: defaultdict(lambda: defaultdict(float)))
-    with open(context_probs_f, 'r') as fd:
-        for i, line in enumerate(fd):
-            # Parse data
-            if i > 0:
-                data = line.strip().split('\t')
-                sample = data[0]
-                context = data[1]
-                probabilities = data[2:]
-                # Load
-                for s, p in list(zip(signatures, probabilities)):
-                    probs_dict[sample][context][s] = float(p)
-            # Parse header
-            else:
-                header = line.strip().split('\t')
-                signatures = header[2:]
+    probabilities = ProbabilityTensor.load(context_probs_f, dtype)
+    order = np.argsort(np.array(probabilities.signatures, dtype=object), kind='stable')
+    signatures = [probabilities.signatures[i] for i in order]
 
     # Read mutations and assign probabilities
     # Write to output file
     if sigstype == 'SBS96':
-        header = ['SAMPLE', 'CHROMOSOME', 'POSITION', 'CONTEXT'] + sorted(signatures)
+        header = ['SAMPLE', 'CHROMOSOME', 'POSITION', 'CONTEXT'] + signatures
         with open(output_f, 'w') as ofd:
             ofd.write('{}\n'.format('\t'.join(header)))
-            for file in os.scandir(muts_dir):
+            for file in sorted(os.scandir(muts_dir), key=lambda e: e.name):
                 if file.name.endswith('seqinfo.txt'):
-                    with open(file, 'r') as fd:
-                        for line in fd:
-                            sample, chrom, pos, context, _ = line.strip().split('\t')
-                            context_tri = context[3:-1]
-                            line = [sample, chrom, pos, context_tri]
-                            for signature in sorted(probs_dict[sample][context_tri].keys()):
-                                line += [str(probs_dict[sample][context_tri][signature])]
-                            ofd.write('{}\n'.format('\t'.join(line)))
+                    for muts_df in read_seqinfo(file.path, chunksize):
+                        muts_probabilities = probabilities.gather(muts_df['SAMPLE'].values, muts_df['CONTEXT'].values)
+                        write_rows(ofd, muts_df, muts_probabilities[:, order])
 
 
 if __name__ == '__main__':
     main()
-
@@ -1,8 +1,16 @@
 """Assign mutation to the signature with maximum probability"""
 
+from multiprocessing import Pool
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir,
+                                'mappable_genome'))
+
 import click
+import numpy as np
+import pandas as pd
 
-import bgreference as bgref
+from reference_genome import Reference
 
 
 base_dir = {
@@ -12,58 +20,96 @@ base_dir = {
     'T': 'PYRIMIDINE',
 }
 
-def rev_comp(seq):
-    """Compute reverse complementary of a sequence"""
-    comp_nucleotides = {
-        'A': 'T',
-        'C': 'G',
-        'G': 'C',
-        'T': 'A'
-    }
-    return ''.join(list(map(lambda x: comp_nucleotides[x], seq[::-1])))
+comp_nucleotides = {
+    'A': 'T',
+    'C': 'G',
+    'G': 'C',
+    'T': 'A'
+}
+
+genome = 'hg38'
+reference = Reference(genome)
+header = ['SAMPLE', 'CHROMOSOME', 'POSITION', 'REF', 'ALT', 'BASE', 'CONTEXT', 'SIGNATURE', 'PROB']
+
+
+def reference_bases(chromosomes, positions):
+    """Reference base of each position, reading only the sequence around the positions of each chromosome"""
+
+    bases = np.zeros(len(positions), dtype=np.uint8)
+    for chrom in pd.unique(chromosomes):
+        rows = np.flatnonzero(chromosomes == chrom)
+        bases[rows] = reference.windows(chrom, positions[rows], 1)[:, 0]
+
+    return bases.view('S1').astype(str).astype(object)
+
+
+def assign_chunk(unit):
+    """
+    Assign the mutations of a chunk to the signature with maximum probability
+    Args:
+        unit (tuple): mutations (SAMPLE, CHROMOSOME, POSITION and CONTEXT columns followed by the probability of each
+            signature) and signatures
+
+    Returns:
+        lines (str): output rows
+    """
+
+    muts_df, signatures = unit
+    chromosomes = muts_df.iloc[:, 1].values
+    positions = muts_df.iloc[:, 2].values.astype(np.int64)
+    contexts = muts_df.iloc[:, 3]
+    probabilities = muts_df.iloc[:, 4:].values.astype(np.float64)
+
+    # Check reference (the alternate of the context is complemented if the reference is in the other strand)
+    reference_n = reference_bases(chromosomes, positions)
+    alternate_n = contexts.str[4]
+    alternate_n = np.where(reference_n == contexts.str[2].values, alternate_n.values,
+                           alternate_n.map(comp_nucleotides).values)
+    base = pd.Series(reference_n).map(base_dir)
+    if base.isnull().any():
+        row = int(np.flatnonzero(base.isnull().values)[0])
+        raise KeyError(f'Reference base {reference_n[row]} at {chromosomes[row]}:{positions[row]}')
+
+    # Get max prob signature (first signature among ties)
+    max_index = np.argmax(probabilities, axis=1)
+    output_df = pd.DataFrame({
+        'SAMPLE': muts_df.iloc[:, 0].values,
+        'CHROMOSOME': chromosomes,
+        'POSITION': muts_df.iloc[:, 2].values,
+        'REF': reference_n,
+        'ALT': alternate_n,
+        'BASE': base.values,
+        'CONTEXT': contexts.values,
+        'SIGNATURE': np.array(signatures, dtype=object)[max_index],
+        'PROB': probabilities[np.arange(len(probabilities)), max_index]
+    })
+
+    return output_df.to_csv(None, sep='\t', header=False, index=False)
+
 
 @click.command()
 @click.option('-m', '--muts_f', default=None, help='Input mutations file')
 @click.option('-o', '--output_f', default=None, help='Output file')
-def main(muts_f, output_f):
+@click.option('--chunksize', default=1000000, type=int, help='Number of mutations assigned at once')
+@click.option('--cores', default=1, type=int)
+def main(muts_f, output_f, chunksize, cores):
     """Assign a mutation to the signature with maximum probability"""
 
+    signatures = pd.read_csv(muts_f, sep='\t', header=0, nrows=0).columns[4:].tolist()
+    chunks = pd.read_csv(muts_f, sep='\t', header=0, dtype=str, na_filter=False, chunksize=chunksize)
+    units = ((muts_df, signatures) for muts_df in chunks)
+
     # Load mutations per signature
     with open(output_f, 'w') as ofd:
-        header = ['SAMPLE', 'CHROMOSOME', 'POSITION', 'REF', 'ALT', 'BASE', 'CONTEXT', 'SIGNATURE', 'PROB']
         ofd.write('{}\n'.format('\t'.join(header)))
-
-        with open(muts_f, 'r') as fd:
-            for i, line in enumerate(fd):
-
-                # Parse data
-                if i > 0:
-                    data = line.strip().split('\t')
-                    sample, chr, pos, context = data[0:4]
-                    probabilities = list(map(float, data[4:]))
-
-                    # Check reference
-                    reference_n = bgref.refseq('hg38', chr, int(pos), 1)
-                    if reference_n == context[2]:
-                        alternate_n = context[4]
-                        base = base_dir[reference_n]
-                    else:
-                        alternate_n = rev_comp(context[4])
-                        base = base_dir[reference_n]
-
-                    # Get max prob signature
-                    sigs_probs = sorted(list(zip(signatures, probabilities)), key=lambda x: x[1], reverse=True)
-                    max_sig, max_prob = sigs_probs[0]
-                    ofd.write('{}\n'.format('\t'.join(list(map(str, [
-                        sample, chr, pos, reference_n, alternate_n, base, context, max_sig, max_prob
-                    ])))))
-
-                # Parse header
-                else:
-                    input_header = line.strip().split('\t')
-                    signatures = input_header[4:]
+        if cores > 1:
+            with Pool(cores) as pool:
+                for lines in pool.imap(assign_chunk, units):
+                    ofd.write(lines)
+        else:
+            for lines in map(assign_chunk, units):
+                ofd.write(lines)
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,88 @@
+"""Signature probabilities per sample and context (SigProfiler Decomposed_Mutation_Probabilities.txt) as a dense
+[sample, context, signature] tensor.
+
+The tensor is cached next to the probabilities file (<file>.<dtype>.tensor.npy) with an index
+(<file>.<dtype>.tensor.index.json) of the samples, contexts and signatures and the size and modification time of
+the source. The index is written last, so a cache is only used once complete, and is rebuilt if the source changes.
+"""
+
+import json
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir,
+                                'mappable_genome'))
+
+import numpy as np
+import pandas as pd
+
+from genome_mask import atomic_save
+
+
+class ProbabilityTensor:
+    """Probabilities of each signature for each sample and context"""
+
+    def __init__(self, tensor, samples, contexts, signatures):
+        self.tensor = tensor
+        self.samples = pd.Index(samples)
+        self.contexts = pd.Index(contexts)
+        self.signatures = list(signatures)
+
+    @classmethod
+    def from_file(cls, file, dtype='float32'):
+        """Read the probabilities file (sample and context columns followed by one column per signature)"""
+
+        df = pd.read_csv(file, sep='\t', header=0, dtype={0: str, 1: str}, float_precision='round_trip')
+        signatures = list(df.columns[2:])
+        samples, sample_ids = np.unique(df.iloc[:, 0].values, return_inverse=True)
+        contexts = pd.unique(df.iloc[:, 1].values)
+        context_ids = pd.Index(contexts).get_indexer(df.iloc[:, 1].values)
+
+        # Missing (sample, context) pairs are NaN
+        tensor = np.full((len(samples), len(contexts), len(signatures)), np.nan, dtype=dtype)
+        tensor[sample_ids, context_ids] = df.iloc[:, 2:].values.astype(dtype)
+
+        return cls(tensor, samples, contexts, signatures)
+
+    @classmethod
+    def load(cls, file, dtype='float32'):
+        """Open the cached tensor of a probabilities file (memory-mapped), building it if needed"""
+
+        prefix = f'{file}.{dtype}.tensor'
+        source = os.stat(file)
+        if os.path.exists(f'{prefix}.index.json'):
+            with open(f'{prefix}.index.json', 'r') as fd:
+                index = json.load(fd)
+            if index['source'] == [source.st_size, source.st_mtime]:
+                return cls(np.load(f'{prefix}.npy', mmap_mode='r'),
+                           index['samples'], index['contexts'], index['signatures'])
+
+        probabilities = cls.from_file(file, dtype)
+        atomic_save(f'{prefix}.npy', lambda ofd: np.save(ofd, probabilities.tensor))
+        index = {
+            'samples': list(probabilities.samples),
+            'contexts': list(probabilities.contexts),
+            'signatures': probabilities.signatures,
+            'source': [source.st_size, source.st_mtime]
+        }
+        atomic_save(f'{prefix}.index.json', lambda ofd: json.dump(index, ofd), mode='w')
+
+        return probabilities
+
+    def gather(self, samples, contexts):
+        """
+        Probabilities of the signatures of each (sample, context) pair
+        Args:
+            samples (array-like): samples
+            contexts (array-like): contexts
+
+        Returns:
+            probabilities (numpy.ndarray): one row per pair and one column per signature (NaN for missing pairs)
+        """
+
+        sample_ids = self.samples.get_indexer(samples)
+        context_ids = self.contexts.get_indexer(contexts)
+        found = (sample_ids >= 0) & (context_ids >= 0)
+        probabilities = np.full((len(sample_ids), len(self.signatures)), np.nan, dtype=self.tensor.dtype)
+        probabilities[found] = self.tensor[sample_ids[found], context_ids[found]]
+
+        return probabilities
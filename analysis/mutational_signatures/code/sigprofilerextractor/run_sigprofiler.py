@@ -3,11 +3,90 @@ Run Sigprofiler
 Full info at: https://osf.io/t6j7u/wiki/3.%20Using%20the%20Tool%20-%20Input/
 """
 
+from multiprocessing import Pool
+import os
+
 import click
+import numpy as np
+import pandas as pd
+from scipy.optimize import nnls
 from SigProfilerExtractor import sigpro as sig
 
 GENOME = 'GRCh38'
 
+
+def fit_exposures(unit):
+    """
+    Fit the exposures of a batch of samples with non-negative least squares
+    Args:
+        unit (tuple): signatures (contexts x signatures) and counts (contexts x samples) matrices
+
+    Returns:
+        exposures (numpy.ndarray): signatures x samples
+    """
+
+    signatures, counts = unit
+    exposures = np.zeros((signatures.shape[1], counts.shape[1]))
+    for j in range(counts.shape[1]):
+        exposures[:, j], _ = nnls(signatures, counts[:, j])
+
+    return exposures
+
+
+def refit_signatures(input, output, context_type, signatures_f, cores):
+    """
+    Refit the mutations of each sample to a fixed set of signatures (e.g. COSMIC v3.2) and write the activities,
+    signatures and mutation probabilities in the layout of the SigProfilerExtractor suggested solution
+    Args:
+        input (path): mutational matrix (contexts x samples)
+        output (path): output directory
+        context_type (str): context type (e.g. SBS96)
+        signatures_f (path): signatures matrix (contexts x signatures)
+        cores (int): number of processes
+    """
+
+    counts_df = pd.read_csv(input, sep='\t', header=0, index_col=0)
+    signatures_df = pd.read_csv(signatures_f, sep='\t', header=0, index_col=0)
+    missing = counts_df.index.difference(signatures_df.index)
+    if len(missing) > 0:
+        raise ValueError(f'Contexts missing in {signatures_f}: {", ".join(missing)}')
+    signatures_df = signatures_df.reindex(counts_df.index)
+    signatures = signatures_df.values.astype(np.float64)
+    counts = counts_df.values.astype(np.float64)
+
+    # Exposures in batches of samples
+    units = [(signatures, batch) for batch in np.array_split(counts, max(cores, 1), axis=1)]
+    with Pool(cores) as pool:
+        exposures = np.concatenate(pool.map(fit_exposures, units), axis=1)
+
+    # Probability of each signature for each sample and context
+    contributions = exposures.T[:, np.newaxis, :] * signatures[np.newaxis, :, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        probabilities = np.nan_to_num(contributions / contributions.sum(axis=2, keepdims=True))
+
+    # Output
+    solution_dir = os.path.join(output, context_type, 'Suggested_Solution',
+                                f'COSMIC_{context_type}_Decomposed_Solution')
+    os.makedirs(os.path.join(solution_dir, 'Activities'), exist_ok=True)
+    os.makedirs(os.path.join(solution_dir, 'Signatures'), exist_ok=True)
+
+    activities_df = pd.DataFrame(np.rint(exposures.T).astype(np.int64), index=counts_df.columns,
+                                 columns=signatures_df.columns)
+    activities_df.index.name = 'Samples'
+    activities_df.to_csv(os.path.join(solution_dir, 'Activities', f'COSMIC_{context_type}_Activities.txt'),
+                         sep='\t', header=True, index=True)
+
+    signatures_df.index.name = 'MutationType'
+    signatures_df.to_csv(os.path.join(solution_dir, 'Signatures', f'COSMIC_{context_type}_Signatures.txt'),
+                         sep='\t', header=True, index=True)
+
+    probabilities_df = pd.DataFrame(probabilities.reshape(-1, signatures.shape[1]), columns=signatures_df.columns)
+    probabilities_df.insert(0, 'MutationTypes', np.tile(counts_df.index.values, len(counts_df.columns)))
+    probabilities_df.insert(0, 'Sample Names', np.repeat(counts_df.columns.values, len(counts_df.index)))
+    probabilities_df.to_csv(os.path.join(solution_dir, 'Activities', 'Decomposed_Mutation_Probabilities.txt'),
+                            sep='\t', header=True, index=False)
+
+
 @click.command()
 @click.option('-i', '--input', default=None, required=True)
 @click.option('-o', '--output', default=None, required=True)
@@ -15,7 +94,17 @@ GENOME = 'GRCh38'
 @click.option('-ct', '--context-type', default=None, required=True)
 @click.option('--nmf-replicates', default=500, required=True)
 @click.option('--max-sigs', default=20, required=True)
-def main(input, output, cores, context_type, nmf_replicates, max_sigs):
+@click.option('--refit', is_flag=True, help='Fit the samples to the signatures of --signatures (non-negative least '
+                                            'squares) instead of extracting signatures de novo')
+@click.option('-s', '--signatures', default=None, type=click.Path(exists=True),
+              help='Signatures to refit (contexts x signatures), e.g. COSMIC v3.2 or a previous extraction')
+def main(input, output, cores, context_type, nmf_replicates, max_sigs, refit, signatures):
+
+    if refit:
+        if signatures is None:
+            raise click.UsageError('Missing --signatures')
+        refit_signatures(input, output, context_type, signatures, int(cores))
+        return
 
     sig.sigProfilerExtractor(
         input_type='matrix',
@@ -0,0 +1,178 @@
+"""SBS96 matrix and seqInfo files of a cancer type without SigProfilerMatrixGenerator.
+
+Writes the files of SigProfilerMatrixGenerator used downstream, in the same layout:
+<output directory>/output/SBS/<project>.SBS96.all and <output directory>/output/vcf_files/SNV/<chromosome>_seqinfo.txt.
+The transcriptional strand is not computed: seqInfo contexts are written as N:<pentanucleotide context>.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, os.pardir,
+                                'mappable_genome'))
+
+import click
+import numpy as np
+import pandas as pd
+
+from reference_genome import Reference
+
+
+genome = 'hg38'
+reference = Reference(genome)
+nucleotides = 'ACGT'
+contexts_sbs96 = sorted(
+    f'{five}[{ref}>{alt}]{three}'
+    for ref in 'CT' for alt in nucleotides if alt != ref for five in nucleotides for three in nucleotides
+)
+
+# Uppercase of each reference byte (N outside the chromosome), complementary base of each (uppercase) byte, and
+# bases that are valid in a context
+upper_bytes = np.frombuffer(bytes(range(256)).upper(), dtype=np.uint8).copy()
+upper_bytes[0] = ord('N')
+comp_bytes = np.frombuffer(bytes(range(256)), dtype=np.uint8).copy()
+for n, c in zip(b'ACGT', b'TGCA'):
+    comp_bytes[n] = c
+valid_bases = np.zeros(256, dtype=bool)
+valid_bases[list(b'ACGT')] = True
+
+
+def read_snvs(mutations_file, chunksize):
+    """
+    Read the single base substitutions of a mutations file in chunks
+    Args:
+        mutations_file (path): mutations with CHROMOSOME, POSITION, REF, ALT and SAMPLE columns
+        chunksize (int): number of mutations read at once
+
+    Yields:
+        muts_df (pandas.DataFrame): SNVs with CHROMOSOME, POSITION (int), REF, ALT and SAMPLE columns
+    """
+
+    for muts_df in pd.read_csv(mutations_file, sep='\t', header=0, dtype=str, keep_default_na=False,
+                               usecols=['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE'], chunksize=chunksize):
+        ref = muts_df['REF'].str.upper()
+        alt = muts_df['ALT'].str.upper()
+        snv = (ref.str.len() == 1) & (alt.str.len() == 1) & ref.str.match('^[ACGT]$') & alt.str.match('^[ACGT]$')
+        snv &= ref != alt
+        muts_df = muts_df.loc[snv].assign(REF=ref[snv], ALT=alt[snv])
+        muts_df['POSITION'] = muts_df['POSITION'].astype(np.int64)
+        yield muts_df
+
+
+def pentanucleotides(chromosomes, positions):
+    """
+    Reference pentanucleotide centered at each position, reading only the sequence around the positions of each
+    chromosome
+    Args:
+        chromosomes (numpy.ndarray): chromosomes
+        positions (numpy.ndarray): 1-based positions
+
+    Returns:
+        sequences (numpy.ndarray): uppercase bytes, one row of 5 per position (N outside the chromosome)
+    """
+
+    sequences = np.full((len(positions), 5), ord('N'), dtype=np.uint8)
+    for chrom in pd.unique(chromosomes):
+        rows = np.flatnonzero(chromosomes == chrom)
+        sequences[rows] = upper_bytes[reference.windows(chrom, positions[rows] - 2, 5)]
+
+    return sequences
+
+
+def sbs96_contexts(muts_df):
+    """
+    Pyrimidine oriented context of each SNV
+    Args:
+        muts_df (pandas.DataFrame): SNVs (see read_snvs)
+
+    Returns:
+        passed (numpy.ndarray): SNVs whose reference matches the genome and trinucleotide has no N
+        contexts (numpy.ndarray): SBS96 context of the passed SNVs (e.g. A[C>T]G)
+        seqinfo_contexts (numpy.ndarray): seqInfo context of the passed SNVs (e.g. N:AA[C>T]GT)
+        strands (numpy.ndarray): 1 if the reference of the passed SNVs is a pyrimidine, -1 otherwise
+    """
+
+    sequences = pentanucleotides(muts_df['CHROMOSOME'].values, muts_df['POSITION'].values)
+    ref = np.frombuffer(''.join(muts_df['REF'].values).encode(), dtype=np.uint8)
+    alt = np.frombuffer(''.join(muts_df['ALT'].values).encode(), dtype=np.uint8)
+    passed = (sequences[:, 2] == ref) & valid_bases[sequences[:, 1:4]].all(axis=1)
+    sequences, alt = sequences[passed], alt[passed]
+
+    # Reverse complement purine references
+    purine = (sequences[:, 2] == ord('A')) | (sequences[:, 2] == ord('G'))
+    sequences[purine] = comp_bytes[sequences[purine, ::-1]]
+    alt = np.where(purine, comp_bytes[alt], alt)
+
+    # Build the context strings
+    n = len(sequences)
+    columns = [ord('N'), ord(':'), sequences[:, 0], sequences[:, 1], ord('['), sequences[:, 2], ord('>'), alt,
+               ord(']'), sequences[:, 3], sequences[:, 4]]
+    chars = np.empty((n, len(columns)), dtype=np.uint8)
+    for i, column in enumerate(columns):
+        chars[:, i] = column
+    seqinfo_contexts = chars.view('S11').ravel().astype(str)
+    contexts = chars[:, 3:10].copy().view('S7').ravel().astype(str)
+
+    return passed, contexts, seqinfo_contexts, np.where(purine, -1, 1)
+
+
+@click.command()
+@click.option('-i', '--mutations-file', default=None, required=True)
+@click.option('-o', '--output-directory', default=None, required=True,
+              help='Project directory (the input directory of run_sigprofilermatrixgenerator.py)')
+@click.option('-p', '--project', default=None, help='Project name (default: name of the mutations file)')
+@click.option('--chunksize', default=1000000, type=int, help='Number of mutations processed at once')
+def main(mutations_file, output_directory, project, chunksize):
+    """Write the SBS96 matrix and seqInfo files of the SNVs of a mutations file"""
+
+    if project is None:
+        project = mutations_file.split('/')[-1].split('.')[0]
+    matrix_directory = os.path.join(output_directory, 'output', 'SBS')
+    seqinfo_directory = os.path.join(output_directory, 'output', 'vcf_files', 'SNV')
+    os.makedirs(matrix_directory, exist_ok=True)
+    os.makedirs(seqinfo_directory, exist_ok=True)
+
+    counts = {}
+    seqinfo_fds = {}
+    total, passed_total = 0, 0
+    try:
+        for muts_df in read_snvs(mutations_file, chunksize):
+            passed, contexts, seqinfo_contexts, strands = sbs96_contexts(muts_df)
+            muts_df = muts_df.loc[passed]
+            total += len(passed)
+            passed_total += len(muts_df)
+
+            # Counts per sample and context
+            sample_ids, samples = pd.factorize(muts_df['SAMPLE'])
+            context_ids = pd.Categorical(contexts, categories=contexts_sbs96).codes
+            chunk_counts = np.bincount(sample_ids * len(contexts_sbs96) + context_ids,
+                                       minlength=len(samples) * len(contexts_sbs96))
+            for sample, sample_counts in zip(samples, chunk_counts.reshape(len(samples), len(contexts_sbs96))):
+                counts[sample] = counts.get(sample, 0) + sample_counts
+
+            # SeqInfo per chromosome (without chr prefix)
+            seqinfo_df = pd.DataFrame({
+                'SAMPLE': muts_df['SAMPLE'].values,
+                'CHROMOSOME': muts_df['CHROMOSOME'].str.replace('^chr', '', regex=True).values,
+                'POSITION': muts_df['POSITION'].values,
+                'CONTEXT': seqinfo_contexts,
+                'STRAND': strands
+            })
+            for chrom, rows in seqinfo_df.groupby('CHROMOSOME', sort=False).indices.items():
+                if chrom not in seqinfo_fds:
+                    seqinfo_fds[chrom] = open(os.path.join(seqinfo_directory, f'{chrom}_seqinfo.txt'), 'w')
+                seqinfo_df.iloc[rows].to_csv(seqinfo_fds[chrom], sep='\t', header=False, index=False)
+    finally:
+        for fd in seqinfo_fds.values():
+            fd.close()
+
+    # SBS96 matrix (one column per sample, sorted)
+    samples = sorted(counts)
+    matrix_df = pd.DataFrame({sample: counts[sample] for sample in samples}, index=contexts_sbs96, dtype=np.int64)
+    matrix_df.index.name = 'MutationType'
+    matrix_df.to_csv(os.path.join(matrix_directory, f'{project}.SBS96.all'), sep='\t', header=True, index=True)
+
+    print(f'SNVs\t{total}\nPASS\t{passed_total}\nFAIL\t{total - passed_total}')
+
+
+if __name__ == '__main__':
+    main()
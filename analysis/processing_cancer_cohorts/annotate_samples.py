@@ -1,46 +1,123 @@
 """Compute number of mutations per sample"""
 
-from collections import defaultdict
+import json
+from multiprocessing import Pool
+import os
 
-from bgparsers import readers
 import click
+import pandas as pd
+
+mutypes = ['snv', 'mnv', 'ins', 'del']
+header = ['SAMPLE', 'COHORT', 'TYPE', 'AGE', 'SNV', 'MNV', 'INS', 'DEL', 'TOTAL']
+
+
+def samples_table(input_file):
+    """
+    Number of mutations of each type per sample
+    Args:
+        input_file (path): mutations of a cancer type with SAMPLE, COHORT, TYPE, AGE and MUTYPE columns
+
+    Returns:
+        samples_df (pandas.DataFrame): one row per sample (in order of appearance)
+    """
+
+    df = pd.read_csv(input_file, sep='\t', header=0, dtype=str, keep_default_na=False,
+                     usecols=['SAMPLE', 'COHORT', 'TYPE', 'AGE', 'MUTYPE'])
+    grouped = df.groupby('SAMPLE', sort=False)
+    samples_df = grouped[['COHORT', 'TYPE', 'AGE']].first()
+    counts = df.groupby(['SAMPLE', 'MUTYPE'], sort=False).size().unstack(fill_value=0)
+    counts = counts.reindex(index=samples_df.index, columns=mutypes, fill_value=0)
+    for mutype in mutypes:
+        samples_df[mutype.upper()] = counts[mutype].values
+    samples_df['TOTAL'] = counts.values.sum(axis=1)
+
+    return samples_df.reset_index()[header]
+
+
+def hotspots_per_sample(hotspots_file, samples):
+    """
+    Number of hotspots in which each sample is mutated
+    Args:
+        hotspots_file (path): HotspotFinder results (mutated samples in the 22nd column, separated by ";")
+        samples (list): samples
+
+    Returns:
+        counts (list): number of hotspots of each sample (0 for samples without hotspots)
+    """
+
+    hotspots_df = pd.read_csv(hotspots_file, sep='\t', header=0, usecols=[21], dtype=str, keep_default_na=False)
+    mutated_samples = hotspots_df.iloc[:, 0].str.split(';').explode()
+
+    return mutated_samples.value_counts().reindex(samples, fill_value=0).astype(int).tolist()
+
+
+def annotate_ctype(unit):
+    """Write the table of samples of a cancer type. Returns the mutations and hotspots per sample"""
+
+    ctype, input_file, output_file, hotspots_file = unit
+
+    samples_df = samples_table(input_file)
+    samples_df.to_csv(output_file, sep='\t', header=True, index=False)
+    total_mutations = samples_df['TOTAL'].astype(int).tolist()
+    total_hotspots = hotspots_per_sample(hotspots_file, samples_df['SAMPLE']) if hotspots_file else None
+
+    return ctype, total_mutations, total_hotspots
 
 
 @click.command()
-@click.option('-i', '--input-file', default=None, required=True)
-@click.option('-o', '--output-file', default=None, required=True)
-def main(input_file, output_file):
+@click.option('-i', '--input-file', default=None)
+@click.option('-o', '--output-file', default=None)
+@click.option('-d', '--input_dir', default=None, help='Directory with the mutations of all cancer types '
+                                                      '(<cancer type>.*.gz), processed in one run')
+@click.option('-hd', '--hotspots_dir', default=None,
+              help='Directory with the hotspots of all cancer types (<cancer type>.results.tsv.gz)')
+@click.option('-od', '--output_dir', default=None,
+              help='Output directory of the samples tables (<cancer type>.sample_annotations.tsv), '
+                   'total_mutations_per_sample.json and total_hotspots_per_sample.json')
+@click.option('--cores', default=1, type=int)
+def main(input_file, output_file, input_dir, hotspots_dir, output_dir, cores):
     """Compute the number of mutations per sample"""
 
-    # Compute
-    print('Reading mutations...')
-    muts_per_sample = defaultdict(lambda: defaultdict(int))
-    cohorts_d = defaultdict(set)
-    type_d = defaultdict(set)
-    age_d = defaultdict(set)
-    for row in readers.variants(
-            file=input_file,
-            required=['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE'],
-            extra=['COHORT', 'TYPE', 'AGE', 'MUTYPE']
-    ):
-        sample = row['SAMPLE']
-        mutype = row['MUTYPE']
-        muts_per_sample[sample][mutype] += 1
-        cohorts_d[sample].add(row['COHORT'])
-        type_d[sample].add(row['TYPE'])
-        age_d[sample].add(row['AGE'])
-
-    # Write output
-    print('Writing output...')
-    header = ['SAMPLE', 'COHORT', 'TYPE', 'AGE', 'SNV', 'MNV', 'INS', 'DEL', 'TOTAL']
-    with open(output_file, 'w') as ofd:
-        ofd.write('{}\n'.format('\t'.join(header)))
-        for sample, sample_data in muts_per_sample.items():
-            counts = []
-            for mutype in ['snv', 'mnv', 'ins', 'del']:
-                counts += [sample_data[mutype]]
-            ofd.write('{}\n'.format('\t'.join(
-                list(map(str, [sample, list(cohorts_d[sample])[0], list(type_d[sample])[0], list(age_d[sample])[0]] + counts + [sum(counts)])))))
+    # Single file
+    if input_dir is None:
+        if input_file is None or output_file is None:
+            raise click.UsageError('Missing --input-file and --output-file, or --input_dir and --output_dir')
+        print('Reading mutations...')
+        samples_df = samples_table(input_file)
+        print('Writing output...')
+        samples_df.to_csv(output_file, sep='\t', header=True, index=False)
+        print('Finished')
+        return
+
+    # All cancer types
+    if output_dir is None:
+        raise click.UsageError('Missing --output_dir')
+    os.makedirs(output_dir, exist_ok=True)
+    units = []
+    for entry in sorted(os.scandir(input_dir), key=lambda e: e.name):
+        if entry.is_file() and entry.name.endswith('.gz'):
+            ctype = entry.name.split('.')[0]
+            hotspots_file = os.path.join(hotspots_dir, f'{ctype}.results.tsv.gz') if hotspots_dir else None
+            if hotspots_file and not os.path.exists(hotspots_file):
+                print(f'{ctype}\tno hotspots file')
+                hotspots_file = None
+            output_f = os.path.join(output_dir, f'{ctype}.sample_annotations.tsv')
+            units.append((ctype, entry.path, output_f, hotspots_file))
+
+    total_mutations_per_sample = {}
+    total_hotspots_per_sample = {}
+    with Pool(cores) as pool:
+        for ctype, total_mutations, total_hotspots in pool.imap(annotate_ctype, units):
+            total_mutations_per_sample[ctype] = total_mutations
+            if total_hotspots is not None:
+                total_hotspots_per_sample[ctype] = total_hotspots
+            print(f'{ctype}\tdone')
+
+    with open(os.path.join(output_dir, 'total_mutations_per_sample.json'), 'w') as ofd:
+        json.dump(total_mutations_per_sample, ofd)
+    if hotspots_dir:
+        with open(os.path.join(output_dir, 'total_hotspots_per_sample.json'), 'w') as ofd:
+            json.dump(total_hotspots_per_sample, ofd)
     print('Finished')
 
 
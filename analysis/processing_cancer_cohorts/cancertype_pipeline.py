@@ -0,0 +1,141 @@
+"""Filter, merge, remove drivers and keep mutations in mappable bins for a cancer type in one pass.
+
+Batches of mutations of each cohort go through the stages of filter_cohorts.py, merge_cohorts.py, remove_drivers.py
+and hotspot_propensity/filter_muts_mappable_bins.py in memory. The output of each stage can be written (tee) to
+reproduce the files of the separate scripts.
+"""
+
+import gzip
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'mappable_genome'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'genomic_bins'))
+
+import click
+import numpy as np
+import pandas as pd
+
+from annotation_bundle import AnnotationBundle
+from bin_index import BinIndex
+import filter_cohorts as fc
+from genome_mask import GenomeMask
+import merge_cohorts as mc
+
+filtered_header = ['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE', 'MUTYPE']
+autosomes = list(map(lambda n: f'chr{n}', range(1, 23)))
+
+
+class Tee:
+    """Gzip TSV output of a stage (nothing is written without a file)"""
+
+    def __init__(self, file, header):
+        self.fd = gzip.open(file, 'wt') if file else None
+        if self.fd:
+            self.fd.write('{}\n'.format('\t'.join(header)))
+
+    def write(self, df):
+        if self.fd:
+            df.to_csv(self.fd, sep='\t', header=False, index=False)
+
+    def close(self):
+        if self.fd:
+            self.fd.close()
+
+
+@click.command()
+@click.option('-i', '--input-directory', default=None, required=True,
+              help='Input directory where raw cohorts are (cohorts_raw)')
+@click.option('-a', '--cohorts-annotations', default=None, required=True, help='File containing cohort data')
+@click.option('-ct', '--cancertype', default=None, required=True, help='Cancer type name')
+@click.option('-co', '--cohort', default=None, required=True, multiple=True, type=click.STRING,
+              help='Cohort to merge')
+@click.option('-d', '--drivers_f', default=None, help='Driver genes regions')
+@click.option('-b', '--bins_f', default=None, required=True, help='Mappable bins')
+@click.option('-o', '--output_f', default=None, required=True,
+              help='Output file (mutations without drivers in mappable autosomal bins, once per bin)')
+@click.option('--annotations', default=None, type=click.Path(exists=True),
+              help='Annotations bundle built with annotation_bundle.py build-annotations (also used for the driver '
+                   'regions if --drivers_f is not given)')
+@click.option('--filtered_dir', default=None,
+              help='Write the filtered cohorts (<cohort>.filtered.in.gz and .log) in this directory')
+@click.option('--merged_f', default=None, help='Write the merged cancer type to this file')
+@click.option('--nodrivers_f', default=None, help='Write the merged cancer type without drivers to this file')
+@click.option('--chunksize', default=100000, type=int, help='Number of mutations processed at once')
+def main(input_directory, cohorts_annotations, cancertype, cohort, drivers_f, bins_f, output_f, annotations,
+         filtered_dir, merged_f, nodrivers_f, chunksize):
+    """Filter, merge and remove drivers from the cohorts of a cancer type, keeping the mutations in mappable bins"""
+
+    if input_directory.rstrip('/').split('/')[-1] != 'cohorts_raw':
+        raise click.UsageError('The pipeline reads raw cohorts (cohorts_raw directory)')
+
+    # Filter annotations
+    mappable_regions_mask, blacklisted_regions_mask, variation_index = fc.load_annotations(annotations)
+    reference = fc.Reference(fc.genome)
+
+    # Cohort annotations
+    cohorts = list(dict.fromkeys(cohort))
+    cohorts_annotations_df = pd.read_csv(cohorts_annotations, sep='\t', header=0)
+    annotations_df = mc.cohort_annotations(cohorts_annotations_df, cohorts, cancertype)
+
+    # Driver regions
+    if drivers_f is not None:
+        drivers_mask = GenomeMask.from_regions(drivers_f, one_based=True, header=0)
+    else:
+        drivers_mask = AnnotationBundle.open(annotations).drivers if annotations is not None else None
+        if drivers_mask is None:
+            raise click.UsageError('Missing driver regions: use --drivers_f or an annotations bundle with drivers')
+
+    # Mappable bins in autosomes
+    bins_df = pd.read_csv(bins_f, sep='\t', header=0)
+    bins_index = BinIndex.from_bed(bins_df.loc[bins_df['CHR'].isin(autosomes)])
+    print('Annotations loaded')
+
+    if filtered_dir:
+        os.makedirs(filtered_dir, exist_ok=True)
+    merged = Tee(merged_f, mc.header)
+    nodrivers = Tee(nodrivers_f, mc.header)
+    output = Tee(output_f, mc.header)
+    for c in cohorts:
+        filtered = Tee(os.path.join(filtered_dir, f'{c}.filtered.in.gz') if filtered_dir else None, filtered_header)
+        total_mut = 0
+        pass_mut = 0
+        for mutations_df in fc.read_batches(mc.cohort_file(input_directory, c), chunksize):
+            # Filter
+            passed, muttype = fc.filter_mutations(
+                mutations_df, reference, mappable_regions_mask, blacklisted_regions_mask, variation_index)
+            mutations_df = fc.passed_mutations(mutations_df, passed, muttype)
+            filtered.write(mutations_df)
+            total_mut += len(passed)
+            pass_mut += int(passed.sum())
+
+            # Merge
+            mutations_df['COHORT'] = c
+            mutations_df = mutations_df.join(annotations_df, on='COHORT')[mc.header]
+            merged.write(mutations_df)
+
+            # Remove drivers
+            positions = mutations_df['POSITION'].astype(int).values
+            in_drivers = np.zeros(len(mutations_df), dtype=bool)
+            for chrom, rows in mutations_df.groupby('CHROMOSOME', sort=False).indices.items():
+                in_drivers[rows] = drivers_mask.contains(chrom, positions[rows])
+            mutations_df = mutations_df.loc[~in_drivers]
+            nodrivers.write(mutations_df)
+
+            # Mappable bins (each mutation once per overlapping bin)
+            rows, _ = bins_index.assign(mutations_df['CHROMOSOME'].values, mutations_df['POSITION'].astype(int).values)
+            output.write(mutations_df.iloc[rows])
+
+        filtered.close()
+        if filtered_dir:
+            with open(os.path.join(filtered_dir, f'{c}.filtered.in.gz.log'), 'w') as ofd:
+                for name, info in [('TOTAL', total_mut), ('PASS', pass_mut), ('FAIL', total_mut - pass_mut)]:
+                    ofd.write(f'{name}\t{info}\n')
+        print(f'{c}\tdone')
+
+    merged.close()
+    nodrivers.close()
+    output.close()
+
+
+if __name__ == '__main__':
+    main()
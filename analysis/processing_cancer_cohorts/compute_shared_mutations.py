@@ -1,65 +1,113 @@
 """Compute the fraction of shared mutations between samples in a file"""
 
-from collections import defaultdict
 import gzip
 
 import click
+import numpy as np
 import pandas as pd
+from scipy import sparse
+
+header = ['sample1', 'sample2', 'sample1_mutations', 'sample2_mutations', 'sample1_data', 'sample2_data',
+          'shared_mutations', 'sample1_fraction_shared', 'sample2_fraction_shared', 'samples']
+
+
+def incidence_matrix(df, sample='SAMPLE', samples=None):
+    """
+    Sample x mutation matrix with the number of times each sample has each mutation
+    Args:
+        df (pandas.DataFrame): mutations with CHROMOSOME, POSITION, REF, ALT and sample columns
+        sample (str): column identifying the samples
+        samples (array-like): samples of the rows (default: all the samples of df, sorted)
+
+    Returns:
+        samples (numpy.ndarray): sample names (rows)
+        matrix (scipy.sparse.csr_matrix): incidence matrix
+    """
+
+    mutation_ids = df.groupby(by=['CHROMOSOME', 'POSITION', 'REF', 'ALT'], sort=False).ngroup().values
+    if samples is None:
+        samples, sample_ids = np.unique(df[sample].values, return_inverse=True)
+    else:
+        samples = np.asarray(samples)
+        sample_ids = pd.Index(samples).get_indexer(df[sample].values)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(df), dtype=np.int64), (sample_ids, mutation_ids)),
+        shape=(len(samples), mutation_ids.max() + 1 if len(df) > 0 else 0))
+    matrix.sum_duplicates()
+
+    return samples, matrix
+
+
+def shared_pairs(matrix, min_shared=1, min_fraction=0., block_size=1000):
+    """
+    Shared mutations of each pair of samples from the product of the incidence matrix and its transpose, computed
+    by blocks of samples to bound the memory
+    Args:
+        matrix (scipy.sparse.csr_matrix): sample x mutation incidence matrix
+        min_shared (int): minimum number of shared mutations of a pair
+        min_fraction (float): minimum fraction of shared mutations of a pair (the largest of both samples)
+        block_size (int): number of samples (rows) computed at once
+
+    Yields:
+        sample1 (numpy.ndarray): index of the first sample of the pairs (sample1 < sample2)
+        sample2 (numpy.ndarray): index of the second sample of the pairs
+        shared (numpy.ndarray): shared mutations of the pairs
+    """
+
+    total = np.asarray(matrix.sum(axis=1)).ravel()
+    transposed = matrix.T.tocsc()
+    for start in range(0, matrix.shape[0], block_size):
+        block = (matrix[start:start + block_size] @ transposed).tocoo()
+        sample1 = block.row.astype(np.int64) + start
+        sample2 = block.col.astype(np.int64)
+        shared = block.data
+        keep = (sample1 < sample2) & (shared >= min_shared)
+        keep &= np.maximum(shared / total[sample1], shared / total[sample2]) >= min_fraction
+        order = np.lexsort((sample2[keep], sample1[keep]))
+        yield sample1[keep][order], sample2[keep][order], shared[keep][order]
+
 
 @click.command()
 @click.option('-i', '--input-file', default=None, type=click.Path(exists=True),
               help='User input file containing somatic mutations in TSV format')
 @click.option('-o', '--output-file', default=None, help='Output file')
-def main(input_file, output_file):
+@click.option('--min_shared', default=1, type=int, help='Minimum number of shared mutations of the reported pairs')
+@click.option('--min_fraction', default=0., type=float,
+              help='Minimum fraction of shared mutations (of any of the samples) of the reported pairs')
+@click.option('--block_size', default=1000, type=int, help='Number of samples compared at once')
+def main(input_file, output_file, min_shared, min_fraction, block_size):
     """Compute shared mutations for each pair of samples in a file"""
 
     # Read mutations
-    df = pd.read_csv(input_file, header=0, sep='\t', low_memory=False)
+    df = pd.read_csv(input_file, header=0, sep='\t', dtype=str, keep_default_na=False,
+                     usecols=['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE', 'COHORT'])
 
-    # Add mutation identifier
-    df['ID'] = df.apply(lambda x: '{}_{}_{}_{}'.format(x['CHROMOSOME'], x['POSITION'], x['REF'], x['ALT']), axis=1)
-
-    # Compute shared mutations for each pair of samples
-    dic_res = defaultdict(lambda: defaultdict(int))
-    for i, data in df.groupby(by='ID'):
-        sample_list = data['SAMPLE'].tolist()
-        for s in sample_list:
-            for s2 in sample_list:
-                if s2 != s:
-                    dic_res[s][s2] += 1
+    # Sample x mutation incidence matrix
+    samples, matrix = incidence_matrix(df)
 
     # Count total mutations per sample
     # Annotate original cohort
-    muts_per_sample = {}
-    data_per_sample = {}
-    for sample, sample_data in df.groupby('SAMPLE'):
-        muts_per_sample[sample] = len(sample_data['ID'])
-        data_per_sample[sample] = list(sample_data['COHORT'].unique())[0]
-
-    # Write
-    header = ['sample1', 'sample2', 'sample1_mutations', 'sample2_mutations', 'sample1_data', 'sample2_data',
-            'shared_mutations', 'sample1_fraction_shared', 'sample2_fraction_shared']
-    l = []
-    for s1, data in dic_res.items():
-        s1_mutations = muts_per_sample[s1]
-        s1_data = data_per_sample[s1]
-        for s2, shared_mut in data.items():
-            s2_mutations = muts_per_sample[s2]
-            s2_data = data_per_sample[s2]
-            l.append(pd.DataFrame([[
-                s1, s2, s1_mutations, s2_mutations, s1_data, s2_data,
-                shared_mut, shared_mut / s1_mutations, shared_mut / s2_mutations]]))
-    if len(l) > 0: 
-        df = pd.concat(l)
-        df.columns = header
-        df['samples'] = df.apply(lambda x: '::'.join(sorted([x['sample1'], x['sample2']])), axis=1)
-        df2 = df.drop_duplicates(subset='samples')
-        df2.to_csv(output_file, sep='\t', header=True, index=False, compression='gzip')
-    else: 
-        with gzip.open(output_file, 'wt') as ofd: 
-            ofd.write('{}\n'.format('\t'.join(header)))
+    muts_per_sample = np.asarray(matrix.sum(axis=1)).ravel()
+    data_per_sample = df.drop_duplicates(subset='SAMPLE').set_index('SAMPLE')['COHORT'].reindex(samples).values
+
+    # Compute shared mutations for each pair of samples and write
+    with gzip.open(output_file, 'wt') as ofd:
+        ofd.write('{}\n'.format('\t'.join(header)))
+        for s1, s2, shared in shared_pairs(matrix, max(min_shared, 1), min_fraction, block_size):
+            pairs_df = pd.DataFrame({
+                'sample1': samples[s1],
+                'sample2': samples[s2],
+                'sample1_mutations': muts_per_sample[s1],
+                'sample2_mutations': muts_per_sample[s2],
+                'sample1_data': data_per_sample[s1],
+                'sample2_data': data_per_sample[s2],
+                'shared_mutations': shared,
+                'sample1_fraction_shared': shared / muts_per_sample[s1],
+                'sample2_fraction_shared': shared / muts_per_sample[s2],
+            })
+            pairs_df['samples'] = pairs_df['sample1'] + '::' + pairs_df['sample2']
+            pairs_df.to_csv(ofd, sep='\t', header=False, index=False)
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,271 @@
+"""Detect samples sharing mutations (e.g., duplicated donors) across cohorts with containment sketches.
+
+The criterion is the fraction of the mutations of a sample shared with another one (containment), which is high
+for the same donor in an exome and a whole-genome cohort even if their Jaccard similarity is low. Samples (cohort
+and sample name) are read from all files in one streaming pass that keeps a bottom-k sketch of each sample (the k
+mutations with the smallest hashes). A second pass builds an inverted index of the sketch mutations: the fraction
+of the sketch of a sample found in another sample estimates the fraction of the mutations of the sample shared
+with it (exactly for samples with at most k mutations). Pairs whose estimate reaches half of --min_fraction are
+candidates, verified with the exact shared mutations (see compute_shared_mutations.py). The mutations of the
+candidate samples are split by hash in groups of about --max_mutations, each read in a pass over the files, and the
+shared mutations of the candidate pairs are added up over the groups.
+"""
+
+import gzip
+import os
+
+import click
+import numpy as np
+import pandas as pd
+
+from compute_shared_mutations import header, incidence_matrix
+
+
+def read_mutations(files, chunksize):
+    """
+    Read the mutations of several files in chunks. Samples are identified by cohort and sample name, and only the
+    first file with a sample is read for it (e.g., a cohort in a cancer type file and in PANCANCER)
+    Args:
+        files (list): files with CHROMOSOME, POSITION, REF, ALT and SAMPLE columns (and COHORT; the file name
+            is used as cohort otherwise)
+        chunksize (int): number of mutations read at once
+
+    Yields:
+        chunk (pandas.DataFrame): mutations with CHROMOSOME, POSITION, REF, ALT, SAMPLE, COHORT and KEY columns
+    """
+
+    sample_file = {}
+    for i, file in enumerate(files):
+        columns = pd.read_csv(file, sep='\t', header=0, nrows=0).columns
+        usecols = [c for c in ['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE', 'COHORT'] if c in columns]
+        for chunk in pd.read_csv(file, sep='\t', header=0, usecols=usecols, dtype=str, keep_default_na=False,
+                                 chunksize=chunksize):
+            if 'COHORT' not in chunk.columns:
+                chunk['COHORT'] = os.path.basename(file).split('.')[0]
+            chunk['KEY'] = chunk['COHORT'] + '::' + chunk['SAMPLE']
+            for key in pd.unique(chunk['KEY']):
+                sample_file.setdefault(key, i)
+            yield chunk.loc[chunk['KEY'].map(sample_file).values == i]
+
+
+def mutation_hashes(chunk):
+    """64-bit hash of each mutation (chromosome, position, reference and alternate) of a chunk"""
+
+    ids = chunk['CHROMOSOME'] + '_' + chunk['POSITION'] + '_' + chunk['REF'] + '_' + chunk['ALT']
+
+    return pd.util.hash_pandas_object(ids, index=False).values
+
+
+def bottom_k(sample_ids, hashes, k):
+    """
+    Smallest k distinct hashes of each sample
+    Args:
+        sample_ids (numpy.ndarray): sample of each hash
+        hashes (numpy.ndarray): hashes
+        k (int): sketch size
+
+    Returns:
+        sample_ids (numpy.ndarray): sample of each kept hash (sorted by sample and hash)
+        hashes (numpy.ndarray): kept hashes
+    """
+
+    order = np.lexsort((hashes, sample_ids))
+    sample_ids, hashes = sample_ids[order], hashes[order]
+    distinct = np.ones(len(hashes), dtype=bool)
+    distinct[1:] = (sample_ids[1:] != sample_ids[:-1]) | (hashes[1:] != hashes[:-1])
+    sample_ids, hashes = sample_ids[distinct], hashes[distinct]
+
+    # Rank of each hash within its sample
+    first = np.ones(len(hashes), dtype=bool)
+    first[1:] = sample_ids[1:] != sample_ids[:-1]
+    starts = np.flatnonzero(first)
+    rank = np.arange(len(hashes)) - np.repeat(starts, np.diff(np.append(starts, len(hashes))))
+    keep = rank < k
+
+    return sample_ids[keep], hashes[keep]
+
+
+def sample_sketches(files, k=256, chunksize=1000000):
+    """
+    Bottom-k sketch of the set of mutations of each sample
+    Args:
+        files (list): mutations files (see read_mutations)
+        k (int): sketch size
+        chunksize (int): number of mutations read at once
+
+    Returns:
+        keys (list): samples (cohort::sample)
+        sketches (tuple): sample index and hash of the sketch mutations (numpy.ndarray)
+        mutations (numpy.ndarray): number of mutations of each sample
+    """
+
+    sample_index = {}
+    mutations = np.array([], dtype=np.int64)
+    sketch_ids = np.array([], dtype=np.int64)
+    sketch_hashes = np.array([], dtype=np.uint64)
+    for chunk in read_mutations(files, chunksize):
+        if len(chunk) == 0:
+            continue
+        keys, key_ids = np.unique(chunk['KEY'].values, return_inverse=True)
+        columns = np.array([sample_index.setdefault(key, len(sample_index)) for key in keys], dtype=np.int64)
+        chunk_ids = columns[key_ids.ravel()]
+        counts = np.bincount(chunk_ids, minlength=len(sample_index))
+        counts[:len(mutations)] += mutations
+        mutations = counts
+        chunk_ids, chunk_hashes = bottom_k(chunk_ids, mutation_hashes(chunk), k)
+        sketch_ids, sketch_hashes = bottom_k(np.concatenate([sketch_ids, chunk_ids]),
+                                             np.concatenate([sketch_hashes, chunk_hashes]), k)
+
+    return list(sample_index), (sketch_ids, sketch_hashes), mutations
+
+
+def candidate_pairs(files, keys, sketches, min_fraction, chunksize=1000000):
+    """
+    Pairs of samples whose estimated fraction of shared mutations (of any of the samples) is at least half of
+    min_fraction
+    Args:
+        files (list): mutations files (see read_mutations)
+        keys (list): samples (cohort::sample)
+        sketches (tuple): sketches (see sample_sketches)
+        min_fraction (float): minimum fraction of shared mutations of the reported pairs
+        chunksize (int): number of mutations read at once
+
+    Returns:
+        pairs (set): pairs of sample indexes (i < j)
+    """
+
+    sketch_ids, sketch_hashes = sketches
+    sketch_size = np.bincount(sketch_ids, minlength=len(keys))
+    sorted_hashes = np.unique(sketch_hashes)
+    sample_index = dict([(key, i) for i, key in enumerate(keys)])
+
+    # Inverted index: samples with each sketch mutation
+    postings = []
+    for chunk in read_mutations(files, chunksize):
+        hashes = mutation_hashes(chunk)
+        found = np.isin(hashes, sorted_hashes)
+        if found.any():
+            postings.append(pd.DataFrame({
+                'HASH': hashes[found],
+                'OTHER': chunk['KEY'].values[found]
+            }))
+    if not postings:
+        return set()
+    postings_df = pd.concat(postings, ignore_index=True).drop_duplicates()
+    postings_df['OTHER'] = postings_df['OTHER'].map(sample_index).values
+
+    # Sketch mutations of each sample found in other samples
+    hits_df = pd.DataFrame({'SAMPLE': sketch_ids, 'HASH': sketch_hashes}).merge(postings_df, on='HASH')
+    hits_df = hits_df.loc[hits_df['SAMPLE'] != hits_df['OTHER']]
+    hits = hits_df.groupby(['SAMPLE', 'OTHER']).size()
+    samples = hits.index.get_level_values('SAMPLE').values
+    others = hits.index.get_level_values('OTHER').values
+    estimate = hits.values / sketch_size[samples]
+    keep = estimate >= min_fraction / 2
+
+    return set(zip(np.minimum(samples, others)[keep].tolist(), np.maximum(samples, others)[keep].tolist()))
+
+
+def verify_pairs(files, keys, pairs, mutations, max_mutations=20000000, chunksize=1000000, block_size=10000):
+    """
+    Exact shared mutations of candidate pairs of samples. The mutations of the candidate samples are split by hash
+    in groups of about max_mutations, each read in a pass over the files
+    Args:
+        files (list): mutations files (see read_mutations)
+        keys (list): samples (cohort::sample)
+        pairs (set): candidate pairs of sample indexes
+        mutations (numpy.ndarray): number of mutations of each sample (see sample_sketches)
+        max_mutations (int): number of mutations of the candidate samples verified at once
+        chunksize (int): number of mutations read at once
+        block_size (int): number of pairs compared at once
+
+    Returns:
+        pairs_df (pandas.DataFrame): shared mutations of the pairs (columns of compute_shared_mutations.py)
+    """
+
+    candidates = sorted(set([i for pair in pairs for i in pair]))
+    groups = max(1, int(np.ceil(mutations[candidates].sum() / max_mutations)))
+
+    # Sample 1 is the first sample in sorted order, as in compute_shared_mutations.py
+    samples = np.array(sorted([keys[i] for i in candidates]), dtype=object)
+    row = dict([(s, i) for i, s in enumerate(samples)])
+    pairs = sorted(set([tuple(sorted([keys[i], keys[j]])) for i, j in pairs]))
+    s1 = np.array([row[k1] for k1, _ in pairs], dtype=np.int64)
+    s2 = np.array([row[k2] for _, k2 in pairs], dtype=np.int64)
+
+    # Shared mutations added up over groups of mutations (a mutation is always in the same group)
+    shared = np.zeros(len(pairs), dtype=np.int64)
+    muts_per_sample = np.zeros(len(samples), dtype=np.int64)
+    cohort, name = {}, {}
+    for group in range(groups):
+        group_chunks = []
+        for chunk in read_mutations(files, chunksize):
+            chunk = chunk.loc[chunk['KEY'].isin(samples)]
+            group_chunks.append(chunk.loc[mutation_hashes(chunk) % np.uint64(groups) == group])
+        df = pd.concat(group_chunks, ignore_index=True)
+        first = df.drop_duplicates(subset='KEY')
+        cohort.update(zip(first['KEY'], first['COHORT']))
+        name.update(zip(first['KEY'], first['SAMPLE']))
+
+        _, matrix = incidence_matrix(df, sample='KEY', samples=samples)
+        muts_per_sample += np.asarray(matrix.sum(axis=1)).ravel()
+        for start in range(0, len(pairs), block_size):
+            block = slice(start, start + block_size)
+            shared[block] += np.asarray(matrix[s1[block]].multiply(matrix[s2[block]]).sum(axis=1)).ravel()
+
+    pairs_df = pd.DataFrame({
+        'sample1': [name[k] for k in samples[s1]],
+        'sample2': [name[k] for k in samples[s2]],
+        'sample1_mutations': muts_per_sample[s1],
+        'sample2_mutations': muts_per_sample[s2],
+        'sample1_data': [cohort[k] for k in samples[s1]],
+        'sample2_data': [cohort[k] for k in samples[s2]],
+        'shared_mutations': shared,
+        'sample1_fraction_shared': shared / muts_per_sample[s1],
+        'sample2_fraction_shared': shared / muts_per_sample[s2],
+    })
+    pairs_df['samples'] = pairs_df['sample1'] + '::' + pairs_df['sample2']
+
+    return pairs_df
+
+
+@click.command()
+@click.option('-i', '--input-file', default=None, required=True, multiple=True, type=click.Path(exists=True),
+              help='Files containing somatic mutations (e.g., merged cohorts; can be used multiple times)')
+@click.option('-o', '--output-file', default=None, required=True, help='Output file')
+@click.option('--sketch_size', default=256, type=int,
+              help='Number of mutations of the sketch of each sample. Larger sketches miss fewer pairs close to '
+                   '--min_fraction')
+@click.option('--min_shared', default=1, type=int, help='Minimum number of shared mutations of the reported pairs')
+@click.option('--min_fraction', default=0.1, type=float,
+              help='Minimum fraction of shared mutations (of any of the samples) of the reported pairs')
+@click.option('--max_mutations', default=20000000, type=int,
+              help='Number of mutations of the candidate samples verified at once (more are verified in several '
+                   'passes over the files)')
+@click.option('--chunksize', default=1000000, type=int, help='Number of mutations read at once')
+def main(input_file, output_file, sketch_size, min_shared, min_fraction, max_mutations, chunksize):
+    """Find pairs of samples sharing mutations across files"""
+
+    files = list(input_file)
+
+    # Sketches
+    keys, sketches, mutations = sample_sketches(files, sketch_size, chunksize)
+    print(f'{len(keys)} samples')
+
+    # Candidates
+    pairs = candidate_pairs(files, keys, sketches, min_fraction, chunksize)
+    print(f'{len(pairs)} candidate pairs')
+
+    # Verify candidates
+    with gzip.open(output_file, 'wt') as ofd:
+        ofd.write('{}\n'.format('\t'.join(header)))
+        if len(pairs) == 0:
+            return
+        pairs_df = verify_pairs(files, keys, pairs, mutations, max_mutations, chunksize)
+        keep = (pairs_df['shared_mutations'] >= min_shared) & (np.maximum(
+            pairs_df['sample1_fraction_shared'], pairs_df['sample2_fraction_shared']) >= min_fraction)
+        pairs_df.loc[keep].to_csv(ofd, sep='\t', header=False, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Filter several cohorts at once, sharing the annotations between workers and splitting cohorts by chromosome"""
+
+import gzip
+import heapq
+from multiprocessing import Pool
+import os
+import shutil
+import tempfile
+
+from bgparsers import readers
+import click
+import numpy as np
+import pandas as pd
+
+import filter_cohorts as fc
+
+# Mappability, blacklist and population variants, loaded once before the workers are forked
+SHARED = {}
+
+columns = ['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'ALT_TYPE', 'SAMPLE']
+
+
+def chromosome_shards(n_shards):
+    """Groups of chromosomes (largest chromosomes are spread across groups)"""
+
+    n_shards = max(1, min(n_shards, len(fc.chromosomes)))
+
+    return [fc.chromosomes[i::n_shards] for i in range(n_shards)]
+
+
+def split_cohort(unit):
+    """
+    Split the mutations of a cohort into one file per chromosome shard, keeping the row number of each mutation
+    Args:
+        unit (tuple): cohort, input file, temporary directory and chromosome shards
+
+    Returns:
+        cohort (str): cohort name
+        total (int): number of mutations
+        skipped (int): number of mutations outside the chromosomes (failing the filters)
+    """
+
+    cohort, input_file, tmp_dir, shards = unit
+    shard_of = dict([(chrom, i) for i, shard in enumerate(shards) for chrom in shard])
+    fds = [open(os.path.join(tmp_dir, f'{cohort}.{i}.tsv'), 'w') for i in range(len(shards))]
+    for fd in fds:
+        fd.write('{}\n'.format('\t'.join(['ROW'] + columns)))
+
+    total = 0
+    skipped = 0
+    for row in readers.variants(
+            file=input_file,
+            required=['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE']
+    ):
+        shard = shard_of.get(row['CHROMOSOME'])
+        if shard is None:
+            skipped += 1
+        else:
+            fds[shard].write('{}\n'.format('\t'.join(map(str, [total] + [row[c] for c in columns]))))
+        total += 1
+
+    for fd in fds:
+        fd.close()
+
+    return cohort, total, skipped
+
+
+def filter_shard(unit):
+    """
+    Filter the mutations of a chromosome shard of a cohort
+    Args:
+        unit (tuple): cohort, shard number, temporary directory and number of mutations filtered at once
+
+    Returns:
+        cohort (str): cohort name
+        passed (int): number of mutations passing the filters
+        failed (int): number of mutations failing the filters
+    """
+
+    cohort, shard, tmp_dir, chunksize = unit
+    shard_file = os.path.join(tmp_dir, f'{cohort}.{shard}.tsv')
+    reference = fc.Reference(fc.genome)
+
+    passed_mut = 0
+    failed_mut = 0
+    with open(os.path.join(tmp_dir, f'{cohort}.{shard}.filtered.tsv'), 'w') as ofd:
+        for mutations_df in pd.read_csv(shard_file, sep='\t', header=0, dtype=str, keep_default_na=False,
+                                        chunksize=chunksize):
+            mutations_df['POSITION'] = mutations_df['POSITION'].astype(np.int64)
+            passed, muttype = fc.filter_mutations(
+                mutations_df, reference, SHARED['mappable'], SHARED['blacklisted'], SHARED['variation'])
+            passed_df = mutations_df.loc[passed, ['ROW', 'CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE']]
+            passed_df['MUTYPE'] = muttype[passed]
+            passed_df.to_csv(ofd, sep='\t', header=False, index=False)
+            passed_mut += int(passed.sum())
+            failed_mut += len(passed) - int(passed.sum())
+    os.remove(shard_file)
+
+    return cohort, passed_mut, failed_mut
+
+
+def merge_shards(cohort, n_shards, tmp_dir, output_file):
+    """Merge the filtered shards of a cohort in the order of the input file"""
+
+    def read_shard(file):
+        with open(file, 'r') as fd:
+            for line in fd:
+                row, mutation = line.split('\t', 1)
+                yield int(row), mutation
+
+    files = [os.path.join(tmp_dir, f'{cohort}.{i}.filtered.tsv') for i in range(n_shards)]
+    header = ['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE', 'MUTYPE']
+    with gzip.open(output_file, 'wt') as ofd:
+        ofd.write('{}\n'.format('\t'.join(header)))
+        for _, mutation in heapq.merge(*[read_shard(file) for file in files]):
+            ofd.write(mutation)
+    for file in files:
+        os.remove(file)
+
+
+@click.command()
+@click.option('-i', '--input_dir', default=None, required=True, type=click.Path(exists=True),
+              help='Directory with the cohorts somatic mutations files (<cohort>.*.gz)')
+@click.option('-o', '--output_dir', default=None, required=True, help='Output directory')
+@click.option('-c', '--cohort', default=None, multiple=True,
+              help='Cohorts (can be used multiple times). Default: all cohorts in the input directory')
+@click.option('--shards', default=4, type=int, help='Number of chromosome shards per cohort')
+@click.option('--chunksize', default=100000, type=int, help='Number of mutations filtered at once')
+@click.option('-a', '--annotations', default=None, type=click.Path(exists=True),
+              help='Annotations bundle built with annotation_bundle.py build-annotations')
+@click.option('--cores', default=1, type=int)
+def main(input_dir, output_dir, cohort, shards, chunksize, annotations, cores):
+    """Filter cohorts of mutations using HotspotFinder filters (see filter_cohorts.py)"""
+
+    # Cohorts
+    cohorts = {}
+    for entry in sorted(os.scandir(input_dir), key=lambda e: e.name):
+        name = entry.name.split('.')[0]
+        if entry.is_file() and entry.name.endswith('.gz') and (not cohort or name in cohort):
+            cohorts[name] = entry.path
+
+    # Shared data
+    SHARED['mappable'], SHARED['blacklisted'], SHARED['variation'] = fc.load_annotations(annotations)
+    print('Annotations loaded')
+
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=output_dir)
+    chrom_shards = chromosome_shards(shards)
+    counts = dict([(c, {'TOTAL': 0, 'PASS': 0, 'FAIL': 0}) for c in cohorts])
+    pool = Pool(cores) if cores > 1 else None
+    imap = pool.imap_unordered if pool else map
+    try:
+        # Split cohorts by chromosome
+        units = [(c, f, tmp_dir, chrom_shards) for c, f in cohorts.items()]
+        for c, total, skipped in imap(split_cohort, units):
+            counts[c]['TOTAL'] += total
+            counts[c]['FAIL'] += skipped
+
+        # Filter shards
+        units = [(c, i, tmp_dir, chunksize) for c in cohorts for i in range(len(chrom_shards))]
+        for c, passed, failed in imap(filter_shard, units):
+            counts[c]['PASS'] += passed
+            counts[c]['FAIL'] += failed
+
+        # Merge shards
+        for c in cohorts:
+            output_file = os.path.join(output_dir, f'{c}.filtered.in.gz')
+            merge_shards(c, len(chrom_shards), tmp_dir, output_file)
+            with open(output_file + '.log', 'w') as ofd:
+                for name in ['TOTAL', 'PASS', 'FAIL']:
+                    ofd.write(f'{name}\t{counts[c][name]}\n')
+            print(f'{c}\tdone')
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,20 @@
 """Remove mutations that do not pass our filters and/or are complex indels"""
 
-from collections import defaultdict
 import gzip
+from itertools import islice
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'mappable_genome'))
 
-import bgreference as bgref
 from bgparsers import readers
 import click
-from intervaltree import IntervalTree
+import numpy as np
+import pandas as pd
+
+from annotation_bundle import AnnotationBundle
+from genome_mask import GenomeMask
+from reference_genome import Reference
+from variant_index import VariantIndex
 
 # Global variables
 chromosomes = list(map(str, range(1, 23))) + ['X', 'Y']
@@ -16,177 +24,213 @@ mappable_regions = 'hg38_100bp.coverage.regions.gz'
 blacklisted_regions = 'ENCFF356LFX.bed.gz'
 population_variants = 'gnomad.genomes.r3.0.sites.allchr.af_0.01.tsv.gz'
 
+# Alternates of substitutions accepted by the alternate filter (alt in nucleotides)
+nucleotides_substrings = set([nucleotides[i:j] for i in range(len(nucleotides) + 1) for j in range(i, len(nucleotides) + 1)])
+# Bases accepted by the context filter (0 marks positions outside the chromosome, which are not checked)
+valid_bases = np.zeros(256, dtype=bool)
+valid_bases[[ord(n) for n in nucleotides] + [0]] = True
+
 
-def load_mappability(file, chr_format='chrN'):
+def load_mappability(file):
     """
-    Load mappability regions into intervaltree
+    Load mappability regions into a bit mask. The mask is built the first time and saved next to the file
     Args:
-        file (path): path to file containing mappability data
-        chr_format (str): chromosome format used in file. 
+        file (path): path to file containing mappability data (1-based CHR, START, END without header)
 
     Returns:
-        tree (dict): tree with regions, keys are chromosomes, data are regions
+        mask (GenomeMask): mask of the positions in the regions (chromosomes with or without "chr")
     """
 
-    tree = defaultdict(IntervalTree)
-    trim = 3 if chr_format == 'chrN' else None
-    with gzip.open(file, 'rt') as fd:
-        for line in fd:
-            chrom, start, end = line.strip().split('\t')
-            tree[chrom[trim:]].addi(int(start), int(end) + 1)  # +1 interval
-    return tree
+    prefix = f'{file}.mask'
+    if os.path.exists(f'{prefix}.index.json'):
+        return GenomeMask.load(prefix)
+    mask = GenomeMask.from_regions(file, one_based=True, header=None)
+    mask.save(prefix)
+    return mask
 
 
-def load_variation(file, chr_format='chrN'):
+def load_variation(file):
     """
-    Load population variants into set
+    Load population variants into a position index. The index is built the first time and saved next to the file
     Args:
         file (path): path to file containing population variants data
-        chr_format (str): chromosome format used in file. 
 
     Returns:
-        set_of_interest (set): set with variants annotated as 'N_position'
+        index (VariantIndex): sorted positions per chromosome (chromosomes with or without "chr")
+    """
+
+    prefix = f'{file}.index'
+    if os.path.exists(f'{prefix}.index.json'):
+        return VariantIndex.load(prefix)
+    index = VariantIndex.from_file(file)
+    index.save(prefix)
+    return index
+
+
+def load_annotations(bundle_dir=None):
+    """
+    Load the mappability, blacklisted regions and population variants annotations
+    Args:
+        bundle_dir (path): annotations bundle built with annotation_bundle.py. If None, the annotations are
+            loaded from the default files
+
+    Returns:
+        mappable_regions_mask (GenomeMask): mappable regions
+        blacklisted_regions_mask (GenomeMask): blacklisted regions
+        variation_index (VariantIndex): population variants
+    """
+
+    if bundle_dir is not None:
+        bundle = AnnotationBundle.open(bundle_dir)
+        return bundle.mappable, bundle.blacklisted, bundle.variation
+
+    return load_mappability(mappable_regions), load_mappability(blacklisted_regions), load_variation(population_variants)
+
+
+def all_nucleotides(sequences):
+    """Whether all the characters of each sequence (pandas.Series) are nucleotides"""
+
+    return sequences.str.match(f'^[{nucleotides}]*$', na=False).values.astype(bool)
+
+
+def filter_mutations(mutations_df, reference, mappable_regions_mask, blacklisted_regions_mask, variation_index):
+    """
+    Apply the filters to a batch of mutations
+    Args:
+        mutations_df (pandas.DataFrame): mutations with CHROMOSOME, POSITION, REF, ALT and ALT_TYPE columns
+        reference (Reference): reference genome
+        mappable_regions_mask (GenomeMask): mappable regions
+        blacklisted_regions_mask (GenomeMask): blacklisted regions
+        variation_index (VariantIndex): population variants
+
+    Returns:
+        passed (numpy.ndarray): whether each mutation passes all the filters
+        muttype (numpy.ndarray): mutation type of each mutation (snv, mnv, ins or del)
+    """
+
+    chrom = mutations_df['CHROMOSOME'].astype(str).values
+    pos = mutations_df['POSITION'].values.astype(np.int64)
+    ref = mutations_df['REF']
+    alt = mutations_df['ALT']
+    alt_type = mutations_df['ALT_TYPE'].values
+
+    # Read mutations in autosomal + sexual chromosomes, with ref != alt
+    selected = np.isin(chrom, chromosomes) & (ref.values != alt.values)
+
+    # Mutation types
+    snv = selected & (alt_type == 'snp')
+    mnv = selected & (alt_type == 'mnp')
+    indel = selected & (alt_type == 'indel')
+    ins = indel & (ref.values == '-')
+    dele = indel & ~ins & (alt.values == '-')
+    muttype = np.select([snv, mnv, ins, dele], ['snv', 'mnv', 'ins', 'del'], default='')
+
+    # Complex indels (and unknown types) are removed
+    fail_filters = selected & ~(snv | mnv | ins | dele)
+
+    # Alternate filter
+    fail_filters |= snv & ~alt.isin(nucleotides_substrings).values
+    fail_filters |= (mnv | ins) & ~all_nucleotides(alt)
+    fail_filters |= dele & ~all_nucleotides(ref)
+
+    # Reference, context, mappability and population variants filters
+    is_mappable = np.zeros(len(chrom), dtype=bool)
+    for c in pd.unique(chrom[selected]):
+        rows = np.flatnonzero(selected & (chrom == c))
+
+        # Reference filter (the reference of substitutions is a single base)
+        check_ref = rows[(snv | mnv | dele)[rows]]
+        fail_filters[check_ref] |= ~reference.matches(c, pos[check_ref], ref.values[check_ref])
+        fail_filters[rows] |= snv[rows] & (ref.str.len().values[rows] != 1)
+
+        # Context filter
+        check_context = rows[(snv | mnv | ins | dele)[rows]]
+        pentamer = reference.windows(c, pos[check_context] - 2, 5)
+        fail_filters[check_context] |= ~valid_bases[pentamer].all(axis=1)
+
+        # Intersect mappability
+        is_mappable[rows] = mappable_regions_mask.contains(c, pos[rows])
+        fail_filters[rows] |= blacklisted_regions_mask.contains(c, pos[rows])
+
+        # Intersect population variants
+        fail_filters[rows] |= variation_index.contains(c, pos[rows])
+
+    passed = selected & is_mappable & ~fail_filters
+
+    return passed, muttype
+
+
+def read_batches(input_file, chunksize):
+    """
+    Read the mutations of a cohort in batches, parsed in the same way as HotspotFinder
+    Args:
+        input_file (path): somatic mutations file
+        chunksize (int): number of mutations per batch
+
+    Yields:
+        mutations_df (pandas.DataFrame): mutations with CHROMOSOME, POSITION, REF, ALT, ALT_TYPE and SAMPLE columns
     """
 
-    set_of_interest = set()
-    trim = 3 if chr_format == 'chrN' else None
-    with gzip.open(file, 'rt') as fd:
-        for line in fd:
-            chrom, position = line.strip().split('\t')[:2]
-            set_of_interest.add(f'{chrom[trim:]}_{position}')
-    return set_of_interest
+    columns = ['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'ALT_TYPE', 'SAMPLE']
+    rows = readers.variants(
+        file=input_file,
+        required=['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE']
+    )
+    while True:
+        chunk = [[row[c] for c in columns] for row in islice(rows, chunksize)]
+        if not chunk:
+            break
+        yield pd.DataFrame(chunk, columns=columns)
+
+
+def passed_mutations(mutations_df, passed, muttype):
+    """Mutations passing the filters with the columns of the output file (as strings)"""
+
+    passed_df = mutations_df.loc[passed, ['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE']].astype(str)
+    passed_df['MUTYPE'] = muttype[passed]
+
+    return passed_df.reset_index(drop=True)
 
 
 @click.command()
 @click.option('-i', '--input-file', default=None, type=click.Path(exists=True),
               help='User input file containing somatic mutations in TSV format')
 @click.option('-o', '--output-file', default=None, help='Output file')
-def main(input_file, output_file):
+@click.option('--chunksize', default=100000, type=int, help='Number of mutations filtered at once')
+@click.option('-a', '--annotations', default=None, type=click.Path(exists=True),
+              help='Annotations bundle built with annotation_bundle.py build-annotations')
+def main(input_file, output_file, chunksize, annotations):
     """Filter a cohort of mutations using HotspotFinder filters"""
 
     # Load data
-    # Mappability data
-    mappable_regions_tree = load_mappability(mappable_regions)
-    blacklisted_regions_tree = load_mappability(blacklisted_regions)
+    # Mappability and variation data
+    mappable_regions_mask, blacklisted_regions_mask, variation_index = load_annotations(annotations)
 
-    # Variation data
-    variation_data_set = load_variation(population_variants)
+    # Reference genome
+    reference = Reference(genome)
 
     # Read and filter cohort mutations
+    # Mutations parsed in the same way as HotspotFinder
+    # Read mutations in autosomal + sexual chromosomes
+    # Mutations that ref != alt are kept
+    # Mutations that ref == bgreference are kept
+    # Mutations that don't have N in alt/ref nor 5-mer context are kept
+    # Complex indels removed
     total_mut = 0
     pass_mut = 0
     fail_mut = 0
     header = ['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE', 'MUTYPE']
     with gzip.open(output_file, 'wt') as ofd:
         ofd.write('{}\n'.format('\t'.join(header)))
-        for row in readers.variants(
-                file=input_file,
-                required=['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE']
-        ):
-            chrom = row['CHROMOSOME']
-            pos = row['POSITION']
-            chr_pos = f'{chrom}_{pos}'
-            ref = row['REF']
-            alt = row['ALT']
-            alt_type = row['ALT_TYPE']
-            sample = row['SAMPLE']
-            total_mut += 1
-
-            # Mutations parsed in the same way as HotspotFinder
-            # Read mutations in autosomal + sexual chromosomes
-            # Mutations that ref != alt are kept
-            # Mutations that ref == bgreference are kept
-            # Mutations that don't have N in alt/ref nor 5-mer context are kept
-            # Complex indels removed
-
-            if chrom in set(chromosomes) and ref != alt:
-                fail_filters = 0
-
-                # Read mutations
-                # Read substitutions
-                if alt_type == 'snp':
-                    muttype = 'snv'
-                    # Reference filter
-                    if ref != bgref.refseq(genome, chrom, pos, 1):
-                        fail_filters += 1
-                    # Alternate filter
-                    if alt not in nucleotides:
-                        fail_filters += 1
-                    # Context filter
-                    pentamer_sequence = bgref.refseq(genome, chrom, pos - 2, 5)
-                    if len(pentamer_sequence) != len(
-                            [i for i in pentamer_sequence if i in nucleotides]):
-                        fail_filters += 1
-
-                # Read MNVs
-                elif alt_type == 'mnp':
-                    muttype = 'mnv'
-                    # Reference filter
-                    if ref != bgref.refseq(genome, chrom, pos, len(ref)):
-                        fail_filters += 1
-                    # Alternate filter
-                    if len(alt) != len([i for i in alt if i in nucleotides]):
-                        fail_filters += 1
-                    # Context filter
-                    pentamer_sequence = bgref.refseq(genome, chrom, pos - 2, 5)
-                    if len(pentamer_sequence) != len(
-                            [i for i in pentamer_sequence if i in nucleotides]):
-                        fail_filters += 1
-
-                # Read indels
-                elif alt_type == 'indel':
-
-                    # Simple insertions (e.g, G>GA, G>GAAA)
-                    if ref == '-':
-                        muttype = 'ins'
-                        # Alternate filter
-                        if len(alt) != len([i for i in alt if i in nucleotides]):
-                            fail_filters += 1
-                        # Context filter
-                        pentamer_sequence = bgref.refseq(genome, chrom, pos - 2, 5)
-                        if len(pentamer_sequence) != len(
-                                [i for i in pentamer_sequence if i in nucleotides]):
-                            fail_filters += 1
-
-                    # Simple deletions (e.g, GT>G, GTG>G)
-                    elif alt == '-':
-                        muttype = 'del'
-                        # Reference filter
-                        if ref != bgref.refseq(genome, chrom, pos, len(ref)):
-                            fail_filters += 1
-                            # Alternate filter
-                        if len(ref) != len([i for i in ref if i in nucleotides]):
-                            fail_filters += 1
-                        # Context filter
-                        pentamer_sequence = bgref.refseq(genome, chrom, pos - 2, 5)
-                        if len(pentamer_sequence) != len(
-                                [i for i in pentamer_sequence if i in nucleotides]):
-                            fail_filters += 1
-                    # Complex indels
-                    else:
-                        fail_filters += 1
-
-                # Intersect mappability
-                is_mappable = False
-                for _ in mappable_regions_tree[chrom][int(pos)]:
-                    is_mappable = True
-                    break
-                for _ in blacklisted_regions_tree[chrom][int(pos)]:
-                    fail_filters += 1
-                    break
-
-                # Intersect population variants
-                if {chr_pos}.intersection(variation_data_set):
-                    fail_filters += 1
-
-                # Write mutation if all filters are pass
-                if is_mappable and fail_filters == 0:
-                    pass_mut += 1
-                    ofd.write('{}\n'.format('\t'.join(list(map(str, [chrom, pos, ref, alt, sample, muttype])))))
-                else:
-                    fail_mut += 1
-            else:
-                fail_mut += 1
+        for mutations_df in read_batches(input_file, chunksize):
+            passed, muttype = filter_mutations(
+                mutations_df, reference, mappable_regions_mask, blacklisted_regions_mask, variation_index)
+
+            # Write mutations if all filters are pass
+            passed_mutations(mutations_df, passed, muttype).to_csv(ofd, sep='\t', header=False, index=False)
+            total_mut += len(mutations_df)
+            pass_mut += int(passed.sum())
+            fail_mut += len(mutations_df) - int(passed.sum())
 
     with open(output_file + '.log', 'w') as ofd:
         for name, info in [('TOTAL', total_mut), ('PASS', pass_mut), ('FAIL', fail_mut)]:
@@ -195,4 +239,3 @@ def main(input_file, output_file):
 
 if __name__ == '__main__':
     main()
-
@@ -1,7 +1,10 @@
 """Merge somatic mutations from individual cohorts into a cancer type"""
 
+from concurrent.futures import ThreadPoolExecutor
 import os
 import gzip
+import queue
+import threading
 
 from bgparsers import readers
 import click
@@ -11,6 +14,144 @@ chromosomes = list(map(str, range(1, 23))) + ['X', 'Y']
 genome = 'hg38'
 nucleotides = 'ACGT'
 
+header = [
+    'CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE',
+    'COHORT', 'CANCER_TYPE', 'PLATFORM', 'TYPE', 'AGE', 'TREATED', 'MUTYPE'
+]
+annotations = ['PLATFORM', 'TYPE', 'AGE', 'TREATED']
+
+
+def cohort_file(input_directory, cohort):
+    """Mutations file of a cohort in a directory of raw or filtered cohorts"""
+
+    files_type = input_directory.rstrip('/').split('/')[-1]
+    if files_type == 'cohorts_raw':
+        if 'HARTWIG' in cohort:
+            sufix = '.in.tsv.gz'
+        else:
+            sufix = '.in.gz'
+    elif files_type == 'cohorts_filtered':
+        sufix = '.filtered.in.gz'
+    else:
+        raise ValueError(f'Unknown cohorts directory {input_directory} (expected cohorts_raw or cohorts_filtered)')
+
+    return os.path.join(input_directory, f'{cohort}{sufix}')
+
+
+def read_cohort(file, chunksize):
+    """
+    Read the mutations of a filtered cohort (written by filter_cohorts.py) in chunks
+    Args:
+        file (path): cohort mutations file
+        chunksize (int): number of mutations read at once
+
+    Returns:
+        chunks (iterator): dataframes with CHROMOSOME, POSITION, REF, ALT, SAMPLE and MUTYPE columns
+    """
+
+    return pd.read_csv(file, sep='\t', header=0, dtype=str, keep_default_na=False, chunksize=chunksize,
+                       usecols=['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE', 'MUTYPE'])
+
+
+def queue_chunks(file, chunksize, chunks_queue, stop):
+    """Put the chunks of a cohort in a bounded queue, followed by None (or the exception raised reading them)"""
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for chunk in read_cohort(file, chunksize):
+            if not put(chunk):
+                return
+    except Exception as e:
+        put(e)
+        return
+    put(None)
+
+
+def cohort_annotations(cohorts_annotations_df, cohorts, cancertype):
+    """Annotations (and cancer type) of each cohort indexed by cohort, formatted as in the row by row merge"""
+
+    annotations_df = cohorts_annotations_df.drop_duplicates(subset='COHORT').set_index('COHORT')
+    annotations_df = annotations_df.reindex(cohorts)[annotations]
+    for column in annotations:
+        annotations_df[column] = [str(v) for v in annotations_df[column].tolist()]
+    annotations_df['CANCER_TYPE'] = str(cancertype)
+
+    return annotations_df
+
+
+def merge_bulk(input_directory, cohorts_annotations_df, cancertype, output_file, cohorts, output_format='tsv',
+               cores=1, chunksize=1000000, queue_size=2):
+    """
+    Merge cohorts reading each file in columnar chunks. Cohort files are read by several threads at once (in the
+    order of the cohorts, at most cores files at once), each into a queue of at most queue_size chunks, so at most
+    cores * (queue_size + 1) chunks are in memory
+    Args:
+        input_directory (path): directory of filtered cohorts
+        cohorts_annotations_df (pandas.DataFrame): cohort annotations
+        cancertype (str): cancer type name
+        output_file (path): output gzip TSV file, or output directory of the Parquet files (one partition per
+            cohort, COHORT=<cohort>/part-<n>.parquet)
+        cohorts (list): cohorts to merge
+        output_format (str): tsv or parquet
+        cores (int): number of files read at once
+        chunksize (int): number of mutations read at once
+        queue_size (int): number of chunks read ahead per file
+    """
+
+    annotations_df = cohort_annotations(cohorts_annotations_df, cohorts, cancertype)
+
+    if output_format == 'tsv':
+        ofd = gzip.open(output_file, 'wt')
+        ofd.write('{}\n'.format('\t'.join(header)))
+    else:
+        os.makedirs(output_file, exist_ok=True)
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in cohorts]
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=cores) as executor:
+        try:
+            for i in range(min(cores, len(cohorts))):
+                executor.submit(queue_chunks, cohort_file(input_directory, cohorts[i]), chunksize, queues[i], stop)
+            for i, cohort in enumerate(cohorts):
+                n = 0
+                while True:
+                    chunk = queues[i].get()
+                    if chunk is None:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    chunk['COHORT'] = cohort
+                    chunk = chunk.join(annotations_df, on='COHORT')[header]
+                    if output_format == 'tsv':
+                        chunk.to_csv(ofd, sep='\t', header=False, index=False)
+                    else:
+                        partition = os.path.join(output_file, f'COHORT={cohort}')
+                        os.makedirs(partition, exist_ok=True)
+                        chunk['POSITION'] = chunk['POSITION'].astype('int64')
+                        chunk.drop(columns='COHORT').to_parquet(os.path.join(partition, f'part-{n}.parquet'),
+                                                                index=False)
+                    n += 1
+                queues[i] = None
+                if i + cores < len(cohorts):
+                    executor.submit(queue_chunks, cohort_file(input_directory, cohorts[i + cores]), chunksize,
+                                    queues[i + cores], stop)
+                print(f'{cohort}\tdone')
+        finally:
+            # Readers waiting on a full queue stop if the merge fails
+            stop.set()
+
+    if output_format == 'tsv':
+        ofd.close()
+
+
 @click.command()
 @click.option('-i', '--input-directory', default=None, help='Input directory where cohorts are')
 @click.option('-a', '--cohorts-annotations', default=None, help='File containing cohort data')
@@ -18,18 +159,33 @@ nucleotides = 'ACGT'
               help='Cancer type name')
 @click.option('-o', '--output-file', default=None, help='Output file')
 @click.option('-co', '--cohort', default=None, multiple=True, type=click.STRING, help='Cohort to merge')
-def main(input_directory, cohorts_annotations, cancertype, output_file, cohort):
+@click.option('--bulk', is_flag=True,
+              help='Read filtered cohorts in columnar chunks (several files at once with --cores)')
+@click.option('-f', '--output_format', default='tsv', type=click.Choice(['tsv', 'parquet']),
+              help='Output format of the bulk merge (parquet writes a directory partitioned by cohort)')
+@click.option('--cores', default=1, type=int, help='Number of cohort files read at once in the bulk merge')
+@click.option('--chunksize', default=1000000, type=int, help='Number of mutations read at once in the bulk merge')
+def main(input_directory, cohorts_annotations, cancertype, output_file, cohort, bulk, output_format, cores, chunksize):
     """Merge cohorts into cancer types"""
 
     cohorts = set(cohort)
 
     cohorts_annotations_df = pd.read_csv(cohorts_annotations, sep='\t', header=0)
-    files_type = input_directory.split('/')[-1]
 
-    header = [
-        'CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE',
-        'COHORT', 'CANCER_TYPE', 'PLATFORM', 'TYPE', 'AGE', 'TREATED', 'MUTYPE'
-    ]
+    if bulk:
+        if input_directory.rstrip('/').split('/')[-1] != 'cohorts_filtered':
+            raise click.UsageError('The bulk merge reads filtered cohorts (cohorts_filtered directory)')
+        if output_format == 'parquet':
+            try:
+                pd.io.parquet.get_engine('auto')
+            except ImportError:
+                raise click.UsageError('-f parquet requires pyarrow or fastparquet (see env.yaml)')
+        merge_bulk(input_directory, cohorts_annotations_df, cancertype, output_file, list(dict.fromkeys(cohort)),
+                   output_format, cores, chunksize)
+        return
+    elif output_format != 'tsv':
+        raise click.UsageError('Parquet output requires --bulk')
+
     with gzip.open(output_file, 'wt') as ofd:
         ofd.write('{}\n'.format('\t'.join(header)))
 
@@ -40,15 +196,7 @@ def main(input_directory, cohorts_annotations, cancertype, output_file, cohort):
             age = list(cohort_info_df['AGE'])[0]
             treated = list(cohort_info_df['TREATED'])[0]
 
-            if files_type == 'cohorts_raw':
-                if 'HARTWIG' in cohort:
-                    sufix = '.in.tsv.gz'
-                else:
-                    sufix = '.in.gz'
-            elif files_type == 'cohorts_filtered':
-                sufix = '.filtered.in.gz'
-
-            cohort_mutations_file = os.path.join(input_directory, f'{cohort}{sufix}')
+            cohort_mutations_file = cohort_file(input_directory, cohort)
             for row in readers.variants(
                     file=cohort_mutations_file,
                     required=['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE'],
@@ -2,27 +2,53 @@
 
 from collections import defaultdict
 import gzip
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'mappable_genome'))
 
 from bgparsers import readers
 import click
 from intervaltree import IntervalTree
 
+from annotation_bundle import AnnotationBundle
+
+
+def load_drivers(drivers_f):
+    """Driver regions (1-based CHR, START, END with header) as interval trees per chromosome"""
+
+    tree = defaultdict(IntervalTree)
+    with open(drivers_f, 'r') as fd:
+        next(fd)
+        for line in fd:
+            chrom, start, end = line.strip().split('\t')
+            tree[chrom].addi(int(start), int(end) + 1)  # +1 open end
+
+    return tree
+
 @click.command()
 @click.option('-m', '--mutations_f', default=None, help='Input file containing somatic mutation of a cancer type')
 @click.option('-d', '--drivers_f', default=None, help='Driver genes regions')
 @click.option('-o', '--output_f', default=None, help='Output file')
-def main(mutations_f, drivers_f, output_f):
+@click.option('-a', '--annotations', default=None, type=click.Path(exists=True),
+              help='Annotations bundle with the driver regions (instead of --drivers_f)')
+def main(mutations_f, drivers_f, output_f, annotations):
     """
     Remove mutations in cancer drivers
     """
 
     # Load driver regions
-    tree = defaultdict(IntervalTree)
-    with open(drivers_f, 'r') as fd:
-        next(fd)
-        for line in fd:
-            chrom, start, end = line.strip().split('\t')
-            tree[chrom].addi(int(start), int(end) + 1)  # +1 open end
+    if annotations is not None:
+        drivers_mask = AnnotationBundle.open(annotations).drivers
+        if drivers_mask is None:
+            raise click.BadParameter(f'Bundle {annotations} does not have driver regions', param_hint='annotations')
+        in_drivers = drivers_mask.contains_position
+    elif drivers_f is not None:
+        tree = load_drivers(drivers_f)
+
+        def in_drivers(chrom, pos):
+            return bool(tree[chrom][int(pos)])
+    else:
+        raise click.UsageError('Missing driver regions: use --drivers_f or --annotations')
     print('Genomic regions loaded')
 
     header = ['CHROMOSOME', 'POSITION', 'REF', 'ALT', 'SAMPLE', 'COHORT', 'CANCER_TYPE', 'PLATFORM', 'TYPE', 'AGE',
@@ -39,7 +65,7 @@ def main(mutations_f, drivers_f, output_f):
             chrom = row['CHROMOSOME']
             pos = row['POSITION']
 
-            if tree[chrom][int(pos)]:
+            if in_drivers(chrom, pos):
                 continue
             else:
                 ofd.write('{}\n'.format('\t'.join([chrom, str(pos)] + [row[c] for c in extra_cols])))